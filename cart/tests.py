@@ -1,3 +1,88 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from products.models import PackVariant, Product
+from .utils import CART_SESSION_KEY, resolve_cart
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    }
+)
+class VariantCartTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Huye", sku="HUY-1", cost_price=Decimal("8.00"), weight_grams=250
+        )
+        self.small = PackVariant.objects.create(
+            product=self.product,
+            name="250g",
+            sku="HUY-250",
+            pack_weight_grams=250,
+            price=Decimal("9.50"),
+        )
+        self.large = PackVariant.objects.create(
+            product=self.product,
+            name="1kg",
+            sku="HUY-1000",
+            pack_weight_grams=1000,
+            price=Decimal("32.00"),
+        )
+        self.url = reverse("cart:add", kwargs={"slug": self.product.slug})
+
+    def test_each_variant_is_its_own_priced_line(self):
+        self.client.post(self.url, {"variant": self.small.pk, "quantity": 2})
+        self.client.post(
+            self.url, {"variant": self.large.pk, "quantity": 1, "grind": "filter"}
+        )
+        self.client.post(self.url, {"variant": self.small.pk, "quantity": 1})
+        self.client.post(self.url, {"quantity": 1})
+
+        cart = self.client.session[CART_SESSION_KEY]
+        self.assertEqual(len(cart), 3)
+        small = cart[f"{self.product.slug}__v{self.small.pk}"]
+        large = cart[f"{self.product.slug}__v{self.large.pk}"]
+        self.assertEqual(
+            (small["quantity"], small["price"], small["weight_grams"]), (3, "9.50", 250)
+        )
+        self.assertEqual(
+            (large["sku"], large["variant_label"], large["grind"]),
+            ("HUY-1000", "1kg", "filter"),
+        )
+        self.assertEqual(cart[self.product.slug]["variant_id"], None)
+
+    def test_variant_of_another_product_is_rejected(self):
+        other = Product.objects.create(
+            name="Other", sku="OTH-1", cost_price=Decimal("8.00")
+        )
+        foreign = PackVariant.objects.create(
+            product=other, name="250g", sku="OTH-250", price=Decimal("5.00")
+        )
+        self.assertEqual(
+            self.client.post(self.url, {"variant": foreign.pk}).status_code, 404
+        )
+
+    def test_resolve_cart_reprices_in_bulk_and_drops_inactive_lines(self):
+        for variant in (self.small, self.large):
+            self.client.post(self.url, {"variant": variant.pk})
+        self.client.post(self.url, {"quantity": 1})
+        cart = self.client.session[CART_SESSION_KEY]
+        PackVariant.objects.filter(pk=self.small.pk).update(price=Decimal("10.00"))
+        PackVariant.objects.filter(pk=self.large.pk).update(is_active=False)
+
+        with self.assertNumQueries(2):
+            lines, removed = resolve_cart(cart)
+        self.assertEqual(removed, ["Huye"])
+        self.assertEqual(
+            lines[f"{self.product.slug}__v{self.small.pk}"], (self.product, self.small)
+        )
+        self.assertEqual(
+            cart[f"{self.product.slug}__v{self.small.pk}"]["price"], "10.00"
+        )
+        self.assertEqual(len(cart), 2)
@@ -1,5 +1,7 @@
 from decimal import Decimal, ROUND_HALF_UP
 
+from products.models import PackVariant, Product
+
 CART_SESSION_KEY = "cart"
 FREE_SHIPPING_THRESHOLD = Decimal("39.00")
 FLAT_SHIPPING = Decimal("4.90")
@@ -23,6 +25,81 @@ def cart_from_session(session) -> dict:
     return cart
 
 
+def cart_key(product_slug: str, variant_id=None) -> str:
+    """Session key of a cart line; each pack variant of a product is its own line."""
+    return f"{product_slug}__v{variant_id}" if variant_id else product_slug
+
+
+def cart_line(product, variant=None, grind: str = "whole") -> dict:
+    """A new (empty) cart line for ``product``, priced from ``variant`` if given."""
+    key = cart_key(product.slug, variant.pk if variant else None)
+    return {
+        "key": key,
+        "slug": key,
+        "product_slug": product.slug,
+        "variant_id": variant.pk if variant else None,
+        "name": product.name,
+        "price": str(variant.price if variant else product.price),
+        "quantity": 0,
+        "grind": grind,
+        "weight_grams": variant.pack_weight_grams if variant else product.weight_grams,
+        "sku": variant.sku if variant else product.sku,
+        "variant_label": variant.name if variant else "",
+        "image_url": product.image.url if product.image else "",
+    }
+
+
+def resolve_cart(cart: dict):
+    """
+    Load the products and pack variants behind ``cart`` (variants in one
+    ``select_related`` query, plain products in one more) and refresh each
+    line's price, weight, SKU and label from them. Lines whose product or
+    variant is gone or inactive are removed from ``cart``.
+
+    Returns ``({key: (product, variant_or_None)}, [names of removed lines])``.
+    """
+    variant_ids = {
+        item["variant_id"] for item in cart.values() if item.get("variant_id")
+    }
+    product_slugs = {
+        item.get("product_slug") or key
+        for key, item in cart.items()
+        if not item.get("variant_id")
+    }
+    variants = {}
+    if variant_ids:
+        variants = PackVariant.objects.select_related("product").filter(
+            pk__in=variant_ids, is_active=True, product__is_active=True
+        ).in_bulk()
+    products = {}
+    if product_slugs:
+        products = Product.objects.filter(
+            slug__in=product_slugs, is_active=True
+        ).in_bulk(field_name="slug")
+
+    resolved, removed = {}, []
+    for key, item in list(cart.items()):
+        variant = variants.get(item.get("variant_id"))
+        product = (
+            variant.product
+            if variant
+            else products.get(item.get("product_slug") or key)
+        )
+        if product is None or (item.get("variant_id") and variant is None):
+            removed.append(item.get("name") or key)
+            del cart[key]
+            continue
+        fresh = cart_line(product, variant, item.get("grind") or "whole")
+        item.update(
+            {
+                field: fresh[field]
+                for field in ("price", "weight_grams", "sku", "variant_label", "name")
+            }
+        )
+        resolved[key] = (product, variant)
+    return resolved, removed
+
+
 def compute_summary(cart: dict):
     """
     Build normalized items with computed line totals,
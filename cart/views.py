@@ -2,9 +2,14 @@ from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect, render
 
 from orders.models import Order
-from products.models import Product
-from .utils import CART_SESSION_KEY, cart_from_session, compute_summary, grind_label
-
+from products.models import PackVariant, Product
+from .utils import (
+    CART_SESSION_KEY,
+    cart_from_session,
+    cart_line,
+    compute_summary,
+    grind_label,
+)
 
 def cart_detail(request):
     cart = cart_from_session(request.session)
@@ -30,34 +35,24 @@ def cart_add(request, slug):
     qty = int(request.POST.get("quantity", 1))
     grind = (request.POST.get("grind") or "whole").strip()
 
-    price = product.price
-    weight = product.weight_grams
-    sku = product.sku
+    variant = None
+    variant_id = request.POST.get("variant")
+    if variant_id:
+        variant = get_object_or_404(
+            PackVariant, pk=variant_id, product=product, is_active=True
+        )
 
-    key = product.slug
+    line = cart_line(product, variant, grind)
+    key = line["key"]
     if key not in cart:
-        cart[key] = {
-            "key": key,
-            "slug": key,
-            "product_slug": product.slug,
-            "name": product.name,
-            "price": str(price),
-            "quantity": 0,
-            "grind": grind,
-            "weight_grams": weight,
-            "sku": sku,
-            "variant_label": "",
-            "image_url": product.image.url if product.image else "",
-        }
+        cart[key] = line
     cart[key]["quantity"] += qty
     cart[key]["grind"] = grind
-    cart[key]["price"] = str(price)
-    cart[key]["weight_grams"] = weight
-    cart[key]["sku"] = sku
-    cart[key]["variant_label"] = ""
+    for field in ("price", "weight_grams", "sku", "variant_id", "variant_label"):
+        cart[key][field] = line[field]
     request.session.modified = True
 
-    label = product.name
+    label = f"{product.name} ({variant.name})" if variant else product.name
     messages.success(request, f"Added {qty} x {label} to cart.")
     return redirect("cart:detail")
 
@@ -94,23 +89,13 @@ def buy_again(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
     cart = cart_from_session(request.session)
 
-    for item in order.items.all():
+    for item in order.items.select_related("product", "variant"):
         product = item.product
-        key = product.slug
+        variant = item.variant if item.variant and item.variant.is_active else None
+        line = cart_line(product, variant, getattr(item, "grind", "whole") or "whole")
+        key = line["key"]
         if key not in cart:
-            cart[key] = {
-                "key": key,
-                "slug": key,
-                "product_slug": product.slug,
-                "name": product.name,
-                "price": str(product.price),
-                "quantity": 0,
-                "grind": getattr(item, "grind", "whole"),
-                "weight_grams": product.weight_grams,
-                "sku": product.sku,
-                "variant_label": "",
-                "image_url": product.image.url if product.image else "",
-            }
+            cart[key] = line
         cart[key]["quantity"] += item.quantity
         if hasattr(item, "grind"):
             cart[key]["grind"] = item.grind
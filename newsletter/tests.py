@@ -1,3 +1,16 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import Subscriber
+
+
+class SubscribeViewTests(TestCase):
+    def test_subscribe_is_post_only(self):
+        url = reverse("newsletter:subscribe")
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        response = self.client.post(
+            url, {"email": "reader@example.com"}, HTTP_REFERER="/shop/"
+        )
+        self.assertRedirects(response, "/shop/", fetch_redirect_response=False)
+        self.assertTrue(Subscriber.objects.filter(email="reader@example.com").exists())
@@ -1,12 +1,13 @@
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.views.decorators.http import require_POST
 from .models import Subscriber
 
 
+@require_POST
 def subscribe(request):
-    if request.method == "POST":
-        email = request.POST.get("email")
-        if email:
-            Subscriber.objects.get_or_create(email=email)
-            messages.success(request, "Thank you for subscribing!")
-        return redirect(request.META.get("HTTP_REFERER", "/"))
\ No newline at end of file
+    email = request.POST.get("email")
+    if email:
+        Subscriber.objects.get_or_create(email=email)
+        messages.success(request, "Thank you for subscribing!")
+    return redirect(request.META.get("HTTP_REFERER", "/"))
@@ -1,13 +1,13 @@
-from django.conf import settings
 from django.contrib import admin, messages
 from django.urls import reverse
 from django.utils.html import format_html
-import stripe
-
-from .models import Order, OrderItem
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
+from .models import Order, OrderItem, OrderItemCost, ProcessedWebhookEvent
+from .reconcile import (
+    apply_payment_intents,
+    fetch_payment_intents,
+    open_orders_with_intents,
+)
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -40,26 +40,15 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.action(description="Reconcile selected orders with Stripe")
 def reconcile_with_stripe(modeladmin, request, queryset):
-    updated = 0
-    for order in queryset:
-        if not order.payment_intent_id:
-            continue
-        try:
-            payment_intent = stripe.PaymentIntent.retrieve(order.payment_intent_id)
-        except Exception:
-            continue
-        if payment_intent.status == "succeeded" and order.status != "paid":
-            for order_item in order.items.select_related("product").all():
-                product = order_item.product
-                if product and product.stock is not None:
-                    new_stock = max(0, product.stock - order_item.quantity)
-                    if new_stock != product.stock:
-                        product.stock = new_stock
-                        product.save(update_fields=["stock"])
-            order.status = "paid"
-            order.save(update_fields=["status"])
-            updated += 1
-    messages.info(request, f"Reconciled {updated} order(s).")
+    intent_ids = list(
+        open_orders_with_intents(queryset).values_list("payment_intent_id", flat=True)
+    )
+    result = apply_payment_intents(fetch_payment_intents(intent_ids))
+    messages.info(
+        request,
+        f"Reconciled {len(result['paid_order_ids'])} order(s); "
+        f"{result['cancelled']} cancelled.",
+    )
 
 
 @admin.register(Order)
@@ -97,3 +86,36 @@ class OrderAdmin(admin.ModelAdmin):
     def picklist_pdf_link(self, obj):
         url = reverse("orders:order_picklist_pdf", args=[obj.id])
         return format_html('<a class="button" href="{}" target="_blank">📄 PDF Picklist</a>', url)
+
+
+@admin.register(ProcessedWebhookEvent)
+class ProcessedWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "event_type", "processed_at")
+    list_filter = ("event_type",)
+    search_fields = ("event_id",)
+    readonly_fields = ("event_id", "event_type", "processed_at")
+
+
+@admin.register(OrderItemCost)
+class OrderItemCostAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "order",
+        "order_item",
+        "product",
+        "batch",
+        "grams",
+        "unit_cost",
+    )
+    search_fields = ("product__name", "product__sku")
+    list_select_related = ("order", "order_item", "product", "batch")
+    date_hierarchy = "created_at"
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,242 @@
+"""
+Cost of goods sold and margins per order line.
+
+Fulfilment takes each product's grams from its batches FIFO and books one
+``CONSUMPTION`` movement per batch. ``record_order_costs`` splits those
+movements over the order's lines, in line order, and stores one
+``OrderItemCost`` per line and batch with a single ``bulk_create``.
+
+``margin_report`` aggregates revenue and cost of fulfilled, costed orders
+in SQL per product, month or order. ``monthly_margins`` caches one rollup per
+calendar month; saving or costing an order drops its month.
+"""
+
+from collections import defaultdict, deque
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DateField, Exists, ExpressionWrapper, F, OuterRef, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from products.models import GRAMS_TO_KG, MONEY_AGGREGATE, StockMovement
+from versohnung_und_vergebung_kaffee.metrics import record_cache_lookup
+from .models import Order, OrderItem, OrderItemCost
+
+# Orders whose goods left the warehouse (and so have a cost).
+MARGIN_STATUSES = {"fulfilled"}
+MARGIN_GROUPS = ("product", "month", "order")
+MONTHLY_MARGIN_KEY = "orders:margins:{:%Y-%m}"
+CENT = Decimal("0.01")
+
+LINE_REVENUE = ExpressionWrapper(
+    F("unit_price") * F("quantity"), output_field=MONEY_AGGREGATE
+)
+LINE_COST = ExpressionWrapper(
+    F("grams") * F("unit_cost") * GRAMS_TO_KG, output_field=MONEY_AGGREGATE
+)
+
+
+def _month(moment) -> date:
+    local = timezone.localtime(moment) if timezone.is_aware(moment) else moment
+    return date(local.year, local.month, 1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _previous_month(month: date) -> date:
+    return date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+
+
+def record_order_costs(order_ids) -> int:
+    """
+    (Re)build the cost ledger of ``order_ids`` from their consumption
+    movements. Returns how many rows were written.
+    """
+    order_ids = list(order_ids)
+    # (order_id, product_id) -> deque of [item_id, grams still to cost]
+    lines = defaultdict(deque)
+    items = (
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values_list(
+            "order_id",
+            "product_id",
+            "pk",
+            "quantity",
+            "weight_grams",
+            "product__weight_grams",
+        )
+        .order_by("order_id", "pk")
+    )
+    for order_id, product_id, pk, quantity, weight, product_weight in items:
+        grams = (weight or product_weight or 0) * (quantity or 0)
+        lines[order_id, product_id].append([pk, grams])
+
+    consumed = (
+        StockMovement.objects.filter(
+            order_id__in=order_ids, kind=StockMovement.CONSUMPTION
+        )
+        .values_list(
+            "order_id",
+            "product_id",
+            "batch_id",
+            "batch__unit_cost",
+            "on_hand_grams",
+            "created_at",
+        )
+        .order_by("pk")
+    )
+    rows = []
+    for order_id, product_id, batch_id, unit_cost, on_hand, created_at in consumed:
+        queue, grams = lines.get((order_id, product_id)), -on_hand
+        while queue and grams > 0:
+            line = queue[0]
+            # The last line of the product absorbs anything beyond its grams.
+            take = grams if len(queue) == 1 else min(line[1], grams)
+            if take:
+                rows.append(OrderItemCost(
+                    order_id=order_id,
+                    order_item_id=line[0],
+                    product_id=product_id,
+                    batch_id=batch_id,
+                    grams=take,
+                    unit_cost=unit_cost or 0,
+                    created_at=created_at,
+                ))
+            grams -= take
+            line[1] -= take
+            if line[1] <= 0 and len(queue) > 1:
+                queue.popleft()
+
+    with transaction.atomic():
+        OrderItemCost.objects.filter(order_id__in=order_ids).delete()
+        OrderItemCost.objects.bulk_create(rows, batch_size=1000)
+        orders = Order.objects.filter(pk__in=order_ids)
+        invalidate_monthly_margins(orders.values_list("created_at", flat=True))
+    return len(rows)
+
+
+def margin_orders(date_from=None, date_to=None):
+    """
+    Fulfilled orders with a cost ledger, optionally by (local) creation
+    date. Orders fulfilled without ``fulfil_order_stock`` have no cost rows
+    and would show their full revenue as margin, so they are left out.
+    """
+    orders = Order.objects.filter(
+        Exists(OrderItemCost.objects.filter(order=OuterRef("pk"))),
+        status__in=MARGIN_STATUSES,
+    )
+    if date_from:
+        orders = orders.filter(created_at__date__gte=date_from)
+    if date_to:
+        orders = orders.filter(created_at__date__lte=date_to)
+    return orders
+
+
+def _grouped(queryset, group, value):
+    if group == "month":
+        queryset = queryset.annotate(
+            key=TruncMonth("order__created_at", output_field=DateField())
+        )
+        fields = ["key"]
+    elif group == "product":
+        queryset = queryset.annotate(key=F("product_id"), label=F("product__name"))
+        fields = ["key", "label"]
+    else:
+        queryset = queryset.annotate(key=F("order_id"), label=F("order__full_name"))
+        fields = ["key", "label"]
+    return queryset.values(*fields).annotate(total=Sum(value)).order_by()
+
+
+def _margin_row(key, label=None, revenue=0, cogs=0):
+    revenue = Decimal(revenue or 0).quantize(CENT, rounding=ROUND_HALF_UP)
+    cogs = Decimal(cogs or 0).quantize(CENT, rounding=ROUND_HALF_UP)
+    margin = revenue - cogs
+    return {
+        "key": key,
+        "label": label if label is not None else key,
+        "revenue": revenue,
+        "cogs": cogs,
+        "margin": margin,
+        "margin_percent": (
+            (margin * 100 / revenue).quantize(Decimal("0.1")) if revenue else None
+        ),
+    }
+
+
+def margin_report(group="product", orders=None) -> list:
+    """
+    Revenue, cost of goods and margin of ``orders`` (default: all fulfilled
+    orders) per product, month or order: two grouped queries, one over the
+    order lines and one over the cost ledger. Months come oldest first,
+    products and orders by margin, highest first.
+    """
+    if group not in MARGIN_GROUPS:
+        raise ValueError(f"Unknown margin grouping: {group}")
+    orders = margin_orders() if orders is None else orders
+    lines = OrderItem.objects.filter(order__in=orders)
+    costs = OrderItemCost.objects.filter(order__in=orders)
+    revenue = {row["key"]: row for row in _grouped(lines, group, LINE_REVENUE)}
+    cogs = {row["key"]: row for row in _grouped(costs, group, LINE_COST)}
+    rows = [
+        _margin_row(
+            key,
+            (revenue.get(key) or cogs[key]).get("label"),
+            revenue.get(key, {}).get("total"),
+            cogs.get(key, {}).get("total"),
+        )
+        for key in revenue.keys() | cogs.keys()
+    ]
+    if group == "month":
+        return sorted(rows, key=lambda row: row["key"])
+    return sorted(rows, key=lambda row: (-row["margin"], row["key"]))
+
+
+def margin_totals(orders=None) -> dict:
+    """Revenue, cost of goods and margin of ``orders`` (default: fulfilled) in total."""
+    orders = margin_orders() if orders is None else orders
+    lines = OrderItem.objects.filter(order__in=orders)
+    revenue = lines.aggregate(sum=Sum(LINE_REVENUE))
+    cogs = OrderItemCost.objects.filter(order__in=orders).aggregate(sum=Sum(LINE_COST))
+    return _margin_row("total", "Total", revenue["sum"], cogs["sum"])
+
+
+def monthly_margins(months=12, today=None) -> list:
+    """
+    Margin rollups of the last ``months`` calendar months, oldest first.
+    Each month is cached on its own; the missing ones are computed together.
+    """
+    wanted = [_month(today or timezone.now())]
+    for _ in range(months - 1):
+        wanted.insert(0, _previous_month(wanted[0]))
+
+    keys = {MONTHLY_MARGIN_KEY.format(month): month for month in wanted}
+    rollups = cache.get_many(keys)
+    record_cache_lookup("monthly_margins", len(rollups) == len(keys))
+    missing = [month for key, month in keys.items() if key not in rollups]
+    if missing:
+        orders = margin_orders().filter(
+            created_at__date__gte=missing[0],
+            created_at__date__lt=_next_month(missing[-1]),
+        )
+        computed = {row["key"]: row for row in margin_report("month", orders)}
+        fresh = {
+            MONTHLY_MARGIN_KEY.format(month): computed.get(month) or _margin_row(month)
+            for month in missing
+        }
+        cache.set_many(fresh, getattr(settings, "MARGIN_CACHE_TIMEOUT", 3600))
+        rollups.update(fresh)
+    return [rollups[MONTHLY_MARGIN_KEY.format(month)] for month in wanted]
+
+
+def invalidate_monthly_margins(moments) -> None:
+    """Drop the cached rollups of the months of ``moments``, now and on commit."""
+    keys = list({MONTHLY_MARGIN_KEY.format(_month(when)) for when in moments if when})
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -12,6 +12,8 @@ from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import cm
 import os
 
+from versohnung_und_vergebung_kaffee.metrics import PDF_RENDER_SECONDS, track_email
+
 logger = logging.getLogger(__name__)
 
 
@@ -93,12 +95,20 @@ def _build_pdf_bytes(order, title):
         canv.drawString(2*cm, 1.7*cm, "Thank you for choosing Versöhnung und Vergebung Kaffee!")
         canv.restoreState()
 
-    doc.build(elements, onFirstPage=_footer, onLaterPages=_footer)
+    with PDF_RENDER_SECONDS.time(document="order_summary"):
+        doc.build(elements, onFirstPage=_footer, onLaterPages=_footer)
     buf.seek(0)
     return buf.read()
 
 
 def _send_mail_with_optional_pdf(subject, template, context, to_email, pdf_filename=None, pdf_bytes=None):
+    with track_email(template.rsplit("/", 1)[-1]):
+        return _render_and_send(
+            subject, template, context, to_email, pdf_filename, pdf_bytes
+        )
+
+
+def _render_and_send(subject, template, context, to_email, pdf_filename, pdf_bytes):
     text_body = render_to_string(template + ".txt", context)
     html_body = render_to_string(template + ".html", context)
 
@@ -180,7 +190,8 @@ def send_order_paid_internal_email(order, recipients):
         reply_to=[settings.DEFAULT_FROM_EMAIL],
     )
     msg.attach_alternative(html_body, "text/html")
-    return msg.send(fail_silently=False)
+    with track_email("order_paid_internal"):
+        return msg.send(fail_silently=False)
 
 
 def send_order_paid_notifications(order):
@@ -198,4 +209,4 @@ def send_order_paid_notifications(order):
     try:
         send_order_paid_internal_email(order, internal_recipients)
     except Exception:
-        logger.exception("Internal paid email failed for order %s", order.id)
\ No newline at end of file
+        logger.exception("Internal paid email failed for order %s", order.id)
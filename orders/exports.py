@@ -0,0 +1,125 @@
+"""
+Streaming order exports for accounting.
+
+One row per order item, with the order's columns repeated, read with
+``values()`` and ``.iterator(chunk_size=...)`` so memory stays flat however
+many orders are exported. ``stream_export`` turns the rows into CSV or
+NDJSON chunks for ``StreamingHttpResponse`` or a management command.
+"""
+
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef, Subquery, Sum
+
+from products.models import MONEY_AGGREGATE
+from versohnung_und_vergebung_kaffee.routers import on_replica
+from .costing import LINE_COST
+from .models import OrderItem, OrderItemCost
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+CENT = Decimal("0.01")
+
+# (column, values() lookup)
+EXPORT_COLUMNS = [
+    ("order_id", "order_id"),
+    ("created_at", "order__created_at"),
+    ("status", "order__status"),
+    ("full_name", "order__full_name"),
+    ("email", "order__email"),
+    ("city", "order__city"),
+    ("postal_code", "order__postal_code"),
+    ("country", "order__country"),
+    ("order_subtotal", "order__subtotal"),
+    ("order_shipping", "order__shipping"),
+    ("order_total", "order__total"),
+    ("item_id", "id"),
+    ("sku", "product__sku"),
+    ("variant_sku", "variant__sku"),
+    ("product_name", "product_name_snapshot"),
+    ("grind", "grind"),
+    ("weight_grams", "weight_grams"),
+    ("quantity", "quantity"),
+    ("unit_price", "unit_price"),
+]
+COGS_COLUMNS = ["cogs", "margin"]
+
+
+def export_columns(include_cogs=False):
+    return (
+        [column for column, _ in EXPORT_COLUMNS]
+        + ["line_total"]
+        + (COGS_COLUMNS if include_cogs else [])
+    )
+
+
+def export_queryset(status=None, date_from=None, date_to=None):
+    """Order items to export, oldest order first, optionally filtered."""
+    items = OrderItem.objects.order_by("order_id", "id")
+    if status:
+        items = items.filter(order__status=status)
+    if date_from:
+        items = items.filter(order__created_at__date__gte=date_from)
+    if date_to:
+        items = items.filter(order__created_at__date__lte=date_to)
+    return on_replica(items)
+
+
+def _with_cogs(items):
+    """Annotate each item's FIFO cost of goods (None until it is fulfilled)."""
+    costs = OrderItemCost.objects.filter(order_item=OuterRef("pk")).values("order_item")
+    return items.annotate(
+        cogs=Subquery(
+            costs.annotate(cost=Sum(LINE_COST)).values("cost"),
+            output_field=MONEY_AGGREGATE,
+        )
+    )
+
+
+def export_rows(items, include_cogs=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one dict per order item, keyed by ``export_columns()``."""
+    lookups = [lookup for _, lookup in EXPORT_COLUMNS]
+    if include_cogs:
+        items = _with_cogs(items)
+        lookups += ["cogs"]
+    for values in items.values(*lookups).iterator(chunk_size=chunk_size):
+        row = {column: values[lookup] for column, lookup in EXPORT_COLUMNS}
+        if isinstance(row["created_at"], datetime):
+            row["created_at"] = row["created_at"].isoformat()
+        line_total = (row["unit_price"] * row["quantity"]).quantize(
+            CENT, rounding=ROUND_HALF_UP
+        )
+        row["line_total"] = line_total
+        if include_cogs:
+            cogs = values["cogs"]
+            if cogs is not None:
+                cogs = Decimal(cogs).quantize(CENT, rounding=ROUND_HALF_UP)
+            row["cogs"] = cogs
+            row["margin"] = line_total - cogs if cogs is not None else None
+        yield row
+
+
+class _Echo:
+    """File-like object whose ``write`` just returns the line csv.writer built."""
+
+    def write(self, value):
+        return value
+
+
+def stream_export(rows, fmt="csv", include_cogs=False):
+    """Yield the export as text chunks (a header, then one line per row)."""
+    if fmt == "ndjson":
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+        return
+    writer = csv.writer(_Echo())
+    columns = export_columns(include_cogs)
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(
+            ["" if row[column] is None else row[column] for column in columns]
+        )
@@ -0,0 +1,62 @@
+"""Cancel abandoned ``new`` orders and their Stripe PaymentIntents."""
+
+import json
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.payments import RateLimiter, expire_stale_orders
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Cancel 'new' orders older than --older-than-hours in batches and "
+        "cancel their PaymentIntents. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-hours", type=float, default=48)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--max-rps",
+            type=float,
+            default=20,
+            help="Maximum Stripe cancel calls per second (0 disables throttling).",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument(
+            "--json", action="store_true", help="Print metrics as JSON."
+        )
+
+    def handle(self, *args, **options):
+        if options["older_than_hours"] <= 0:
+            raise CommandError("--older-than-hours must be positive.")
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive.")
+
+        metrics = expire_stale_orders(
+            older_than=timedelta(hours=options["older_than_hours"]),
+            batch_size=options["batch_size"],
+            limiter=RateLimiter(options["max_rps"]),
+            dry_run=options["dry_run"],
+        )
+        logger.info("expire_stale_orders %s", json.dumps(metrics, sort_keys=True))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(metrics, sort_keys=True))
+            return
+        prefix = "[dry run] " if options["dry_run"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Cancelled {metrics['orders_cancelled']} of "
+                f"{metrics['scanned']} stale order(s) "
+                f"in {metrics['batches']} batch(es), {metrics['elapsed_seconds']}s."
+            )
+        )
+        self.stdout.write(
+            f"PaymentIntents: {metrics['intents_cancelled']} cancelled, "
+            f"{metrics['intents_skipped']} kept, {metrics['intents_failed']} failed."
+        )
@@ -0,0 +1,61 @@
+"""Stream orders and their items to CSV or NDJSON for accounting."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from orders.exports import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    export_queryset,
+    export_rows,
+    stream_export,
+)
+
+class Command(BaseCommand):
+    help = (
+        "Write one row per order item (with its order's columns) as CSV or "
+        "NDJSON. Rows are streamed in chunks, so memory use does not grow "
+        "with the number of orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--status", help="Only orders with this status.")
+        parser.add_argument("--since", help="First order date (YYYY-MM-DD), inclusive.")
+        parser.add_argument("--until", help="Last order date (YYYY-MM-DD), inclusive.")
+        parser.add_argument(
+            "--cogs",
+            action="store_true",
+            help="Add FIFO cost of goods and margin per line.",
+        )
+        parser.add_argument(
+            "--output", "-o", help="Write to this file instead of stdout."
+        )
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ("since", "until"):
+            value = options[option]
+            try:
+                dates[option] = parse_date(value) if value else None
+            except ValueError:
+                dates[option] = None
+            if value and dates[option] is None:
+                raise CommandError(f"--{option} must be a date like 2025-01-31.")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        items = export_queryset(
+            status=options["status"], date_from=dates["since"], date_to=dates["until"]
+        )
+        rows = export_rows(
+            items, include_cogs=options["cogs"], chunk_size=options["chunk_size"]
+        )
+        chunks = stream_export(rows, options["format"], options["cogs"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as handle:
+                handle.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,39 @@
+"""Rebuild the per-line cost of goods ledger from fulfilment stock movements."""
+
+from django.core.management.base import BaseCommand
+
+from orders.costing import MARGIN_STATUSES, record_order_costs
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute OrderItemCost rows of fulfilled orders from their FIFO "
+        "consumption movements, e.g. once after upgrading or to repair the "
+        "ledger. Existing rows of those orders are replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order",
+            type=int,
+            action="append",
+            default=[],
+            help="Limit to this order id (repeatable).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="Orders per transaction."
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.filter(status__in=MARGIN_STATUSES).order_by("pk")
+        if options["order"]:
+            orders = orders.filter(pk__in=options["order"])
+        ids = list(orders.values_list("pk", flat=True))
+
+        rows = 0
+        for start in range(0, len(ids), options["chunk_size"]):
+            rows += record_order_costs(ids[start:start + options["chunk_size"]])
+        self.stdout.write(
+            self.style.SUCCESS(f"Costed {len(ids)} order(s) with {rows} row(s).")
+        )
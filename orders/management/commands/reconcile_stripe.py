@@ -0,0 +1,83 @@
+"""Reconcile order statuses with Stripe PaymentIntents in bulk."""
+
+import json
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.emails import send_order_paid_notifications
+from orders.models import Order
+from orders.reconcile import (
+    apply_payment_intents,
+    fetch_payment_intents,
+    iter_payment_intents,
+    open_orders_with_intents,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "List PaymentIntents created in a time window (default) or retrieve the "
+        "intents of open orders (--retrieve) and apply their status to orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since-hours", type=float, default=72)
+        parser.add_argument("--until-hours", type=float, default=0,
+                            help="End of the window, in hours before now.")
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument(
+            "--retrieve",
+            action="store_true",
+            help="Retrieve intents of open orders in the window instead of listing.",
+        )
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Thread pool size for --retrieve.")
+        parser.add_argument("--notify", action="store_true",
+                            help="Send paid-order emails for orders that became paid.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["since_hours"] <= options["until_hours"]:
+            raise CommandError("--since-hours must be greater than --until-hours.")
+        if not 1 <= options["page_size"] <= 100:
+            raise CommandError("--page-size must be between 1 and 100.")
+
+        now = timezone.now()
+        window_start = now - timedelta(hours=options["since_hours"])
+        window_end = now - timedelta(hours=options["until_hours"])
+
+        if options["retrieve"]:
+            intent_ids = list(
+                open_orders_with_intents(
+                    Order.objects.filter(
+                        created_at__gte=window_start, created_at__lt=window_end
+                    )
+                ).values_list("payment_intent_id", flat=True)
+            )
+            intents = fetch_payment_intents(intent_ids, workers=options["workers"])
+        else:
+            intents = iter_payment_intents(
+                window_start, window_end, page_size=options["page_size"]
+            )
+
+        result = apply_payment_intents(intents, dry_run=options["dry_run"])
+        paid_ids = result.pop("paid_order_ids")
+        result["paid"] = len(paid_ids)
+        logger.info("reconcile_stripe %s", json.dumps(result, sort_keys=True))
+
+        if options["notify"] and not options["dry_run"]:
+            for order in Order.objects.filter(pk__in=paid_ids).prefetch_related(
+                "items"
+            ):
+                send_order_paid_notifications(order)
+
+        prefix = "[dry run] " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Checked {result['intents']} PaymentIntent(s): "
+            f"{result['paid']} order(s) paid, {result['cancelled']} cancelled."
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_processedwebhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_client_secret_encrypted',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:36
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_payment_intent_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(django.db.models.functions.text.Lower('email'), condition=models.Q(('user__isnull', True)), name='order_guest_email_lower_idx'),
+        ),
+    ]
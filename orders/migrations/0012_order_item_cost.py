@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_orderitem_variant'),
+        ('products', '0008_backfill_price_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItemCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grams', models.PositiveIntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='item_costs', to='products.productbatch')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_costs', to='orders.order')),
+                ('order_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='costs', to='orders.orderitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_costs', to='products.product')),
+            ],
+            options={
+                'ordering': ['order_item', 'id'],
+                'indexes': [models.Index(fields=['product', 'order'], name='item_cost_product_order_idx')],
+            },
+        ),
+    ]
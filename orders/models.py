@@ -1,12 +1,18 @@
 """Order and order item domain models."""
 
+import base64
+import hashlib
 from decimal import Decimal, ROUND_HALF_UP
 
+from cryptography.fernet import Fernet, InvalidToken
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
 
-from products.models import Product
+from products.models import PackVariant, Product, ProductBatch
 
 
 class Order(models.Model):
@@ -41,6 +47,8 @@ class Order(models.Model):
     # Payment/fulfillment
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="new")
     payment_intent_id = models.CharField(max_length=120, blank=True)  # Stripe PaymentIntent id
+    # Encrypted PaymentIntent client secret so the pay page needs no Stripe call
+    payment_client_secret_encrypted = models.TextField(blank=True, editable=False)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     shipping = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -51,6 +59,21 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Account linking looks up unclaimed guest orders by lower-cased email
+            models.Index(
+                Lower("email"),
+                condition=Q(user__isnull=True),
+                name="order_guest_email_lower_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["payment_intent_id"],
+                condition=~Q(payment_intent_id=""),
+                name="order_unique_payment_intent",
+            ),
+        ]
         permissions = [
             ("view_fulfillment", "Can access fulfillment (paid picklists)"),
             ("change_fulfillment_status", "Can mark orders fulfilled"),
@@ -91,12 +114,49 @@ class Order(models.Model):
 
         return self.status in {"paid", "fulfilled", "refunded"}
 
+    @staticmethod
+    def _client_secret_cipher() -> Fernet:
+        digest = hashlib.sha256(
+            f"orders.client-secret:{settings.SECRET_KEY}".encode()
+        ).digest()
+        return Fernet(base64.urlsafe_b64encode(digest))
+
+    def set_client_secret(self, client_secret: str) -> None:
+        """Store the PaymentIntent client secret encrypted (not saved yet)."""
+
+        if not client_secret:
+            self.payment_client_secret_encrypted = ""
+            return
+        token = self._client_secret_cipher().encrypt(client_secret.encode())
+        self.payment_client_secret_encrypted = token.decode()
+
+    @property
+    def client_secret(self) -> str:
+        """Decrypted client secret, or "" if missing or the key was rotated."""
+
+        if not self.payment_client_secret_encrypted:
+            return ""
+        try:
+            raw = self._client_secret_cipher().decrypt(
+                self.payment_client_secret_encrypted.encode()
+            )
+        except InvalidToken:
+            return ""
+        return raw.decode()
+
 
 class OrderItem(models.Model):
     """Snapshot of a product inside an order."""
 
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name="order_items")
+    variant = models.ForeignKey(
+        PackVariant,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="order_items",
+    )
     product_name_snapshot = models.CharField(max_length=140)  # keep name at purchase time
     unit_price = models.DecimalField(
         max_digits=8,
@@ -129,3 +189,61 @@ class OrderItem(models.Model):
         price = self.unit_price or Decimal("0.00")
         qty = self.quantity or 0
         return (price * qty).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+class OrderItemCost(models.Model):
+    """
+    Cost of goods sold: grams of one order line taken from one batch at
+    fulfilment, at that batch's cost per kg. Grams no batch could cover
+    have no batch and cost nothing.
+    """
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="item_costs"
+    )
+    order_item = models.ForeignKey(
+        OrderItem, on_delete=models.CASCADE, related_name="costs"
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="item_costs"
+    )
+    batch = models.ForeignKey(
+        ProductBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="item_costs",
+    )
+    grams = models.PositiveIntegerField()
+    # EUR per kg
+    unit_cost = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["order_item", "id"]
+        indexes = [
+            models.Index(
+                fields=["product", "order"], name="item_cost_product_order_idx"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.order_item_id}: {self.grams}g at €{self.unit_cost}/kg"
+
+    @property
+    def cost(self) -> Decimal:
+        return Decimal(self.grams) * self.unit_cost / 1000
+
+
+class ProcessedWebhookEvent(models.Model):
+    """Stripe event ids that were already handled, so retries are no-ops."""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-processed_at"]
+
+    def __str__(self) -> str:
+        return f"{self.event_type} ({self.event_id})"
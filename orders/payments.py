@@ -0,0 +1,230 @@
+"""Payment lifecycle helpers shared by views, admin actions and commands."""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import stripe
+from django.db import transaction
+from django.utils import timezone
+
+from products.stock import (
+    RESERVED_ORDER_STATUSES,
+    fulfil_order_stock,
+    release_order_stock,
+    reserve_order_stock,
+)
+from .models import Order
+from .stripe_gateway import get_gateway
+
+logger = logging.getLogger(__name__)
+
+# Stripe statuses after which the order can safely be cancelled locally.
+CANCELLED_INTENT_STATUSES = {"canceled"}
+REFUNDABLE_STATUSES = {"paid", "pending_fulfillment", "fulfilled"}
+CANCELLABLE_STATUSES = {"new", "paid", "pending_fulfillment"}
+# Mirrors Order.is_paid(): these orders already had their stock taken.
+PAID_STATUSES = {"paid", "fulfilled", "refunded"}
+
+
+def mark_orders_paid(order_ids) -> list:
+    """
+    Move every unpaid order in ``order_ids`` to ``paid`` in bulk.
+
+    The items' grams are reserved in the stock ledger (one movement per
+    order and product) and the orders are flipped with one UPDATE. Orders
+    that were already paid, fulfilled or refunded are skipped, so repeated
+    Stripe signals are harmless. Returns the ids that actually changed.
+    """
+    with transaction.atomic():
+        ids = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=list(order_ids))
+            .exclude(status__in=PAID_STATUSES)
+            .values_list("pk", flat=True)
+        )
+        if not ids:
+            return []
+
+        reserve_order_stock(ids)
+        Order.objects.filter(pk__in=ids).update(
+            status="paid", updated_at=timezone.now()
+        )
+    return ids
+
+
+def mark_order_paid(order: Order) -> bool:
+    """Single-order form of :func:`mark_orders_paid` that also updates ``order``."""
+    if order.is_paid() or not mark_orders_paid([order.pk]):
+        return False
+    order.status = "paid"
+    return True
+
+
+def mark_order_refunded(order: Order) -> bool:
+    """
+    Flag a paid order as refunded and release the grams it still holds.
+
+    Fulfilled orders hold nothing any more; what was shipped is not
+    restocked automatically.
+    """
+    return _close_order(order, "refunded", REFUNDABLE_STATUSES)
+
+
+def mark_order_cancelled(order: Order) -> bool:
+    """Cancel an order that has not been fulfilled, releasing its reservation."""
+    return _close_order(order, "cancelled", CANCELLABLE_STATUSES)
+
+
+def _close_order(order: Order, status: str, from_statuses) -> bool:
+    with transaction.atomic():
+        current = (
+            Order.objects.select_for_update()
+            .filter(pk=order.pk)
+            .values_list("status", flat=True)
+            .first()
+        )
+        if current not in from_statuses:
+            return False
+        release_order_stock([order.pk])
+        order.status = status
+        order.save(update_fields=["status"])
+    return True
+
+
+def book_status_change(order: Order, previous: str) -> None:
+    """
+    Book the stock for a staff edit that moved ``order`` from ``previous``
+    to its current status, through the same ledger helpers as the
+    automatic paths: paying reserves, fulfilling sells and consumes FIFO,
+    refunding and cancelling release the reservation.
+    """
+    status = order.status
+    if status == previous:
+        return
+    if status in RESERVED_ORDER_STATUSES:
+        if previous == "new":
+            reserve_order_stock([order.pk])
+    elif status == "fulfilled":
+        fulfil_order_stock(order)
+    elif status in {"refunded", "cancelled"}:
+        release_order_stock([order.pk])
+
+
+class RateLimiter:
+    """Space out calls so no more than ``rate`` happen per second."""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = self._clock()
+            if now < self._next_at:
+                self._sleep(self._next_at - now)
+                now = self._next_at
+            self._next_at = now + self.interval
+
+
+def cancel_payment_intent(payment_intent_id: str) -> str:
+    """
+    Cancel a PaymentIntent as abandoned and return its resulting status.
+
+    Stripe refuses to cancel intents that already succeeded (or were
+    cancelled before); the error carries the current intent, so we report
+    its status instead of raising.
+    """
+    try:
+        intent = get_gateway().cancel_payment_intent(
+            payment_intent_id, reason="abandoned"
+        )
+    except stripe.error.InvalidRequestError as exc:
+        intent = getattr(getattr(exc, "error", None), "payment_intent", None)
+        if not intent:
+            raise
+    return intent.get("status") or ""
+
+
+def expire_stale_orders(
+    older_than: timedelta,
+    batch_size: int = 500,
+    limiter: RateLimiter = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Cancel ``new`` orders created before ``now - older_than``.
+
+    Orders are walked in primary-key batches. Each batch cancels its
+    PaymentIntents through ``limiter`` and then flips the affected orders to
+    ``cancelled`` with a single UPDATE. Orders whose intent could not be
+    cancelled (already succeeded, processing, or a Stripe error) are left
+    untouched for the webhook / reconciliation to pick up.
+
+    ``new`` orders never reserve stock (that happens when the
+    order is paid), so there is no reserved stock to hand back here.
+    """
+    limiter = limiter or RateLimiter(0)
+    cutoff = timezone.now() - older_than
+    metrics = {
+        "scanned": 0,
+        "orders_cancelled": 0,
+        "intents_cancelled": 0,
+        "intents_skipped": 0,
+        "intents_failed": 0,
+        "batches": 0,
+    }
+    started = time.monotonic()
+    last_id = 0
+
+    while True:
+        rows = list(
+            Order.objects.filter(status="new", created_at__lt=cutoff, pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", "payment_intent_id")[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        metrics["batches"] += 1
+        metrics["scanned"] += len(rows)
+
+        cancellable = []
+        for order_id, pi_id in rows:
+            if not pi_id or dry_run:
+                cancellable.append(order_id)
+                continue
+            limiter.wait()
+            try:
+                status = cancel_payment_intent(pi_id)
+            except Exception:
+                logger.exception(
+                    "Could not cancel PaymentIntent %s for order %s", pi_id, order_id
+                )
+                metrics["intents_failed"] += 1
+                continue
+            if status in CANCELLED_INTENT_STATUSES:
+                metrics["intents_cancelled"] += 1
+                cancellable.append(order_id)
+            else:
+                logger.info(
+                    "PaymentIntent %s is %s; keeping order %s", pi_id, status, order_id
+                )
+                metrics["intents_skipped"] += 1
+
+        if cancellable and not dry_run:
+            # Re-check the status so a webhook that paid the order meanwhile wins.
+            metrics["orders_cancelled"] += Order.objects.filter(
+                pk__in=cancellable, status="new"
+            ).update(status="cancelled", updated_at=timezone.now())
+        elif dry_run:
+            metrics["orders_cancelled"] += len(cancellable)
+
+    metrics["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    return metrics
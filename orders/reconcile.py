@@ -0,0 +1,109 @@
+"""Bulk reconciliation of local orders against Stripe PaymentIntents."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.utils import timezone
+
+from .models import Order
+from .payments import PAID_STATUSES, mark_orders_paid
+from .stripe_gateway import get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+def iter_payment_intents(
+    created_gte: datetime,
+    created_lt: datetime,
+    page_size: int = 100,
+    list_intents=None,
+):
+    """
+    Yield PaymentIntents created in ``[created_gte, created_lt)``.
+
+    Walks Stripe's cursor pagination (``starting_after``/``has_more``).
+    ``list_intents`` defaults to the Stripe gateway's
+    ``list_payment_intents``; tests may pass a local stub with the same
+    signature.
+    """
+    list_intents = list_intents or get_gateway().list_payment_intents
+    params = {
+        "created": {
+            "gte": int(created_gte.timestamp()),
+            "lt": int(created_lt.timestamp()),
+        },
+        "limit": page_size,
+    }
+    while True:
+        page = list_intents(**params)
+        data = page["data"]
+        yield from data
+        if not page.get("has_more") or not data:
+            return
+        params["starting_after"] = data[-1]["id"]
+
+
+def fetch_payment_intents(intent_ids, workers: int = 4, retrieve=None) -> list:
+    """Retrieve specific PaymentIntents with a bounded thread pool."""
+    retrieve = retrieve or get_gateway().retrieve_payment_intent
+
+    def _fetch(pi_id):
+        try:
+            return retrieve(pi_id)
+        except Exception:
+            logger.exception("Could not retrieve PaymentIntent %s", pi_id)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return [pi for pi in pool.map(_fetch, intent_ids) if pi is not None]
+
+
+def apply_payment_intents(intents, dry_run: bool = False) -> dict:
+    """
+    Apply Stripe intent statuses to matching orders in bulk.
+
+    Succeeded intents mark their orders paid through the shared paid
+    transition; canceled intents cancel orders that are still ``new``.
+    Returns counts plus the ids of orders that became paid.
+    """
+    by_status = {}
+    for pi in intents:
+        by_status.setdefault(pi["status"], []).append(pi["id"])
+
+    succeeded = by_status.get("succeeded", [])
+    canceled = by_status.get("canceled", [])
+    to_pay = list(
+        Order.objects.filter(payment_intent_id__in=succeeded)
+        .exclude(status__in=PAID_STATUSES)
+        .values_list("pk", flat=True)
+    ) if succeeded else []
+    to_cancel = (
+        Order.objects.filter(payment_intent_id__in=canceled, status="new")
+        if canceled
+        else None
+    )
+
+    result = {
+        "intents": sum(len(ids) for ids in by_status.values()),
+        "paid_order_ids": to_pay,
+        "cancelled": 0,
+    }
+    if dry_run:
+        result["cancelled"] = to_cancel.count() if to_cancel is not None else 0
+        return result
+
+    result["paid_order_ids"] = mark_orders_paid(to_pay) if to_pay else []
+    if to_cancel is not None:
+        result["cancelled"] = to_cancel.update(
+            status="cancelled", updated_at=timezone.now()
+        )
+    return result
+
+
+def open_orders_with_intents(queryset=None):
+    """Unpaid orders that have a PaymentIntent worth checking."""
+    queryset = Order.objects.all() if queryset is None else queryset
+    return queryset.exclude(payment_intent_id="").exclude(
+        status__in=PAID_STATUSES | {"cancelled"}
+    )
@@ -1,17 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from django.db.models.signals import post_save
 from django.dispatch import receiver
 from allauth.account.signals import user_logged_in, user_signed_up
+from versohnung_und_vergebung_kaffee.metrics import record_cache_lookup
+from .costing import invalidate_monthly_margins
 from .models import Order
 
+# Cache flag meaning "no unlinked guest orders exist for this email".
+GUEST_ORDERS_LINKED_KEY = "orders:guest-orders-linked:{}"
 
-def _attach_orders_to_user(user):
+
+def _guest_flag_key(email):
+    return GUEST_ORDERS_LINKED_KEY.format(email.strip().lower())
+
+
+def _attach_orders_to_user(user, force=False):
     if not user.email:
         return
-    Order.objects.filter(user__isnull=True, email__iexact=user.email).update(user=user)
+    key = _guest_flag_key(user.email)
+    if not force:
+        linked = bool(cache.get(key))
+        record_cache_lookup("guest_orders_linked", linked)
+        if linked:
+            return
+    (
+        Order.objects.filter(user__isnull=True)
+        .alias(email_lower=Lower("email"))
+        .filter(email_lower=user.email.strip().lower())
+        .update(user=user)
+    )
+    cache.set(key, True, getattr(settings, "GUEST_ORDER_LINK_CACHE_TIMEOUT", 3600))
+
+
+@receiver(post_save, sender=Order)
+def on_guest_order_saved(sender, instance, **kwargs):
+    # A new or edited guest order means the email has something to link again.
+    if instance.user_id is None and instance.email:
+        cache.delete(_guest_flag_key(instance.email))
+
+
+@receiver(post_save, sender=Order)
+def on_order_saved(sender, instance, **kwargs):
+    # A status change can move the order in or out of its month's margins.
+    invalidate_monthly_margins([instance.created_at])
 
 
 @receiver(user_signed_up)
 def on_signup(sender, request, user, **kwargs):
-    _attach_orders_to_user(user)
+    _attach_orders_to_user(user, force=True)
 
 
 @receiver(user_logged_in)
@@ -0,0 +1,249 @@
+"""
+Single entry point for Stripe API calls.
+
+``get_gateway()`` returns the process-wide gateway named by
+``settings.STRIPE_GATEWAY``. The real ``StripeGateway`` holds one
+``stripe.StripeClient`` backed by a pooled (keep-alive) httpx client, with
+explicit timeouts and bounded network retries. Async calls get a client per
+event loop: pooled async connections are bound to the loop that opened
+them, and under WSGI ``async_to_sync`` runs each request on a new loop.
+Writes carry idempotency keys derived from our own ids, so a retried
+request never creates a second PaymentIntent.
+
+Tests switch to the in-process ``FakeStripeGateway`` with
+``override_settings(STRIPE_GATEWAY="orders.stripe_gateway.FakeStripeGateway")``.
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+import weakref
+
+import httpx
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def payment_intent_idempotency_key(order_id) -> str:
+    return f"vv-order-{order_id}-payment-intent"
+
+
+class StripeGateway:
+    """Thin wrapper around a configured ``StripeClient``."""
+
+    def __init__(
+        self,
+        api_key=None,
+        timeout=None,
+        connect_timeout=None,
+        max_retries=None,
+        client=None,
+        api_base=None,
+    ):
+        self.api_key = settings.STRIPE_SECRET_KEY if api_key is None else api_key
+        self.timeout = (
+            getattr(settings, "STRIPE_TIMEOUT", 20.0) if timeout is None else timeout
+        )
+        self.connect_timeout = (
+            getattr(settings, "STRIPE_CONNECT_TIMEOUT", 5.0)
+            if connect_timeout is None
+            else connect_timeout
+        )
+        self.max_retries = (
+            getattr(settings, "STRIPE_MAX_RETRIES", 2)
+            if max_retries is None
+            else max_retries
+        )
+        self.api_base = api_base
+        self._client = client
+        self._injected = client is not None
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _build_client(self):
+        http_client = stripe.HTTPXClient(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            allow_sync_methods=True,
+        )
+        options = {"base_addresses": {"api": self.api_base}} if self.api_base else {}
+        return stripe.StripeClient(
+            self.api_key,
+            http_client=http_client,
+            max_network_retries=self.max_retries,
+            **options,
+        )
+
+    @property
+    def client(self):
+        """Client for sync calls, shared by all threads of the process."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    @property
+    def async_client(self):
+        """Client for async calls on the running event loop (one per loop)."""
+        if self._injected:
+            return self._client
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._loop_clients.get(loop)
+            if client is None:
+                client = self._loop_clients[loop] = self._build_client()
+        return client
+
+    # ── PaymentIntents ───────────────────────────────────────────────────────
+    def create_payment_intent(self, order_id, **params):
+        return self.client.payment_intents.create(
+            params=params,
+            options={"idempotency_key": payment_intent_idempotency_key(order_id)},
+        )
+
+    def retrieve_payment_intent(self, intent_id):
+        return self.client.payment_intents.retrieve(intent_id)
+
+    async def retrieve_payment_intent_async(self, intent_id):
+        return await self.async_client.payment_intents.retrieve_async(intent_id)
+
+    def cancel_payment_intent(self, intent_id, reason="abandoned"):
+        return self.client.payment_intents.cancel(
+            intent_id,
+            params={"cancellation_reason": reason},
+            options={"idempotency_key": f"vv-{intent_id}-cancel"},
+        )
+
+    def list_payment_intents(self, **params):
+        return self.client.payment_intents.list(params=params)
+
+    # ── Webhooks ─────────────────────────────────────────────────────────────
+    def construct_event(self, payload, sig_header, secret=None):
+        secret = settings.STRIPE_WEBHOOK_SECRET if secret is None else secret
+        return stripe.Webhook.construct_event(payload, sig_header, secret)
+
+
+class FakeStripeGateway:
+    """
+    In-process stand-in with the same interface, for tests and local demos.
+
+    PaymentIntents live in ``self.intents``; ``calls`` records every method
+    invocation. Idempotency keys behave like Stripe's: a repeated create for
+    the same order returns the first intent.
+    """
+
+    def __init__(self):
+        self.intents = {}
+        self.calls = []
+        self._by_idempotency_key = {}
+        self._ids = itertools.count(1)
+
+    def _intent(self, data):
+        return stripe.PaymentIntent.construct_from(data, "sk_fake")
+
+    def add_intent(self, intent_id, status="requires_payment_method", **fields):
+        data = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "status": status,
+            "client_secret": f"{intent_id}_secret_fake",
+            "created": int(time.time()) - 60,  # safely inside "until now" windows
+            "metadata": {},
+            **fields,
+        }
+        self.intents[intent_id] = data
+        return self._intent(data)
+
+    def create_payment_intent(self, order_id, **params):
+        self.calls.append(("create_payment_intent", order_id))
+        key = payment_intent_idempotency_key(order_id)
+        if key not in self._by_idempotency_key:
+            intent = self.add_intent(f"pi_fake_{next(self._ids)}", **params)
+            self._by_idempotency_key[key] = intent["id"]
+        return self._intent(self.intents[self._by_idempotency_key[key]])
+
+    def retrieve_payment_intent(self, intent_id):
+        self.calls.append(("retrieve_payment_intent", intent_id))
+        if intent_id not in self.intents:
+            raise stripe.InvalidRequestError(
+                f"No such payment_intent: '{intent_id}'", "intent"
+            )
+        return self._intent(self.intents[intent_id])
+
+    async def retrieve_payment_intent_async(self, intent_id):
+        return self.retrieve_payment_intent(intent_id)
+
+    def cancel_payment_intent(self, intent_id, reason="abandoned"):
+        self.calls.append(("cancel_payment_intent", intent_id))
+        data = self.intents.get(intent_id)
+        if data is None:
+            raise stripe.InvalidRequestError(
+                f"No such payment_intent: '{intent_id}'", "intent"
+            )
+        if data["status"] in {"succeeded", "canceled"}:
+            error = stripe.InvalidRequestError(
+                f"This PaymentIntent's status is {data['status']}.",
+                "intent",
+                code="payment_intent_unexpected_state",
+            )
+            error.error = stripe.ErrorObject.construct_from(
+                {"payment_intent": self._intent(data)}, "sk_fake"
+            )
+            raise error
+        data.update(status="canceled", cancellation_reason=reason)
+        return self._intent(data)
+
+    def list_payment_intents(
+        self, created=None, limit=10, starting_after=None, **params
+    ):
+        self.calls.append(("list_payment_intents", starting_after))
+        created = created or {}
+        matching = [
+            data
+            for data in sorted(self.intents.values(), key=lambda d: d["created"])
+            if created.get("gte", 0)
+            <= data["created"]
+            < created.get("lt", float("inf"))
+        ]
+        if starting_after:
+            ids = [data["id"] for data in matching]
+            matching = matching[ids.index(starting_after) + 1:]
+        page = [self._intent(data) for data in matching[:limit]]
+        return {"data": page, "has_more": len(matching) > limit}
+
+    def construct_event(self, payload, sig_header, secret=None):
+        """Accept any payload as an already-verified event."""
+        return stripe.Event.construct_from(json.loads(payload), "sk_fake")
+
+
+def get_gateway():
+    """Process-wide gateway instance (shares the HTTP connection pool)."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                path = getattr(
+                    settings, "STRIPE_GATEWAY", "orders.stripe_gateway.StripeGateway"
+                )
+                _gateway = import_string(path)()
+    return _gateway
+
+
+def reset_gateway():
+    """Drop the cached gateway; the next ``get_gateway()`` builds a new one."""
+    global _gateway
+    _gateway = None
+
+
+@receiver(setting_changed)
+def _reset_gateway_on_setting_change(sender, setting, **kwargs):
+    if setting.startswith("STRIPE_"):
+        reset_gateway()
@@ -1,15 +1,37 @@
+import csv
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
 from decimal import Decimal
-from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import stripe
+from asgiref.sync import async_to_sync
 
 from django.contrib.auth.models import User
 from django.contrib.staticfiles import storage as static_storage
 from django.contrib.staticfiles.storage import StaticFilesStorage
 from django.core import mail
-from django.test import Client, TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import AsyncClient, Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+
+from orders.costing import margin_report, monthly_margins
+from orders.models import Order, OrderItem, OrderItemCost, ProcessedWebhookEvent
+from orders.payments import mark_order_refunded
+from orders.signals import _attach_orders_to_user
+from orders.stripe_gateway import StripeGateway, get_gateway, reset_gateway
+from products.models import Category, PackVariant, Product, ProductBatch, StockBalance
+from products.stock import fulfil_order_stock, reserve_order_stock
 
-from orders.models import Order, OrderItem
-from products.models import Category, Product
+FAKE_GATEWAY = "orders.stripe_gateway.FakeStripeGateway"
 
 
 class PaidEmailFlowTests(TestCase):
@@ -108,6 +130,169 @@ class PaidEmailFlowTests(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].to, ["customer@example.com"])
 
+    @override_settings(
+        EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+        ORDER_NOTIFICATION_EMAILS=[],
+        DEFAULT_FROM_EMAIL="shop@example.com",
+    )
+    @patch("orders.views.stripe.Webhook.construct_event")
+    def test_duplicate_event_is_processed_once(self, construct_event):
+        construct_event.return_value = dict(self.webhook_payload, id="evt_1")
+
+        for _ in range(2):
+            response = self.client.post(
+                reverse("orders:stripe_webhook"),
+                data="{}",
+                content_type="application/json",
+                HTTP_STRIPE_SIGNATURE="sig",
+            )
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            ProcessedWebhookEvent.objects.filter(event_id="evt_1").count(), 1
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Product.objects.get(sku="FIL-1").stock, 4)
+
+    @patch("orders.views.stripe.Webhook.construct_event")
+    def test_full_refund_and_cancel_events_update_status(self, construct_event):
+        Order.objects.filter(pk=self.order.pk).update(status="paid")
+        construct_event.return_value = {
+            "id": "evt_refund",
+            "type": "charge.refunded",
+            "data": {
+                "object": {"id": "ch_1", "refunded": True, "payment_intent": "pi_12345"}
+            },
+        }
+        self.client.post(reverse("orders:stripe_webhook"), data="{}",
+                         content_type="application/json", HTTP_STRIPE_SIGNATURE="sig")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "refunded")
+
+        other = Order.objects.create(
+            full_name="Guest", email="g@example.com", street="S", city="C",
+            postal_code="1", payment_intent_id="pi_other",
+        )
+        construct_event.return_value = {
+            "id": "evt_cancel",
+            "type": "payment_intent.canceled",
+            "data": {
+                "object": {"id": "pi_other", "metadata": {"order_id": str(other.id)}}
+            },
+        }
+        self.client.post(reverse("orders:stripe_webhook"), data="{}",
+                         content_type="application/json", HTTP_STRIPE_SIGNATURE="sig")
+        other.refresh_from_db()
+        self.assertEqual(other.status, "cancelled")
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+    STRIPE_GATEWAY=FAKE_GATEWAY,
+)
+class PayViewTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.stripe = get_gateway()
+        product = Product.objects.create(
+            name="Espresso", sku="ESP-1", price=Decimal("9.00")
+        )
+        self.order = Order.objects.create(
+            full_name="Guest",
+            email="guest@example.com",
+            street="Street",
+            city="City",
+            postal_code="12345",
+            payment_intent_id="pi_pay",
+        )
+        OrderItem.objects.create(
+            order=self.order,
+            product=product,
+            product_name_snapshot=product.name,
+            unit_price=product.price,
+            quantity=2,
+        )
+
+    def test_stored_secret_renders_without_stripe_call(self):
+        self.order.set_client_secret("pi_pay_secret_abc")
+        self.order.save()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("orders:pay", args=[self.order.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "pi_pay_secret_abc")
+        self.assertEqual(self.stripe.calls, [])
+
+    def test_missing_secret_is_fetched_once_and_stored(self):
+        self.stripe.add_intent("pi_pay", client_secret="pi_pay_secret_xyz")
+
+        self.client.get(reverse("orders:pay", args=[self.order.id]))
+        self.client.get(reverse("orders:pay", args=[self.order.id]))
+
+        self.assertEqual(self.stripe.calls, [("retrieve_payment_intent", "pi_pay")])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.client_secret, "pi_pay_secret_xyz")
+        self.assertNotIn(
+            "pi_pay_secret_xyz", self.order.payment_client_secret_encrypted
+        )
+
+    @patch("orders.views.send_order_paid_notifications")
+    async def test_thank_you_reconciles_paid_intent_under_asgi(self, notify):
+        self.stripe.add_intent("pi_pay", status="succeeded")
+
+        response = await AsyncClient().get(
+            reverse("orders:thank_you", args=[self.order.id])
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stripe.calls, [("retrieve_payment_intent", "pi_pay")])
+        await self.order.arefresh_from_db()
+        self.assertEqual(self.order.status, "paid")
+        notify.assert_called_once()
+
+
+    @patch("orders.views.send_order_paid_notifications")
+    def test_pay_and_thank_you_call_stripe_repeatedly_under_wsgi(self, notify):
+        other = Order.objects.create(
+            full_name="Other", email="other@example.com", street="Street", city="City",
+            postal_code="12345", payment_intent_id="pi_other",
+        )
+        OrderItem.objects.create(
+            order=other,
+            product=self.order.items.get().product,
+            product_name_snapshot="Espresso",
+            unit_price=Decimal("9.00"),
+            quantity=1,
+        )
+        with _stripe_stub_server() as api_base:
+            gateway = StripeGateway(
+                api_key="sk_test_stub", max_retries=0, api_base=api_base
+            )
+            with patch("orders.views.get_gateway", return_value=gateway):
+                paid = self.client.get(
+                    reverse("orders:thank_you", args=[self.order.id])
+                )
+                pay = self.client.get(reverse("orders:pay", args=[other.id]))
+                paid_too = self.client.get(reverse("orders:thank_you", args=[other.id]))
+
+        self.assertEqual(
+            (paid.status_code, pay.status_code, paid_too.status_code), (200, 200, 200)
+        )
+        self.assertContains(pay, "pi_other_secret_stub")
+        self.assertEqual(
+            set(
+                Order.objects.filter(pk__in=[self.order.pk, other.pk]).values_list(
+                    "status", flat=True
+                )
+            ),
+            {"paid"},
+        )
 
 @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
 class StaffOrderViewTests(TestCase):
@@ -173,3 +358,595 @@ class StaffOrderViewTests(TestCase):
         self.order.refresh_from_db()
         self.assertEqual(self.order.status, "fulfilled")
         self.assertIsNotNone(self.order.fulfilled_at)
+
+    def _reserved(self):
+        return StockBalance.objects.get(product=self.product).reserved_grams
+
+    def test_staff_fulfilment_sells_consumes_and_costs_the_order(self):
+        reserve_order_stock([self.order.pk])
+        self.client.login(username="staff", password="pw")
+        url = reverse("orders:staff_order_update", args=[self.order.pk])
+        self.client.post(url, {"status": "fulfilled", "notes": ""})
+
+        self.assertEqual(self._reserved(), 0)
+        self.assertEqual(
+            list(
+                self.order.stock_movements.values_list(
+                    "kind", "reserved_grams", "on_hand_grams"
+                )
+            ),
+            [("reservation", 250, 0), ("sale", -250, 0), ("consumption", 0, -250)],
+        )
+        self.assertTrue(OrderItemCost.objects.filter(order=self.order).exists())
+
+    def test_refund_and_staff_cancel_release_the_reservation(self):
+        other = Order.objects.create(
+            full_name="Other", email="o@example.com", status="new"
+        )
+        OrderItem.objects.create(
+            order=other, product=self.product, product_name_snapshot=self.product.name,
+            unit_price=self.product.price, quantity=2, weight_grams=250,
+        )
+        reserve_order_stock([self.order.pk])
+        self.client.login(username="staff", password="pw")
+        url = reverse("orders:staff_order_update", args=[other.pk])
+        self.client.post(url, {"status": "paid", "notes": ""})
+        self.assertEqual(self._reserved(), 750)
+
+        self.assertTrue(mark_order_refunded(self.order))
+        self.assertFalse(mark_order_refunded(self.order))
+        self.assertEqual(self._reserved(), 500)
+
+        self.client.post(url, {"status": "cancelled", "notes": ""})
+        other.refresh_from_db()
+        self.assertEqual(other.status, "cancelled")
+        self.assertEqual(self._reserved(), 0)
+        self.assertEqual(
+            list(other.stock_movements.values_list("kind", "reserved_grams")),
+            [("reservation", 500), ("reservation", -500)],
+        )
+
+
+@override_settings(STRIPE_GATEWAY=FAKE_GATEWAY)
+class ExpireStaleOrdersCommandTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.stripe = get_gateway()
+
+    def _order(self, status="new", pi="", age_hours=0):
+        order = Order.objects.create(
+            full_name="Guest",
+            email="guest@example.com",
+            street="Street",
+            city="City",
+            postal_code="12345",
+            status=status,
+            payment_intent_id=pi,
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(hours=age_hours)
+        )
+        return order
+
+    def test_cancels_only_stale_new_orders(self):
+        self.stripe.add_intent("pi_old")
+        stale = self._order(pi="pi_old", age_hours=72)
+        stale_without_intent = self._order(age_hours=72)
+        fresh = self._order(pi="pi_fresh", age_hours=1)
+        paid = self._order(status="paid", pi="pi_paid", age_hours=72)
+
+        out = StringIO()
+        call_command(
+            "expire_stale_orders",
+            "--older-than-hours",
+            "48",
+            "--max-rps",
+            "0",
+            stdout=out,
+        )
+
+        self.assertEqual(self.stripe.calls, [("cancel_payment_intent", "pi_old")])
+        self.assertEqual(self.stripe.intents["pi_old"]["status"], "canceled")
+        statuses = dict(Order.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[stale.pk], "cancelled")
+        self.assertEqual(statuses[stale_without_intent.pk], "cancelled")
+        self.assertEqual(statuses[fresh.pk], "new")
+        self.assertEqual(statuses[paid.pk], "paid")
+        self.assertIn("Cancelled 2 of 2", out.getvalue())
+
+    def test_succeeded_intent_keeps_order_open(self):
+        self.stripe.add_intent("pi_done", status="succeeded")
+        order = self._order(pi="pi_done", age_hours=72)
+
+        call_command("expire_stale_orders", "--max-rps", "0", stdout=StringIO())
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, "new")
+
+
+@override_settings(STRIPE_GATEWAY=FAKE_GATEWAY)
+class ReconcileStripeCommandTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.stripe = get_gateway()
+        self.product = Product.objects.create(
+            name="Filter", sku="REC-1", price=Decimal("10.00"), stock=10
+        )
+
+    def _order(self, pi, status="new", quantity=1):
+        order = Order.objects.create(
+            full_name="Guest", email="g@example.com", street="S", city="C",
+            postal_code="1", status=status, payment_intent_id=pi,
+        )
+        OrderItem.objects.create(
+            order=order, product=self.product, product_name_snapshot="Filter",
+            unit_price=Decimal("10.00"), quantity=quantity,
+        )
+        return order
+
+    def test_lists_pages_and_applies_statuses_in_bulk(self):
+        succeeded = self._order("pi_a", quantity=2)
+        also_succeeded = self._order("pi_b", quantity=3)
+        abandoned = self._order("pi_c")
+        already_paid = self._order("pi_d", status="paid")
+        for pi, status in [
+            ("pi_a", "succeeded"),
+            ("pi_b", "succeeded"),
+            ("pi_c", "canceled"),
+            ("pi_d", "succeeded"),
+            ("pi_unknown", "succeeded"),
+        ]:
+            self.stripe.add_intent(pi, status=status)
+
+        out = StringIO()
+        call_command("reconcile_stripe", "--page-size", "2", stdout=out)
+
+        self.assertEqual(
+            self.stripe.calls,
+            [
+                ("list_payment_intents", None),
+                ("list_payment_intents", "pi_b"),
+                ("list_payment_intents", "pi_d"),
+            ],
+        )
+        statuses = dict(Order.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[succeeded.pk], "paid")
+        self.assertEqual(statuses[also_succeeded.pk], "paid")
+        self.assertEqual(statuses[abandoned.pk], "cancelled")
+        self.assertEqual(statuses[already_paid.pk], "paid")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertIn("2 order(s) paid, 1 cancelled", out.getvalue())
+
+    def test_retrieve_mode_fetches_open_orders_only(self):
+        self._order("pi_open")
+        self._order("pi_paid", status="paid")
+
+        self.stripe.add_intent("pi_open", status="succeeded")
+        self.stripe.add_intent("pi_paid", status="succeeded")
+
+        call_command(
+            "reconcile_stripe", "--retrieve", "--workers", "2", stdout=StringIO()
+        )
+
+        self.assertEqual(self.stripe.calls, [("retrieve_payment_intent", "pi_open")])
+        self.assertEqual(Order.objects.get(payment_intent_id="pi_open").status, "paid")
+
+
+class GuestOrderLinkingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            "buyer", email="Buyer@Example.com", password="pw"
+        )
+
+    def _guest_order(self, email):
+        return Order.objects.create(
+            full_name="Guest", email=email, street="S", city="C", postal_code="1",
+        )
+
+    def test_links_case_insensitively_and_skips_repeat_logins(self):
+        order = self._guest_order("buyer@EXAMPLE.com")
+
+        _attach_orders_to_user(self.user)
+        order.refresh_from_db()
+        self.assertEqual(order.user, self.user)
+
+        with self.assertNumQueries(0):
+            _attach_orders_to_user(self.user)
+
+        later = self._guest_order("BUYER@example.com")
+        _attach_orders_to_user(self.user)
+        later.refresh_from_db()
+        self.assertEqual(later.user, self.user)
+
+    def test_duplicate_payment_intent_rejected(self):
+        self._guest_order("a@example.com")
+        self._guest_order("b@example.com")  # blank intent ids may repeat
+        Order.objects.create(
+            full_name="A", email="a@example.com", street="S", city="C",
+            postal_code="1", payment_intent_id="pi_dup",
+        )
+        with self.assertRaises(IntegrityError):
+            Order.objects.create(
+                full_name="B", email="b@example.com", street="S", city="C",
+                postal_code="1", payment_intent_id="pi_dup",
+            )
+
+
+@contextmanager
+def _stripe_stub_server(status="succeeded"):
+    """A keep-alive HTTP server answering every request with one PaymentIntent."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            intent_id = self.path.rsplit("/", 1)[-1]
+            body = json.dumps({
+                "id": intent_id, "object": "payment_intent", "status": status,
+                "client_secret": f"{intent_id}_secret_stub",
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class StripeGatewayTests(TestCase):
+    def test_writes_send_idempotency_keys_derived_from_ids(self):
+        client = Mock()
+        gateway = StripeGateway(client=client)
+
+        gateway.create_payment_intent(42, amount=1250, currency="eur")
+        gateway.cancel_payment_intent("pi_42")
+
+        client.payment_intents.create.assert_called_once_with(
+            params={"amount": 1250, "currency": "eur"},
+            options={"idempotency_key": "vv-order-42-payment-intent"},
+        )
+        client.payment_intents.cancel.assert_called_once_with(
+            "pi_42",
+            params={"cancellation_reason": "abandoned"},
+            options={"idempotency_key": "vv-pi_42-cancel"},
+        )
+
+    @override_settings(
+        STRIPE_TIMEOUT=7.0, STRIPE_CONNECT_TIMEOUT=2.0, STRIPE_MAX_RETRIES=3
+    )
+    def test_shared_client_uses_pooled_httpx_with_settings(self):
+        reset_gateway()
+        gateway = get_gateway()
+
+        self.assertIs(gateway, get_gateway())
+        self.assertIs(gateway.client, gateway.client)
+        self.assertEqual(
+            (gateway.timeout, gateway.connect_timeout, gateway.max_retries),
+            (7.0, 2.0, 3),
+        )
+        self.assertIsInstance(gateway.client._requestor._client, stripe.HTTPXClient)
+
+    def test_async_retrieves_work_across_event_loops(self):
+        # Under WSGI every async_to_sync call runs on a new event loop.
+        with _stripe_stub_server() as api_base:
+            gateway = StripeGateway(
+                api_key="sk_test_stub", max_retries=0, api_base=api_base
+            )
+            first = async_to_sync(gateway.retrieve_payment_intent_async)("pi_stub")
+            second = async_to_sync(gateway.retrieve_payment_intent_async)("pi_stub")
+        self.assertEqual((first.status, second.status), ("succeeded", "succeeded"))
+
+    @override_settings(STRIPE_GATEWAY=FAKE_GATEWAY)
+    def test_fake_replays_create_for_the_same_order(self):
+        reset_gateway()
+        fake = get_gateway()
+        first = fake.create_payment_intent(7, amount=100)
+        again = fake.create_payment_intent(7, amount=100)
+        self.assertEqual(first.id, again.id)
+        self.assertEqual(len(fake.intents), 1)
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+    STRIPE_GATEWAY=FAKE_GATEWAY,
+)
+class VariantCheckoutTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.product = Product.objects.create(
+            name="Kivu", sku="KIV-1", cost_price=Decimal("8.00"), weight_grams=250
+        )
+        self.kilo = PackVariant.objects.create(
+            product=self.product,
+            name="1kg",
+            sku="KIV-1000",
+            pack_weight_grams=1000,
+            price=Decimal("30.00"),
+        )
+        add = reverse("cart:add", kwargs={"slug": self.product.slug})
+        self.client.post(
+            add, {"variant": self.kilo.pk, "quantity": 2, "grind": "espresso"}
+        )
+        self.client.post(add, {"quantity": 1})
+
+    def test_checkout_writes_variant_price_and_weight(self):
+        PackVariant.objects.filter(pk=self.kilo.pk).update(price=Decimal("31.00"))
+        response = self.client.post(
+            reverse("orders:checkout"),
+            {
+                "full_name": "Kunde",
+                "email": "k@example.com",
+                "street": "Weg",
+                "house_number": "1",
+                "city": "Köln",
+                "postal_code": "50667",
+                "country": "Germany",
+            },
+        )
+        order = Order.objects.get()
+        self.assertRedirects(
+            response,
+            reverse("orders:pay", args=[order.pk]),
+            fetch_redirect_response=False,
+        )
+
+        kilo, plain = order.items.order_by("-weight_grams")
+        self.assertEqual(
+            (
+                kilo.variant,
+                kilo.unit_price,
+                kilo.weight_grams,
+                kilo.quantity,
+                kilo.product_name_snapshot,
+            ),
+            (self.kilo, Decimal("31.00"), 1000, 2, "Kivu (1kg)"),
+        )
+        self.assertEqual(
+            (plain.variant, plain.unit_price, plain.weight_grams),
+            (None, self.product.price, 250),
+        )
+        self.assertEqual(order.subtotal, Decimal("62.00") + self.product.price)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Nyamasheke", sku="NYA-1", cost_price=Decimal("8.00"), weight_grams=250
+        )
+        ProductBatch.objects.create(
+            product=self.product,
+            quantity_grams=500,
+            remaining_grams=500,
+            unit_cost=Decimal("4.00"),
+        )
+        ProductBatch.objects.create(
+            product=self.product,
+            quantity_grams=1000,
+            remaining_grams=1000,
+            unit_cost=Decimal("6.00"),
+        )
+        self.fulfilled = self._order("fulfilled", [("whole", 1), ("espresso", 2)])
+        fulfil_order_stock(self.fulfilled)
+        self.open = self._order("new", [("filter", 1)])
+        self.staff = User.objects.create_user("exporter", password="pw", is_staff=True)
+
+    def _order(self, status, lines):
+        order = Order.objects.create(
+            full_name="Export",
+            email="export@example.com",
+            street="S",
+            city="Kigali",
+            postal_code="1",
+            status=status,
+        )
+        for grind, quantity in lines:
+            OrderItem.objects.create(
+                order=order,
+                product=self.product,
+                product_name_snapshot=self.product.name,
+                unit_price=Decimal("9.99"),
+                quantity=quantity,
+                grind=grind,
+                weight_grams=250,
+            )
+        return order
+
+    def test_staff_csv_export_streams_filtered_rows_with_cogs(self):
+        url = reverse("orders:staff_order_export")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {"status": "fulfilled", "cogs": "1"})
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment;", response["Content-Disposition"])
+        rows = list(
+            csv.DictReader(b"".join(response.streaming_content).decode().splitlines())
+        )
+
+        self.assertEqual([row["grind"] for row in rows], ["whole", "espresso"])
+        # FIFO per line: 250 g at 4.00/kg, then 250 g at 4.00/kg + 250 g at 6.00/kg
+        self.assertEqual([row["cogs"] for row in rows], ["1.00", "2.50"])
+        self.assertEqual([row["line_total"] for row in rows], ["9.99", "19.98"])
+        self.assertEqual(rows[1]["margin"], "17.48")
+        self.assertEqual(self.client.get(url, {"format": "xml"}).status_code, 400)
+
+    def test_command_writes_ndjson(self):
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as handle:
+            call_command(
+                "export_orders", format="ndjson", chunk_size=1, output=handle.name
+            )
+            rows = [json.loads(line) for line in open(handle.name, encoding="utf-8")]
+        self.assertEqual(
+            [row["order_id"] for row in rows], [self.fulfilled.pk] * 2 + [self.open.pk]
+        )
+        self.assertEqual(rows[2]["unit_price"], "9.99")
+        self.assertNotIn("cogs", rows[0])
+
+        out = StringIO()
+        call_command("export_orders", status="new", cogs=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith(",,"))  # not fulfilled yet: no COGS
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+)
+class OrderCostingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.kivu = Product.objects.create(
+            name="Kivu", sku="KIV-1", cost_price=Decimal("4.00"), weight_grams=250
+        )
+        self.huye = Product.objects.create(
+            name="Huye", sku="HUY-1", cost_price=Decimal("5.00"), weight_grams=500
+        )
+        self.old = ProductBatch.objects.create(
+            product=self.kivu,
+            quantity_grams=500,
+            remaining_grams=500,
+            unit_cost=Decimal("4.00"),
+        )
+        self.new = ProductBatch.objects.create(
+            product=self.kivu,
+            quantity_grams=1000,
+            remaining_grams=1000,
+            unit_cost=Decimal("6.00"),
+        )
+        ProductBatch.objects.create(
+            product=self.huye,
+            quantity_grams=400,
+            remaining_grams=400,
+            unit_cost=Decimal("10.00"),
+        )
+
+    def _order(self, lines, status="paid"):
+        order = Order.objects.create(
+            full_name="Margin",
+            email="margin@example.com",
+            street="S",
+            city="Kigali",
+            postal_code="1",
+            status=status,
+        )
+        for product, quantity, price in lines:
+            OrderItem.objects.create(
+                order=order, product=product, product_name_snapshot=product.name,
+                unit_price=price, quantity=quantity, weight_grams=product.weight_grams,
+            )
+        return order
+
+    def _fulfil(self, order):
+        fulfil_order_stock(order)
+        order.status = "fulfilled"
+        order.save(update_fields=["status"])
+
+    def test_fulfilment_costs_each_line_fifo_by_batch(self):
+        order = self._order(
+            [
+                (self.kivu, 1, Decimal("9.00")),
+                (self.kivu, 2, Decimal("8.00")),
+                (self.huye, 1, Decimal("20.00")),
+            ]
+        )
+        self._fulfil(order)
+        first, second, huye = order.items.order_by("pk")
+
+        costs = OrderItemCost.objects.order_by("pk").values_list(
+            "order_item", "batch", "grams", "unit_cost"
+        )
+        self.assertEqual(list(costs), [
+            (first.pk, self.old.pk, 250, Decimal("4.00")),
+            (second.pk, self.old.pk, 250, Decimal("4.00")),
+            (second.pk, self.new.pk, 250, Decimal("6.00")),
+            (huye.pk, huye.product.batches.get().pk, 400, Decimal("10.00")),
+            (huye.pk, None, 100, Decimal("0.00")),  # not covered by any batch
+        ])
+        recorded = list(costs.all())
+        OrderItemCost.objects.all().delete()
+        call_command("rebuild_order_costs", stdout=StringIO())
+        self.assertEqual(list(costs.all()), recorded)
+
+        rows = {row["label"]: row for row in margin_report("product")}
+        self.assertEqual(
+            (rows["Kivu"]["revenue"], rows["Kivu"]["cogs"]),
+            (Decimal("25.00"), Decimal("3.50")),
+        )
+        self.assertEqual(
+            (rows["Huye"]["cogs"], rows["Huye"]["margin"]),
+            (Decimal("4.00"), Decimal("16.00")),
+        )
+        [by_order] = margin_report("order")
+        self.assertEqual(
+            (by_order["key"], by_order["margin"]), (order.pk, Decimal("37.50"))
+        )
+
+    def test_unreserved_and_uncosted_orders_do_not_skew_margins(self):
+        costed = self._order([(self.kivu, 1, Decimal("9.00"))])
+        self._fulfil(costed)  # paid without a reservation
+        self.assertEqual(StockBalance.objects.get(product=self.kivu).reserved_grams, 0)
+        # Fulfilled but never costed.
+        self._order([(self.kivu, 1, Decimal("9.00"))], status="fulfilled")
+
+        self.assertEqual([row["key"] for row in margin_report("order")], [costed.pk])
+        self.assertEqual(margin_report("product")[0]["revenue"], Decimal("9.00"))
+
+    def test_monthly_rollups_are_cached_until_an_order_changes(self):
+        self._fulfil(self._order([(self.kivu, 2, Decimal("9.00"))]))
+        months = monthly_margins(months=3)
+        self.assertEqual(
+            [row["revenue"] for row in months],
+            [Decimal("0.00"), Decimal("0.00"), Decimal("18.00")],
+        )
+        self.assertEqual(months[-1]["cogs"], Decimal("2.00"))
+        with self.assertNumQueries(0):
+            monthly_margins(months=3)
+
+        self._fulfil(self._order([(self.kivu, 1, Decimal("9.00"))]))
+        self.assertEqual(monthly_margins(months=3)[-1]["cogs"], Decimal("3.50"))
+
+    def test_staff_margin_report(self):
+        self._fulfil(self._order([(self.kivu, 1, Decimal("9.00"))]))
+        url = reverse("orders:staff_margin_report")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(
+            User.objects.create_user("margins", password="pw", is_staff=True)
+        )
+        response = self.client.get(url, {"group": "month"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["totals"]["margin"], Decimal("8.00"))
+        self.assertEqual(len(response.context["rows"]), 1)
+        self.assertEqual(
+            self.client.get(url, {"date_from": "2025-02-30"}).status_code, 400
+        )
+
+        # The order list links to the report instead of aggregating margins.
+        response = self.client.get(
+            reverse("orders:staff_order_list"), {"date_from": "2025-01-01"}
+        )
+        self.assertNotIn("fulfilled_margin", response.context)
+        self.assertContains(response, f"{url}?date_from=2025-01-01&amp;date_to=")
@@ -12,23 +12,59 @@ urlpatterns = [
     path(
         "staff/orders/<int:order_id>/picklist/",
         views.order_picklist,
-        name="order_picklist"
+        name="order_picklist",
     ),
     path(
         "staff/orders/<int:order_id>/picklist/pdf/",
         order_picklist_pdf,
-        name="order_picklist_pdf"
+        name="order_picklist_pdf",
     ),
     path("staff/orders/", views.staff_order_list, name="staff_order_list"),
+    path("staff/orders/export/", views.staff_order_export, name="staff_order_export"),
+    path(
+        "staff/orders/margins/", views.staff_margin_report, name="staff_margin_report"
+    ),
     path("staff/orders/<int:pk>/", views.staff_order_detail, name="staff_order_detail"),
-    path("staff/orders/<int:pk>/update/", views.staff_order_update, name="staff_order_update"),
-    path("staff/orders/<int:pk>/delete/", views.staff_order_delete, name="staff_order_delete"),
-    path("staff/fulfillment/", views.fulfillment_paid_orders, name="fulfillment_paid_orders"),
-    path("staff/orders/<int:order_id>/fulfill/", views.mark_order_fulfilled, name="mark_order_fulfilled"),
-    path("staff/fulfillment/recent/", views.fulfillment_recently_fulfilled, name="fulfillment_recent"),
+    path(
+        "staff/orders/<int:pk>/update/",
+        views.staff_order_update,
+        name="staff_order_update",
+    ),
+    path(
+        "staff/orders/<int:pk>/delete/",
+        views.staff_order_delete,
+        name="staff_order_delete",
+    ),
+    path(
+        "staff/fulfillment/",
+        views.fulfillment_paid_orders,
+        name="fulfillment_paid_orders",
+    ),
+    path(
+        "staff/orders/<int:order_id>/fulfill/",
+        views.mark_order_fulfilled,
+        name="mark_order_fulfilled",
+    ),
+    path(
+        "staff/fulfillment/recent/",
+        views.fulfillment_recently_fulfilled,
+        name="fulfillment_recent",
+    ),
     path("account/orders/", views.my_orders, name="my_orders"),
-    path("account/orders/<int:order_id>/", views.my_order_detail, name="my_order_detail"),
-    path("account/orders/<int:order_id>/edit/", views.my_order_edit, name="my_order_edit"),
-    path("account/orders/<int:order_id>/delete/", views.my_order_delete, name="my_order_delete"),
-    path("continue-payment/<int:order_id>/", views.continue_payment, name="continue_payment"),
+    path(
+        "account/orders/<int:order_id>/", views.my_order_detail, name="my_order_detail"
+    ),
+    path(
+        "account/orders/<int:order_id>/edit/", views.my_order_edit, name="my_order_edit"
+    ),
+    path(
+        "account/orders/<int:order_id>/delete/",
+        views.my_order_delete,
+        name="my_order_delete",
+    ),
+    path(
+        "continue-payment/<int:order_id>/",
+        views.continue_payment,
+        name="continue_payment",
+    ),
 ]
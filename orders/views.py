@@ -2,21 +2,37 @@
 import json
 import logging
 import stripe
+from asgiref.sync import sync_to_async
 from decimal import Decimal, ROUND_HALF_UP
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
+from django.db import IntegrityError, transaction
 
 from django.contrib import messages
 
-from django.shortcuts import get_object_or_404, redirect, render
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.urls import reverse
 
-from products.models import Product
-from cart.utils import cart_from_session, compute_summary
+from products.stock import fulfil_order_stock
+from cart.utils import cart_from_session, compute_summary, resolve_cart
+from .costing import (
+    MARGIN_GROUPS,
+    margin_orders,
+    margin_report,
+    margin_totals,
+    monthly_margins,
+)
+from .exports import EXPORT_FORMATS, export_queryset, export_rows, stream_export
 from .forms import CheckoutForm, StaffOrderForm, OrderCustomerEditForm
-from .models import Order, OrderItem
+from .models import Order, OrderItem, ProcessedWebhookEvent
+from .payments import (
+    book_status_change,
+    mark_order_cancelled,
+    mark_order_paid,
+    mark_order_refunded,
+)
+from .stripe_gateway import get_gateway
 from django.contrib.admin.views.decorators import staff_member_required
 
 from reportlab.pdfgen import canvas
@@ -39,14 +55,22 @@ from django.contrib.auth.decorators import login_required, permission_required,
 from django.http import HttpResponseForbidden, Http404
 
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.db.models import F, Sum, DecimalField, ExpressionWrapper, Q
 from django.views.decorators.http import require_POST
 from datetime import timedelta
 from .emails import send_order_pending_email
 from .emails import send_order_paid_notifications
+from versohnung_und_vergebung_kaffee.metrics import (
+    CHECKOUT_SECONDS,
+    PAYMENT_INTENT_CREATE_SECONDS,
+    PDF_RENDER_SECONDS,
+    WEBHOOK_SECONDS,
+)
+from versohnung_und_vergebung_kaffee.routers import read_from_replica
 
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.STRIPE_SECRET_KEY
+MARGIN_REPORT_ROWS = 200
 
 
 def _to_cents(amount_decimal: Decimal) -> int:
@@ -55,6 +79,7 @@ def _to_cents(amount_decimal: Decimal) -> int:
     return int((amt * 100).to_integral_value(rounding=ROUND_HALF_UP))
 
 
+@CHECKOUT_SECONDS.timed()
 @transaction.atomic
 def checkout(request):
     cart = cart_from_session(request.session)
@@ -65,6 +90,16 @@ def checkout(request):
     if request.method == "POST":
         form = CheckoutForm(request.POST)
         if form.is_valid():
+            # Re-price every line from its current product / pack variant
+            lines, removed = resolve_cart(cart)
+            request.session.modified = True
+            for name in removed:
+                messages.warning(
+                    request, f"Item '{name}' is no longer available and was skipped."
+                )
+            if not cart:
+                return redirect("cart:detail")
+
             # 1) Create Order (pending)
             order = Order.objects.create(
                 user=request.user if request.user.is_authenticated else None,
@@ -81,28 +116,26 @@ def checkout(request):
 
             # 2) Copy items from session cart into OrderItems + compute totals
             items, subtotal, shipping, total = compute_summary(cart)
+            order_items = []
             for item in items:
-                try:
-                    product_slug = item.get("product_slug") or item.get("slug")
-                    product = Product.objects.get(slug=product_slug, is_active=True)
-                except Product.DoesNotExist:
-                    messages.warning(
-                        request,
-                        f"Item '{item['name']}' is no longer available and was skipped."
+                product, variant = lines[item["key"]]
+                order_items.append(
+                    OrderItem(
+                        order=order,
+                        product=product,
+                        variant=variant,
+                        product_name_snapshot=(
+                            f"{product.name} ({variant.name})"
+                            if variant
+                            else product.name
+                        ),
+                        unit_price=item["price"],
+                        quantity=item["quantity"],
+                        grind=item["grind"],
+                        weight_grams=item["weight_grams"] or product.weight_grams,
                     )
-                    continue
-
-                name_snapshot = product.name
-
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    product_name_snapshot=name_snapshot,
-                    unit_price=item["price"],
-                    quantity=item["quantity"],
-                    grind=item["grind"],
-                    weight_grams=item["weight_grams"] or product.weight_grams,
                 )
+            OrderItem.objects.bulk_create(order_items)
 
             order.subtotal = subtotal
             order.shipping = shipping
@@ -120,16 +153,21 @@ def checkout(request):
             extra = f" +{len(items) - 1} more" if len(items) > 1 else ""
             pi_description = f"VV Kaffee - {first_name}{extra}"
 
-            intent = stripe.PaymentIntent.create(
-                amount=_to_cents(order.total),
-                currency="eur",
-                metadata={"order_id": str(order.id), "email": order.email},
-                receipt_email=order.email,
-                description=pi_description,
-                automatic_payment_methods={"enabled": True},
-            )
+            with PAYMENT_INTENT_CREATE_SECONDS.time():
+                intent = get_gateway().create_payment_intent(
+                    order.id,
+                    amount=_to_cents(order.total),
+                    currency="eur",
+                    metadata={"order_id": str(order.id), "email": order.email},
+                    receipt_email=order.email,
+                    description=pi_description,
+                    automatic_payment_methods={"enabled": True},
+                )
             order.payment_intent_id = intent.id
-            order.save(update_fields=["payment_intent_id"])
+            order.set_client_secret(intent.client_secret)
+            order.save(
+                update_fields=["payment_intent_id", "payment_client_secret_encrypted"]
+            )
 
             # 5) Clear session cart
             request.session["cart"] = {}
@@ -167,14 +205,20 @@ def checkout(request):
     )
 
 
-def pay(request, order_id: int):
-    if request.user.is_authenticated:
-        order = get_object_or_404(Order, pk=order_id, user=request.user)
+async def pay(request, order_id: int):
+    user = await request.auser()
+    # auser() and the lazy request.user cache separately; share the loaded
+    # user so the (sync) template context doesn't query it again.
+    request.user = user
+    orders = Order.objects.prefetch_related("items")
+    if user.is_authenticated:
+        order = await aget_object_or_404(orders, pk=order_id, user=user)
     else:
-        order = get_object_or_404(Order, pk=order_id, user__isnull=True)
+        order = await aget_object_or_404(orders, pk=order_id, user__isnull=True)
 
-    # Check for items
-    if order.items.count() == 0:
+    # Check for items (prefetched together with the order)
+    items = list(order.items.all())
+    if not items:
         messages.error(request, "This order has no items and cannot be paid.")
         return redirect("orders:my_orders")  # Or another appropriate page
 
@@ -185,10 +229,8 @@ def pay(request, order_id: int):
 
     # Build a clean list of items for display
     order_items = []
-    subtotal = Decimal("0.00")
-    for oi in order.items.select_related("product").all():
+    for oi in items:
         line_total = (oi.unit_price * oi.quantity).quantize(Decimal("0.01"))
-        subtotal += line_total
         order_items.append({
             "name": oi.product_name_snapshot,
             "quantity": oi.quantity,
@@ -198,11 +240,18 @@ def pay(request, order_id: int):
             "line_total": line_total,
         })
 
-    # fetch PI client secret
-    intent = stripe.PaymentIntent.retrieve(order.payment_intent_id)
-    client_secret = intent.client_secret
+    # Client secret is stored at checkout; only older orders need Stripe
+    client_secret = order.client_secret
+    if not client_secret:
+        intent = await get_gateway().retrieve_payment_intent_async(
+            order.payment_intent_id
+        )
+        client_secret = intent.client_secret
+        order.set_client_secret(client_secret)
+        await order.asave(update_fields=["payment_client_secret_encrypted"])
 
-    return render(request, "orders/pay.html", {
+    # Context processors read the session/cart, so render in a thread.
+    return await sync_to_async(render)(request, "orders/pay.html", {
         "order": order,
         "order_items": order_items,
         "subtotal": order.subtotal,
@@ -219,45 +268,128 @@ def continue_payment(request, order_id):
     return redirect("orders:pay", order_id=order.id)
 
 
-def thank_you(request, order_id: int):
-    order = get_object_or_404(Order.objects.prefetch_related("items__product"), pk=order_id)
+def _mark_paid_and_notify(order):
+    if mark_order_paid(order):
+        logger.warning("Order %s reconciled to PAID on thank_you", order.id)
+
+        # ✅ send paid email here too
+        send_order_paid_notifications(order)
+
 
-    if order.status != "paid":
+async def thank_you(request, order_id: int):
+    order = await aget_object_or_404(
+        Order.objects.prefetch_related("items__product"), pk=order_id
+    )
+
+    if not order.is_paid():
         pi_id = request.GET.get("payment_intent") or order.payment_intent_id
         if pi_id:
             try:
-                pi = stripe.PaymentIntent.retrieve(pi_id)
+                pi = await get_gateway().retrieve_payment_intent_async(pi_id)
                 if pi.status == "succeeded":
-                    for oi in order.items.select_related("product").all():
-                        p = oi.product
-                        if p and p.stock is not None:
-                            new_stock = max(0, p.stock - oi.quantity)
-                            if new_stock != p.stock:
-                                p.stock = new_stock
-                                p.save(update_fields=["stock"])
-                    order.status = "paid"
-                    order.save(update_fields=["status"])
-                    logger.warning("Order %s reconciled to PAID on thank_you", order.id)
-
-                    # ✅ send paid email here too
-                    send_order_paid_notifications(order)
+                    await sync_to_async(_mark_paid_and_notify)(order)
             except Exception:
                 logger.exception("Thank_you reconcile error for order %s", order.id)
 
-    return render(request, "orders/thank_you.html", {"order": order})
+    return await sync_to_async(render)(
+        request, "orders/thank_you.html", {"order": order}
+    )
 
 
+def _order_for_intent(payment_intent_id, order_id=None):
+    """Lock the order behind a PaymentIntent, preferring the metadata id."""
+    orders = Order.objects.select_for_update()
+    if order_id:
+        return orders.filter(pk=order_id).first()
+    if payment_intent_id:
+        return orders.filter(payment_intent_id=payment_intent_id).first()
+    return None
+
+
+def _handle_payment_succeeded(intent):
+    metadata = intent.get("metadata") or {}
+    order_id = metadata.get("order_id")
+    if not order_id:
+        logger.warning("No order_id in PI %s metadata", intent.get("id"))
+        return
+
+    order = _order_for_intent(intent.get("id"), order_id)
+    if order is None:
+        logger.warning("Order %s not found for PI %s", order_id, intent.get("id"))
+        return
+
+    if mark_order_paid(order):
+        logger.warning("Order %s marked PAID and stock adjusted", order.id)
+        send_order_paid_notifications(order)
+
+
+def _handle_payment_failed(intent):
+    metadata = intent.get("metadata") or {}
+    order = _order_for_intent(intent.get("id"), metadata.get("order_id"))
+    error = intent.get("last_payment_error") or {}
+    # The order stays "new": the customer can retry with the same PaymentIntent.
+    logger.warning(
+        "Payment failed for order %s (PI %s): %s",
+        order.id if order else metadata.get("order_id"),
+        intent.get("id"),
+        error.get("message") or error.get("code") or "unknown error",
+    )
+
+
+def _handle_payment_canceled(intent):
+    metadata = intent.get("metadata") or {}
+    order = _order_for_intent(intent.get("id"), metadata.get("order_id"))
+    if order and mark_order_cancelled(order):
+        logger.warning(
+            "Order %s cancelled (PI %s canceled)", order.id, intent.get("id")
+        )
+
+
+def _handle_charge_refunded(charge):
+    if not charge.get("refunded"):
+        # Partial refunds keep the order paid; staff handle them manually.
+        logger.warning("Partial refund on charge %s", charge.get("id"))
+        return
+    metadata = charge.get("metadata") or {}
+    order = _order_for_intent(charge.get("payment_intent"), metadata.get("order_id"))
+    if order and mark_order_refunded(order):
+        logger.warning(
+            "Order %s marked REFUNDED (charge %s)", order.id, charge.get("id")
+        )
+
+
+STRIPE_EVENT_HANDLERS = {
+    "payment_intent.succeeded": _handle_payment_succeeded,
+    "payment_intent.payment_failed": _handle_payment_failed,
+    "payment_intent.canceled": _handle_payment_canceled,
+    "charge.refunded": _handle_charge_refunded,
+}
 
 
-@csrf_exempt  # Stripe posts from outside; skip CSRF
 @transaction.atomic
-def stripe_webhook(request):
+def _process_stripe_event(event_id, etype, obj):
+    """Record the event and run its handler in one transaction."""
+    # The event id commits (or rolls back) together with the order changes,
+    # so a Stripe retry becomes one index lookup.
+    if event_id:
+        try:
+            with transaction.atomic():
+                ProcessedWebhookEvent.objects.create(
+                    event_id=event_id, event_type=etype
+                )
+        except IntegrityError:
+            logger.info("Stripe webhook %s already processed", event_id)
+            return
+    STRIPE_EVENT_HANDLERS[etype](obj)
+
+
+@csrf_exempt  # Stripe posts from outside; skip CSRF
+async def stripe_webhook(request):
     # 1) Verify signature
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
-    endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
+        event = get_gateway().construct_event(payload, sig_header)
     except ValueError:
         logger.warning("Stripe webhook: invalid payload")
         return HttpResponseBadRequest("Invalid payload")
@@ -266,42 +398,17 @@ def stripe_webhook(request):
         return HttpResponseBadRequest("Invalid signature")
 
     etype = event["type"]
-    logger.warning("Stripe webhook received: %s", etype)
-
-    # 2) Handle PI success (Payment Element flow)
-    if etype == "payment_intent.succeeded":
-        intent = event["data"]["object"]
-        metadata = intent.get("metadata") or {}
-        order_id = metadata.get("order_id")
-        if not order_id:
-            logger.warning("No order_id in PI %s metadata", intent.get("id"))
-            return HttpResponse(status=200)
-
-        try:
-            order = Order.objects.select_for_update().get(pk=order_id)
-        except Order.DoesNotExist:
-            logger.warning("Order %s not found for PI %s", order_id, intent.get("id"))
-            return HttpResponse(status=200)
-
-        if order.status != "paid":
-            # decrement stock
-            for oi in order.items.select_related("product").all():
-                p = oi.product
-                if p and p.stock is not None:
-                    new_stock = max(0, p.stock - oi.quantity)
-                    if new_stock != p.stock:
-                        p.stock = new_stock
-                        p.save(update_fields=["stock"])
-
-            order.status = "paid"
-            order.save(update_fields=["status"])
-            logger.warning("Order %s marked PAID and stock adjusted", order.id)
-            
-            send_order_paid_notifications(order)
+    event_id = event.get("id")
+    logger.warning("Stripe webhook received: %s %s", etype, event_id or "")
 
+    if etype not in STRIPE_EVENT_HANDLERS:
         return HttpResponse(status=200)
 
-    # 3) Ignore other events
+    # 2) Record and dispatch on the shared DB thread (handlers send email too)
+    with WEBHOOK_SECONDS.time(event_type=etype):
+        await sync_to_async(_process_stripe_event)(
+            event_id, etype, event["data"]["object"]
+        )
     return HttpResponse(status=200)
 
 
@@ -485,7 +592,8 @@ def order_picklist_pdf(request, order_id):
     elements.append(Paragraph(f"<b>Grand total:</b> {_fmt_money(grand_total)}", normal))
 
     # Build with footer on each page
-    doc.build(elements, onFirstPage=_draw_footer, onLaterPages=_draw_footer)
+    with PDF_RENDER_SECONDS.time(document="picklist"):
+        doc.build(elements, onFirstPage=_draw_footer, onLaterPages=_draw_footer)
     return response
 
 
@@ -539,16 +647,11 @@ def mark_order_fulfilled(request, order_id):
         # Ignore or show error if it's not in a packable state
         return redirect("orders:fulfillment_paid_orders")
 
-    # Apply FIFO consumption on product batches before marking fulfilled
-    for item in order.items.select_related("product").all():
-        product = item.product
-        if not product:
-            continue
-        grams_needed = Decimal(item.weight_grams or 0) * Decimal(item.quantity or 0)
-        try:
-            product.consume_grams_fifo(grams_needed)
-        except Exception:
-            logger.exception("Failed to consume FIFO stock for product %s", product.id)
+    # Release the reservation and consume the grams from batches (FIFO)
+    try:
+        fulfil_order_stock(order)
+    except Exception:
+        logger.exception("Failed to record fulfilment stock for order %s", order.id)
 
     order.status = "fulfilled"
     order.fulfilled_at = timezone.now()
@@ -644,6 +747,7 @@ def my_order_delete(request, order_id: int):
 
 @login_required
 @staff_required
+@read_from_replica
 def staff_order_list(request):
     orders = (
         Order.objects.select_related("user")
@@ -746,6 +850,63 @@ def staff_order_list(request):
     )
 
 
+@login_required
+@staff_required
+@read_from_replica
+def staff_margin_report(request):
+    """Revenue, FIFO cost and margin of fulfilled orders per product, month or order."""
+    group = request.GET.get("group")
+    if group not in MARGIN_GROUPS:
+        group = "product"
+    try:
+        date_from = parse_date(request.GET.get("date_from") or "")
+        date_to = parse_date(request.GET.get("date_to") or "")
+    except ValueError:
+        return HttpResponseBadRequest("Invalid date.")
+    orders = margin_orders(date_from, date_to)
+    return render(
+        request,
+        "orders/staff_margin_report.html",
+        {
+            "group": group,
+            "groups": MARGIN_GROUPS,
+            "rows": margin_report(group, orders)[:MARGIN_REPORT_ROWS],
+            "row_limit": MARGIN_REPORT_ROWS,
+            "totals": margin_totals(orders),
+            "months": monthly_margins(),
+            "date_from": date_from.isoformat() if date_from else "",
+            "date_to": date_to.isoformat() if date_to else "",
+        },
+    )
+
+
+@login_required
+@staff_required
+def staff_order_export(request):
+    """Stream the (filtered) order items as CSV or NDJSON, one row per item."""
+    fmt = request.GET.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Unknown export format.")
+    try:
+        date_from = parse_date(request.GET.get("date_from") or "") or None
+        date_to = parse_date(request.GET.get("date_to") or "") or None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid date.")
+    include_cogs = request.GET.get("cogs") == "1"
+
+    items = export_queryset(
+        status=request.GET.get("status"), date_from=date_from, date_to=date_to
+    )
+    response = StreamingHttpResponse(
+        stream_export(export_rows(items, include_cogs=include_cogs), fmt, include_cogs),
+        content_type=EXPORT_FORMATS[fmt],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="orders-{timezone.localdate():%Y%m%d}.{fmt}"'
+    )
+    return response
+
+
 @login_required
 @staff_required
 def staff_order_detail(request, pk: int):
@@ -762,7 +923,9 @@ def staff_order_update(request, pk: int):
     if request.method == "POST":
         form = StaffOrderForm(request.POST, instance=order)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                book_status_change(order, form.original_status)
             messages.success(request, "Order updated.")
             return redirect("orders:staff_order_detail", pk=order.pk)
     else:
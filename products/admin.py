@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from .models import Category, Product
+from .models import (
+    Category,
+    LowStockAlert,
+    Product,
+    ProductPriceHistory,
+    StockBalance,
+    StockForecast,
+    StockMovement,
+)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -37,3 +45,122 @@ class ProductAdmin(admin.ModelAdmin):
     def average_rating_display(self, obj):
         rating = obj.average_rating()
         return f"{rating}★" if rating is not None else "—"
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "product",
+        "kind",
+        "on_hand_grams",
+        "reserved_grams",
+        "batch",
+        "order",
+        "note",
+    )
+    list_filter = ("kind",)
+    search_fields = ("product__name", "product__sku", "note")
+    list_select_related = ("product", "batch", "order")
+    date_hierarchy = "created_at"
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StockBalance)
+class StockBalanceAdmin(admin.ModelAdmin):
+    list_display = (
+        "product",
+        "on_hand_grams",
+        "reserved_grams",
+        "available_grams",
+        "updated_at",
+    )
+    search_fields = ("product__name", "product__sku")
+    list_select_related = ("product",)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProductPriceHistory)
+class ProductPriceHistoryAdmin(admin.ModelAdmin):
+    list_display = (
+        "valid_from",
+        "product",
+        "variant",
+        "price",
+        "cost_price",
+        "markup_percent",
+        "source",
+    )
+    list_filter = ("source",)
+    search_fields = ("product__name", "product__sku", "variant__sku")
+    list_select_related = ("product", "variant")
+    date_hierarchy = "valid_from"
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StockForecast)
+class StockForecastAdmin(admin.ModelAdmin):
+    list_display = (
+        "product",
+        "daily_grams",
+        "available_grams",
+        "days_of_cover",
+        "reorder_grams",
+        "reorder_by",
+        "computed_at",
+    )
+    search_fields = ("product__name", "product__sku")
+    list_select_related = ("product",)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(LowStockAlert)
+class LowStockAlertAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "product",
+        "available_grams",
+        "threshold_grams",
+        "sent_at",
+    )
+    search_fields = ("product__name", "product__sku")
+    list_select_related = ("product",)
+    date_hierarchy = "created_at"
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
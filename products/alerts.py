@@ -0,0 +1,120 @@
+"""
+Low-stock alerts on threshold crossings.
+
+``record_movements`` passes the products it just moved, with their net
+on-hand and reserved deltas, to ``detect_low_stock`` in the same
+transaction. One query reads the new balances of those products that
+have a threshold. The balance before the movements is the new one less
+the deltas, so crossings are found without scanning other products.
+
+``StockBalance.low_stock_alerted`` arms and disarms the alert. A product
+that falls to its threshold gets one ``LowStockAlert``; further sales
+below the threshold stay quiet. Once available stock is back above the
+threshold the flag is cleared and the next crossing alerts again. The
+balance rows are locked by the movements' UPDATE until commit, so
+concurrent movements always see each other's flag.
+The alerts are mailed to ``LOW_STOCK_ALERT_EMAILS`` after the commit.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.utils import timezone
+
+from versohnung_und_vergebung_kaffee.metrics import track_email
+from .models import LowStockAlert, Product, StockBalance
+
+logger = logging.getLogger(__name__)
+
+
+def threshold_grams(threshold, unit, weight_grams) -> int:
+    """A product's threshold in grams (``unit`` thresholds count packs)."""
+    if unit == Product.GRAMS:
+        return threshold
+    return threshold * (weight_grams or 0)
+
+
+def detect_low_stock(deltas) -> list:
+    """
+    Raise an alert for every product in ``deltas`` (``{product_id:
+    (on_hand_delta, reserved_delta)}``) whose available grams are now at
+    or below its threshold and that is not already alerted; re-arm the
+    ones that recovered. Returns the new alerts.
+    """
+    balances = StockBalance.objects.filter(
+        product_id__in=list(deltas), product__low_stock_threshold__isnull=False
+    ).values_list(
+        "product_id",
+        "on_hand_grams",
+        "reserved_grams",
+        "low_stock_alerted",
+        "product__low_stock_threshold",
+        "product__low_stock_unit",
+        "product__weight_grams",
+    )
+    crossed, recovered = {}, []
+    for pk, on_hand, reserved, alerted, threshold, unit, weight in balances:
+        limit = threshold_grams(threshold, unit, weight)
+        available = on_hand - reserved
+        before = available - (deltas[pk][0] - deltas[pk][1])
+        if available <= limit and (not alerted or before > limit):
+            crossed[pk] = (available, limit)
+        elif available > limit and alerted:
+            recovered.append(pk)
+
+    if recovered:
+        StockBalance.objects.filter(product_id__in=recovered).update(
+            low_stock_alerted=False
+        )
+    if not crossed:
+        return []
+    StockBalance.objects.filter(product_id__in=list(crossed)).update(
+        low_stock_alerted=True
+    )
+    alerts = LowStockAlert.objects.bulk_create([
+        LowStockAlert(product_id=pk, available_grams=available, threshold_grams=limit)
+        for pk, (available, limit) in sorted(crossed.items())
+    ])
+    ids = [alert.pk for alert in alerts]
+    transaction.on_commit(lambda: send_low_stock_alerts(ids))
+    return alerts
+
+
+def send_low_stock_alerts(alert_ids) -> int:
+    """Mail the unsent alerts among ``alert_ids`` in one message; returns how many."""
+    recipients = getattr(settings, "LOW_STOCK_ALERT_EMAILS", None) or getattr(
+        settings, "ORDER_NOTIFICATION_EMAILS", []
+    )
+    alerts = list(
+        LowStockAlert.objects.filter(pk__in=list(alert_ids), sent_at__isnull=True)
+        .select_related("product")
+        .order_by("product__name")
+    )
+    if not alerts:
+        return 0
+    if not recipients:
+        logger.info("No LOW_STOCK_ALERT_EMAILS; %s alert(s) not mailed", len(alerts))
+        return 0
+
+    lines = [
+        f"{alert.product.name} ({alert.product.sku}): {alert.available_grams} g "
+        f"available, threshold {alert.threshold_grams} g"
+        for alert in alerts
+    ]
+    try:
+        with track_email("low_stock_alert"):
+            send_mail(
+                subject=f"Low stock: {', '.join(a.product.name for a in alerts)}",
+                message="These products are running low:\n\n" + "\n".join(lines),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=recipients,
+            )
+    except Exception:
+        logger.exception("Low-stock alert email failed for %s alert(s)", len(alerts))
+        return 0
+    LowStockAlert.objects.filter(pk__in=[a.pk for a in alerts]).update(
+        sent_at=timezone.now()
+    )
+    return len(alerts)
@@ -0,0 +1,160 @@
+"""
+Sales velocity and reorder forecasting.
+
+``daily_sold_grams`` reads the grams sold per product and day by paid
+orders in one grouped query, and ``sales_matrix`` lays them out as a NumPy
+product x day array. ``forecast`` then works on all products at once:
+
+- 7- and 28-day moving averages of daily sales, blended into a velocity;
+- days of cover for the grams left in batches, less those held for paid
+  orders;
+- a reorder suggestion when the cover drops below the supplier lead time
+  plus a safety margin.
+
+A suggestion orders enough to cover the lead time plus the target cover,
+in whole packs. ``refresh_stock_forecasts`` stores the results in
+``StockForecast``. Run it nightly with ``manage.py forecast_stock``.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, NullIf, TruncDate
+from django.utils import timezone
+
+from .models import Product, ProductBatch, StockForecast
+
+# Orders whose grams count as sold (paid, whether shipped yet or not).
+SOLD_ORDER_STATUSES = {"paid", "pending_fulfillment", "fulfilled"}
+SHORT_WINDOW_DAYS, LONG_WINDOW_DAYS = 7, 28
+DEFAULT_HISTORY_DAYS = 56
+DEFAULT_LEAD_TIME_DAYS = 14
+DEFAULT_TARGET_COVER_DAYS = 28
+SAFETY_DAYS = 7
+
+
+def daily_sold_grams(start, end) -> list:
+    """``[(product_id, day, grams)]`` of paid orders created ``start``..``end``."""
+    from orders.models import OrderItem
+
+    weight = Coalesce(NullIf(F("weight_grams"), 0), F("product__weight_grams"))
+    rows = (
+        OrderItem.objects.filter(
+            order__status__in=SOLD_ORDER_STATUSES,
+            order__created_at__date__gte=start,
+            order__created_at__date__lte=end,
+            product__isnull=False,
+        )
+        .annotate(day=TruncDate("order__created_at"))
+        .values("product_id", "day")
+        .annotate(grams=Sum(F("quantity") * weight))
+        .order_by()
+    )
+    return [(row["product_id"], row["day"], row["grams"]) for row in rows]
+
+
+def sales_matrix(rows, product_ids, start, days) -> np.ndarray:
+    """Grams sold as a ``len(product_ids)`` x ``days`` array, day 0 = ``start``."""
+    index = {pk: position for position, pk in enumerate(product_ids)}
+    matrix = np.zeros((len(product_ids), days))
+    cells = [
+        (index[pk], (day - start).days, grams)
+        for pk, day, grams in rows
+        if pk in index and 0 <= (day - start).days < days
+    ]
+    if cells:
+        products, offsets, grams = (np.array(column) for column in zip(*cells))
+        np.add.at(matrix, (products, offsets), grams)
+    return matrix
+
+
+def _stock_levels():
+    """Active products with their batch grams left and grams held for paid orders."""
+    remaining = (
+        ProductBatch.objects.filter(product=OuterRef("pk"))
+        .values("product")
+        .annotate(grams=Sum("remaining_grams"))
+        .values("grams")
+    )
+    return list(
+        Product.objects.filter(is_active=True)
+        .annotate(
+            remaining=Coalesce(Subquery(remaining), 0),
+            reserved=Coalesce(F("stock_balance__reserved_grams"), 0),
+        )
+        .order_by("pk")
+        .values_list("pk", "weight_grams", "remaining", "reserved")
+    )
+
+
+def forecast(
+    today=None,
+    history_days=DEFAULT_HISTORY_DAYS,
+    lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+    target_cover_days=DEFAULT_TARGET_COVER_DAYS,
+) -> list:
+    """Unsaved ``StockForecast`` rows for every active product."""
+    today = today or timezone.localdate()
+    start = today - timedelta(days=history_days - 1)
+    levels = _stock_levels()
+    if not levels:
+        return []
+    ids, weights, remaining, reserved = (np.array(column) for column in zip(*levels))
+    sold = daily_sold_grams(start, today)
+    matrix = sales_matrix(sold, ids.tolist(), start, history_days)
+
+    short = matrix[:, -SHORT_WINDOW_DAYS:].mean(axis=1)
+    long = matrix[:, -LONG_WINDOW_DAYS:].mean(axis=1)
+    velocity = (short + long) / 2
+    available = np.maximum(remaining - reserved, 0)
+    selling = velocity > 0
+    cover = np.full(len(ids), np.inf)
+    cover[selling] = available[selling] / velocity[selling]
+
+    target = velocity * (lead_time_days + target_cover_days)
+    shortfall = np.maximum(target - available, 0)
+    shortfall[cover >= lead_time_days + SAFETY_DAYS] = 0
+    packs = np.where(weights > 0, weights, 1)
+    reorder = np.ceil(shortfall / packs) * packs
+    # The last day to order and still receive the goods before running out.
+    order_in = np.floor(np.clip(cover - lead_time_days, 0, None))
+
+    now = timezone.now()
+    return [
+        StockForecast(
+            product_id=int(ids[i]),
+            computed_at=now,
+            history_days=history_days,
+            sold_grams=int(matrix[i].sum()),
+            avg_7d_grams=float(short[i]),
+            avg_28d_grams=float(long[i]),
+            daily_grams=float(velocity[i]),
+            available_grams=int(available[i]),
+            days_of_cover=float(cover[i]) if np.isfinite(cover[i]) else None,
+            reorder_grams=int(reorder[i]),
+            reorder_by=today + timedelta(days=int(order_in[i])) if reorder[i] else None,
+        )
+        for i in range(len(ids))
+    ]
+
+
+def refresh_stock_forecasts(**options) -> list:
+    """Replace the stored forecasts with a fresh ``forecast(**options)``."""
+    rows = forecast(**options)
+    with transaction.atomic():
+        current = [row.product_id for row in rows]
+        StockForecast.objects.exclude(product_id__in=current).delete()
+        StockForecast.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=[
+                field.name
+                for field in StockForecast._meta.concrete_fields
+                if not field.primary_key
+            ],
+            batch_size=1000,
+        )
+    return rows
@@ -1,8 +1,10 @@
 from decimal import Decimal, ROUND_HALF_UP
 
 from django import forms
+from django.db import transaction
 
-from .models import Product, ProductBatch, PackVariant
+from .models import Category, Product, ProductBatch, PackVariant, StockMovement
+from .pricing import select_products
 
 
 class CommaDecimalField(forms.DecimalField):
@@ -36,10 +38,10 @@ class ProductForm(forms.ModelForm):
         label="Sale price (cost + markup%)",
     )
     weight_grams = forms.IntegerField(min_value=1)
-    stock = forms.IntegerField(
-        min_value=0,
+    stock_adjustment = forms.IntegerField(
         required=False,
-        error_messages={"min_value": "Inventory cannot be negative."},
+        label="Adjust stock (packs)",
+        help_text="Packs to add (+) or remove (-), e.g. after a stock count.",
     )
 
     class Meta:
@@ -60,7 +62,8 @@ class ProductForm(forms.ModelForm):
             "price",
             "weight_grams",
             "available_grinds",
-            "stock",
+            "low_stock_threshold",
+            "low_stock_unit",
             "is_active",
             "image",
             "description",
@@ -82,6 +85,39 @@ class ProductForm(forms.ModelForm):
             )
         return ",".join(values)
 
+    def clean_stock_adjustment(self):
+        change = self.cleaned_data.get("stock_adjustment") or 0
+        current = 0
+        if self.instance.pk:
+            current = (
+                Product.objects.filter(pk=self.instance.pk)
+                .values_list("stock", flat=True)
+                .first()
+                or 0
+            )
+        if current + change < 0:
+            raise forms.ValidationError("Inventory cannot be negative.")
+        return change
+
+    def save(self, commit=True):
+        """Save the product and book ``stock_adjustment`` in the stock ledger."""
+        if not commit:
+            return super().save(commit=False)
+        from .stock import record_movement
+
+        with transaction.atomic():
+            product = super().save()
+            change = self.cleaned_data.get("stock_adjustment")
+            if change:
+                record_movement(
+                    product,
+                    StockMovement.ADJUSTMENT,
+                    on_hand_grams=change * (product.weight_grams or 0),
+                    note="Adjusted on the staff product form",
+                )
+                product.refresh_stock()
+        return product
+
     def clean(self):
         cleaned = super().clean()
         cost = cleaned.get("cost_price") or Decimal("0")
@@ -114,3 +150,116 @@ class PackVariantForm(forms.ModelForm):
     class Meta:
         model = PackVariant
         fields = ["name", "sku", "pack_weight_grams", "price", "markup_percent", "is_active"]
+
+
+class CatalogueImportForm(forms.Form):
+    products_csv = forms.FileField(
+        required=False,
+        label="Products CSV",
+        help_text=(
+            "Columns: sku, name, cost_price, markup_percent, weight_grams, ... "
+            "Existing SKUs are updated."
+        ),
+    )
+    batches_csv = forms.FileField(
+        required=False,
+        label="Batch receipts CSV",
+        help_text=(
+            "Columns: sku, quantity_grams, remaining_grams (optional), unit_cost, note."
+        ),
+    )
+    dry_run = forms.BooleanField(
+        required=False, initial=True, label="Dry run (show changes, write nothing)"
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        if not cleaned.get("products_csv") and not cleaned.get("batches_csv"):
+            raise forms.ValidationError(
+                "Upload a products CSV, a batch receipts CSV or both."
+            )
+        return cleaned
+
+
+class RepricingForm(forms.Form):
+    COST_KEEP, COST_SET, COST_CHANGE = "keep", "set", "change"
+
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.all(), required=False, empty_label="All categories"
+    )
+    skus = forms.CharField(
+        required=False,
+        label="SKUs",
+        widget=forms.Textarea(attrs={"rows": 2}),
+        help_text="Optional; comma or newline separated.",
+    )
+    roast_type = forms.ChoiceField(
+        choices=[("", "Any roast")] + Product.ROAST_CHOICES, required=False
+    )
+    include_inactive = forms.BooleanField(
+        required=False, label="Include hidden products"
+    )
+    cost_mode = forms.ChoiceField(
+        choices=[
+            (COST_KEEP, "Keep cost"),
+            (COST_SET, "Set cost to (EUR)"),
+            (COST_CHANGE, "Change cost by (%)"),
+        ],
+        initial=COST_KEEP,
+    )
+    cost_value = CommaDecimalField(required=False, max_digits=8, decimal_places=2)
+    markup_percent = CommaDecimalField(
+        required=False,
+        min_value=0,
+        max_digits=5,
+        decimal_places=2,
+        help_text="Leave empty to keep each markup.",
+    )
+    variants = forms.BooleanField(required=False, label="Also reprice pack variants")
+    variant_markup_percent = CommaDecimalField(
+        required=False,
+        min_value=0,
+        max_digits=5,
+        decimal_places=2,
+        help_text="Leave empty to keep each variant's markup.",
+    )
+
+    def clean_skus(self):
+        raw = self.cleaned_data.get("skus") or ""
+        skus = (sku.strip() for sku in raw.replace("\n", ",").split(","))
+        return [sku for sku in skus if sku]
+
+    def clean(self):
+        cleaned = super().clean()
+        mode, value = cleaned.get("cost_mode"), cleaned.get("cost_value")
+        if mode != self.COST_KEEP and value is None:
+            self.add_error("cost_value", "Enter the new cost or the percentage change.")
+        if mode == self.COST_SET and value is not None and value < 0:
+            self.add_error("cost_value", "Cost cannot be negative.")
+        if mode == self.COST_CHANGE and value is not None and value <= -100:
+            self.add_error("cost_value", "A cost cannot drop by 100% or more.")
+        markup = cleaned.get("markup_percent")
+        if mode == self.COST_KEEP and markup is None and not cleaned.get("variants"):
+            raise forms.ValidationError(
+                "Choose a cost or markup change (or reprice variants)."
+            )
+        return cleaned
+
+    def reprice_kwargs(self):
+        """Arguments for ``products.pricing.reprice`` / ``reprice_preview``."""
+        data = self.cleaned_data
+        mode, value = data["cost_mode"], data["cost_value"]
+        return {
+            "cost_price": value if mode == self.COST_SET else None,
+            "cost_change_percent": value if mode == self.COST_CHANGE else None,
+            "markup_percent": data["markup_percent"],
+        }
+
+    def selected_products(self):
+        data = self.cleaned_data
+        return select_products(
+            category=data["category"].slug if data["category"] else None,
+            skus=data["skus"],
+            roast_type=data["roast_type"] or None,
+            include_inactive=data["include_inactive"],
+        )
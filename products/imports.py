@@ -0,0 +1,341 @@
+"""
+Bulk catalogue import from plain CSV: products (upserted by SKU) and batch
+receipts.
+
+Every row is validated with the staff form rules before anything is
+written. Products go in with one ``bulk_create(update_conflicts=True)``,
+batches with one ``bulk_create``, and the receipts are booked in the stock
+ledger in one pass, so stock is recalculated once per affected product
+rather than once per batch. New and changed prices are recorded in the
+price history in bulk too. A dry run returns the same report without
+writing.
+"""
+
+import csv
+import io
+
+from django import forms
+from django.db import transaction
+from django.forms.models import model_to_dict
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .forms import ProductBatchForm, ProductForm
+from .inventory import invalidate_inventory_totals
+from .models import Category, Product, ProductBatch, ProductPriceHistory, StockMovement
+from .sitemaps import invalidate_sitemap
+from .stock import record_movements
+
+PRODUCT_IMPORT_FIELDS = [
+    "name",
+    "sku",
+    "category",
+    "origin",
+    "farm",
+    "variety",
+    "altitude_masl",
+    "process",
+    "roast_type",
+    "tasting_notes",
+    "cost_price",
+    "markup_percent",
+    "weight_grams",
+    "available_grinds",
+    "is_active",
+    "description",
+]
+BATCH_IMPORT_FIELDS = ["sku", "quantity_grams", "remaining_grams", "unit_cost", "note"]
+CSV_BOOLEANS = {
+    "1": True,
+    "true": True,
+    "yes": True,
+    "0": False,
+    "false": False,
+    "no": False,
+}
+
+
+class CsvBooleanField(forms.Field):
+    """
+    Yes/no CSV cell: 1/0, true/false or yes/no, in any case. A checkbox
+    treats any non-empty string but "false" as ticked, so "0" and "no"
+    would import as True.
+    """
+
+    def to_python(self, value):
+        if isinstance(value, bool):  # unchanged value of an existing product
+            return value
+        try:
+            return CSV_BOOLEANS[str(value).strip().lower()]
+        except KeyError:
+            raise forms.ValidationError(
+                f"Enter 1/0, true/false or yes/no, not {value!r}.", code="invalid"
+            ) from None
+
+
+class ProductImportForm(ProductForm):
+    """
+    ``ProductForm`` rules for one CSV row. The category is given by name,
+    slug or id, and SKU uniqueness is not checked per row because existing
+    SKUs are updated.
+    """
+
+    price = None
+    stock_adjustment = None
+    category = forms.CharField(required=False)
+    is_active = CsvBooleanField()
+
+    class Meta(ProductForm.Meta):
+        fields = PRODUCT_IMPORT_FIELDS
+
+    def __init__(self, *args, categories=None, **kwargs):
+        self.categories = categories or {}
+        super().__init__(*args, **kwargs)
+
+    def clean_category(self):
+        value = (self.cleaned_data.get("category") or "").strip()
+        if not value:
+            return None
+        category = self.categories.get(value.lower())
+        if category is None:
+            raise forms.ValidationError(f"Unknown category: {value}")
+        return category
+
+    def validate_unique(self):
+        pass
+
+
+class ImportReport:
+    """Per-row outcome of an import: what changes (or would), and any errors."""
+
+    def __init__(self):
+        self.products = []  # {"row", "sku", "action", "changes"}
+        # {"row", "sku", "quantity_grams", "remaining_grams", "unit_cost"}
+        self.batches = []
+        self.errors = []  # (file, row, message)
+        self.applied = False
+
+    @property
+    def created(self):
+        return sum(1 for row in self.products if row["action"] == "create")
+
+    @property
+    def updated(self):
+        return sum(1 for row in self.products if row["action"] == "update")
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def read_csv(source):
+    """Rows of CSV text or bytes (UTF-8), comma or semicolon separated."""
+    if isinstance(source, bytes):
+        source = source.decode("utf-8-sig")
+    try:
+        dialect = csv.Sniffer().sniff(source.split("\n", 1)[0], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    return [
+        {(key or "").strip(): (value or "").strip() for key, value in row.items()}
+        for row in csv.DictReader(io.StringIO(source), dialect=dialect)
+    ]
+
+
+def _form_errors(form):
+    return [
+        f"{field}: {message}" if field != "__all__" else message
+        for field, messages in form.errors.items()
+        for message in messages
+    ]
+
+
+def _validate_products(rows, report):
+    """Clean product rows; returns ``[(row_number, existing_or_None, cleaned)]``."""
+    categories = {}
+    for category in Category.objects.all():
+        for key in (category.name, category.slug, str(category.pk)):
+            categories[key.lower()] = category
+    existing = Product.objects.in_bulk(
+        [row.get("sku", "") for row in rows], field_name="sku"
+    )
+
+    valid, seen = [], set()
+    for number, row in enumerate(rows, start=2):
+        sku = row.get("sku", "")
+        if sku in seen:
+            report.errors.append(("products", number, f"Duplicate SKU in file: {sku}"))
+            continue
+        seen.add(sku)
+        product = existing.get(sku)
+        data = model_to_dict(product or Product(), fields=PRODUCT_IMPORT_FIELDS)
+        # Empty cells keep the current (or default) value.
+        data.update(
+            {
+                key: value
+                for key, value in row.items()
+                if key in PRODUCT_IMPORT_FIELDS and value != ""
+            }
+        )
+        form = ProductImportForm(data, categories=categories)
+        if form.is_valid():
+            valid.append((number, product, form.cleaned_data))
+        else:
+            report.errors.extend(
+                ("products", number, message) for message in _form_errors(form)
+            )
+    return valid
+
+
+def _validate_batches(rows, known_skus, report):
+    """Clean batch rows; returns ``[(row_number, sku, cleaned)]``."""
+    existing = set(
+        Product.objects.filter(
+            sku__in={row.get("sku", "") for row in rows}
+        ).values_list("sku", flat=True)
+    )
+    valid = []
+    for number, row in enumerate(rows, start=2):
+        sku = row.get("sku", "")
+        if sku not in existing and sku not in known_skus:
+            report.errors.append(("batches", number, f"Unknown SKU: {sku}"))
+            continue
+        data = {
+            key: value
+            for key, value in row.items()
+            if key in BATCH_IMPORT_FIELDS and value != ""
+        }
+        # A new receipt is untouched.
+        data.setdefault("remaining_grams", data.get("quantity_grams"))
+        form = ProductBatchForm(data)
+        if form.is_valid():
+            valid.append((number, sku, form.cleaned_data))
+        else:
+            report.errors.extend(
+                ("batches", number, message) for message in _form_errors(form)
+            )
+    return valid
+
+
+def _unique_slugs(products):
+    """Give new products a slug that no other SKU already uses."""
+    taken = dict(
+        Product.objects.filter(slug__in=[p.slug for p in products]).values_list(
+            "slug", "sku"
+        )
+    )
+    for product in products:
+        if taken.get(product.slug, product.sku) != product.sku:
+            product.slug = slugify(f"{product.slug}-{product.sku}")
+        taken[product.slug] = product.sku
+
+
+def import_catalogue(product_rows=(), batch_rows=(), dry_run=False):
+    """
+    Validate and (unless ``dry_run`` or any row is invalid) write
+    ``product_rows`` and ``batch_rows`` in one transaction.
+    Returns an ``ImportReport``.
+    """
+    report = ImportReport()
+    products = _validate_products(list(product_rows), report)
+    batches = _validate_batches(
+        list(batch_rows), {cleaned["sku"] for _, _, cleaned in products}, report
+    )
+
+    to_write, repriced = [], set()
+    for number, existing, cleaned in products:
+        values = {field: cleaned[field] for field in PRODUCT_IMPORT_FIELDS}
+        before = (
+            model_to_dict(existing, fields=PRODUCT_IMPORT_FIELDS) if existing else {}
+        )
+        after = {
+            **values,
+            "category": values["category"].pk if values["category"] else None,
+        }
+        changes = {
+            field: (before.get(field), after[field])
+            for field in after
+            if before.get(field) != after[field]
+        }
+        action = (
+            "create" if existing is None else ("update" if changes else "unchanged")
+        )
+        report.products.append(
+            {"row": number, "sku": cleaned["sku"], "action": action, "changes": changes}
+        )
+        if action != "unchanged":
+            product = Product(**values, price=cleaned["price"])
+            product.slug = (
+                existing.slug
+                if existing
+                else slugify(f"{product.name}-{product.weight_grams}")
+            )
+            to_write.append(product)
+            if existing is None or existing.price != product.price:
+                repriced.add(product.sku)
+    for number, sku, cleaned in batches:
+        report.batches.append(
+            {
+                "row": number,
+                "sku": sku,
+                **{field: cleaned[field] for field in BATCH_IMPORT_FIELDS[1:]},
+            }
+        )
+
+    if dry_run or not report.ok:
+        return report
+
+    with transaction.atomic():
+        _unique_slugs([product for product in to_write if product.slug])
+        Product.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=["sku"],
+            update_fields=[field for field in PRODUCT_IMPORT_FIELDS if field != "sku"]
+            + ["price", "updated_at"],
+            batch_size=500,
+        )
+        skus = repriced | {sku for _, sku, _ in batches}
+        product_ids = dict(
+            Product.objects.filter(sku__in=skus).values_list("sku", "pk")
+        )
+        now = timezone.now()
+        ProductPriceHistory.objects.bulk_create(
+            [
+                ProductPriceHistory(
+                    product_id=product_ids[product.sku],
+                    price=product.price,
+                    cost_price=product.cost_price,
+                    markup_percent=product.markup_percent,
+                    valid_from=now,
+                    source=ProductPriceHistory.IMPORT,
+                )
+                for product in to_write
+                if product.sku in repriced
+            ],
+            batch_size=500,
+        )
+        created = ProductBatch.objects.bulk_create(
+            [
+                ProductBatch(
+                    product_id=product_ids[sku],
+                    quantity_grams=cleaned["quantity_grams"],
+                    remaining_grams=cleaned["remaining_grams"],
+                    unit_cost=cleaned["unit_cost"],
+                    note=cleaned["note"],
+                )
+                for _, sku, cleaned in batches
+            ],
+            batch_size=500,
+        )
+        record_movements([
+            StockMovement(
+                product_id=batch.product_id, batch=batch, kind=StockMovement.RECEIPT,
+                on_hand_grams=batch.remaining_grams, note="CSV import",
+            )
+            for batch in created
+        ])
+    invalidate_inventory_totals()
+    invalidate_sitemap()
+    report.applied = True
+    return report
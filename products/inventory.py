@@ -0,0 +1,81 @@
+"""Whole-inventory valuation totals, cached until products or batches change."""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from versohnung_und_vergebung_kaffee.metrics import record_cache_lookup
+from .models import GRAMS_TO_KG, MONEY_AGGREGATE, Product, ProductBatch
+
+INVENTORY_TOTALS_KEY = "products:inventory-totals"
+CENT = Decimal("0.01")
+
+
+def _compute_totals():
+    batch_totals = ProductBatch.objects.aggregate(
+        total_cost=Coalesce(
+            Sum(
+                F("remaining_grams") * F("unit_cost") * GRAMS_TO_KG,
+                output_field=MONEY_AGGREGATE,
+            ),
+            Value(Decimal("0")),
+            output_field=MONEY_AGGREGATE,
+        ),
+    )
+    remaining = (
+        ProductBatch.objects.filter(product=OuterRef("pk"))
+        .values("product")
+        .annotate(grams=Sum("remaining_grams"))
+        .values("grams")
+    )
+    product_totals = Product.objects.annotate(
+        remaining_grams=Coalesce(Subquery(remaining), 0)
+    ).aggregate(
+        products=Count("pk"),
+        grams=Coalesce(Sum("remaining_grams"), 0),
+        stock_units=Coalesce(
+            Sum(F("remaining_grams") / NullIf(F("weight_grams"), 0)), 0
+        ),
+        total_revenue=Coalesce(
+            Sum(
+                F("price") * F("remaining_grams") * GRAMS_TO_KG,
+                output_field=MONEY_AGGREGATE,
+            ),
+            Value(Decimal("0")),
+            output_field=MONEY_AGGREGATE,
+        ),
+    )
+    return {
+        "products": product_totals["products"],
+        "total_kg": (Decimal(product_totals["grams"]) / 1000).quantize(
+            Decimal("0.001")
+        ),
+        "total_cost": Decimal(batch_totals["total_cost"]).quantize(
+            CENT, rounding=ROUND_HALF_UP
+        ),
+        "total_revenue": Decimal(product_totals["total_revenue"]).quantize(
+            CENT, rounding=ROUND_HALF_UP
+        ),
+        "stock_units": product_totals["stock_units"],
+    }
+
+
+def inventory_totals():
+    """Totals row for the staff product list: products, kg, cost, revenue, units."""
+    totals = cache.get(INVENTORY_TOTALS_KEY)
+    record_cache_lookup("inventory_totals", totals is not None)
+    if totals is None:
+        totals = _compute_totals()
+        cache.set(
+            INVENTORY_TOTALS_KEY,
+            totals,
+            getattr(settings, "INVENTORY_TOTALS_CACHE_TIMEOUT", 300),
+        )
+    return totals
+
+
+def invalidate_inventory_totals():
+    cache.delete(INVENTORY_TOTALS_KEY)
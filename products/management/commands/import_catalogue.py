@@ -0,0 +1,59 @@
+"""Import products and batch receipts from CSV files."""
+
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.imports import import_catalogue, read_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Validate every row with the staff form rules, then upsert products by "
+        "SKU and insert batch receipts in bulk. Nothing is written if any row "
+        "is invalid or with --dry-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", help="Products CSV (upserted by sku).")
+        parser.add_argument(
+            "--batches", help="Batch receipts CSV (sku, quantity_grams, ...)."
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not options["products"] and not options["batches"]:
+            raise CommandError("Pass --products, --batches or both.")
+        rows = {}
+        for name in ("products", "batches"):
+            path = options[name]
+            try:
+                rows[name] = read_csv(Path(path).read_bytes()) if path else []
+            except (OSError, UnicodeDecodeError) as exc:
+                raise CommandError(f"Cannot read {path}: {exc}")
+
+        report = import_catalogue(
+            rows["products"], rows["batches"], dry_run=options["dry_run"]
+        )
+        for row in report.products:
+            if row["action"] != "unchanged" or options["verbosity"] > 1:
+                changed = ", ".join(
+                    f"{field}: {old!r} -> {new!r}"
+                    for field, (old, new) in row["changes"].items()
+                )
+                self.stdout.write(f"  {row['action']:<9} {row['sku']}  {changed}")
+        for file, row, message in report.errors:
+            self.stderr.write(f"  {file} row {row}: {message}")
+        if report.errors:
+            raise CommandError(
+                f"{len(report.errors)} invalid row(s); nothing was imported."
+            )
+
+        summary = (
+            f"{report.created} new and {report.updated} updated products, "
+            f"{len(report.batches)} batches"
+        )
+        if report.applied:
+            self.stdout.write(self.style.SUCCESS(f"Imported {summary}."))
+        else:
+            self.stdout.write(f"Dry run: would import {summary}.")
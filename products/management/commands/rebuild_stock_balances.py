@@ -0,0 +1,49 @@
+"""Replay the stock ledger into the per-product balances."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from products.models import Product
+from products.stock import balances_at, rebuild_stock_balances
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute StockBalance rows (and Product.stock) from the StockMovement "
+        "ledger and report how many differed. With --as-of, print the replayed "
+        "balances at that moment instead of writing anything."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sku", action="append", default=[], help="Limit to this SKU (repeatable)."
+        )
+        parser.add_argument(
+            "--as-of", help="ISO timestamp; print balances at that moment, read-only."
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by("sku")
+        if options["sku"]:
+            products = products.filter(sku__in=options["sku"])
+        ids = list(products.values_list("pk", flat=True))
+
+        if options["as_of"]:
+            moment = parse_datetime(options["as_of"])
+            if moment is None:
+                raise CommandError(
+                    "--as-of must be an ISO date/time, e.g. 2025-01-31T18:00:00+00:00."
+                )
+            balances = balances_at(moment, product_ids=ids)
+            for pk, sku in products.values_list("pk", "sku"):
+                on_hand, reserved = balances.get(pk, (0, 0))
+                self.stdout.write(
+                    f"{sku}\ton_hand={on_hand}g\treserved={reserved}g"
+                    f"\tavailable={on_hand - reserved}g"
+                )
+            return
+
+        differed = rebuild_stock_balances(ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(ids)} balance(s); {differed} differed.")
+        )
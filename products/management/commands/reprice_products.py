@@ -0,0 +1,116 @@
+"""Apply a cost or markup change to many products with one UPDATE."""
+
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import PackVariant
+from products.pricing import (
+    reprice,
+    reprice_preview,
+    select_products,
+    variant_preview,
+)
+
+
+def _decimal(value):
+    try:
+        return Decimal(value.replace(",", "."))
+    except InvalidOperation:
+        raise CommandError(f"Not a number: {value}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Set or change the cost and/or markup of the selected products (and "
+        "optionally reprice their pack variants) in bulk, rounding half up to "
+        "cents like Product.save, and record price history for every change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--category", help="Category slug or name.")
+        parser.add_argument(
+            "--sku", action="append", default=[], help="Limit to this SKU (repeatable)."
+        )
+        parser.add_argument("--roast", choices=["light", "medium", "dark"])
+        parser.add_argument("--include-inactive", action="store_true")
+        parser.add_argument(
+            "--all", action="store_true", help="Required when no filter is given."
+        )
+        cost = parser.add_mutually_exclusive_group()
+        cost.add_argument("--cost", type=_decimal, help="New cost price (EUR).")
+        cost.add_argument(
+            "--cost-change",
+            type=_decimal,
+            help="Change cost by this percentage, e.g. 7.5 or -5.",
+        )
+        parser.add_argument("--markup", type=_decimal, help="New markup percent.")
+        parser.add_argument(
+            "--variants", action="store_true", help="Also reprice pack variants."
+        )
+        parser.add_argument(
+            "--variant-markup",
+            type=_decimal,
+            help="New markup percent for pack variants.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Show new prices without writing."
+        )
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ("category", "sku", "roast", "all")):
+            raise CommandError(
+                "Select products with --category, --sku or --roast, or pass --all."
+            )
+        changes = (options["cost"], options["cost_change"], options["markup"])
+        if all(value is None for value in changes) and not options["variants"]:
+            raise CommandError(
+                "Nothing to change: pass --cost, --cost-change, --markup or --variants."
+            )
+        if options["cost_change"] is not None and options["cost_change"] <= -100:
+            raise CommandError("--cost-change must be above -100.")
+
+        products = select_products(
+            category=options["category"],
+            skus=options["sku"],
+            roast_type=options["roast"],
+            include_inactive=options["include_inactive"],
+        )
+        kwargs = {
+            "cost_price": options["cost"],
+            "cost_change_percent": options["cost_change"],
+            "markup_percent": options["markup"],
+        }
+
+        if options["dry_run"]:
+            for product in reprice_preview(products, **kwargs):
+                self.stdout.write(
+                    f"{product.sku}\t"
+                    f"cost {product.cost_price} -> {product.new_cost_price:.2f}\t"
+                    f"markup {product.markup_percent} -> "
+                    f"{product.new_markup_percent:.2f}\t"
+                    f"price {product.price} -> {product.new_price:.2f}"
+                )
+            if options["variants"]:
+                variants = variant_preview(
+                    PackVariant.objects.filter(product__in=products),
+                    options["variant_markup"],
+                    cost_price=kwargs["cost_price"],
+                    cost_change_percent=kwargs["cost_change_percent"],
+                )
+                for variant in variants:
+                    self.stdout.write(
+                        f"{variant.sku}\t"
+                        f"price {variant.price} -> {variant.new_price:.2f}"
+                    )
+            return
+
+        changed, variants_changed = reprice(
+            products,
+            **kwargs,
+            variants=options["variants"],
+            variant_markup_percent=options["variant_markup"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Repriced {changed} product(s) and {variants_changed} pack variant(s)."
+        ))
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def open_balances(apps, schema_editor):
+    """
+    Open the ledger with one adjustment per product. On hand is what the
+    batches still hold (or legacy ``stock`` x weight for products without
+    batches). Grams of paid, unfulfilled orders are reserved.
+    """
+    Product = apps.get_model("products", "Product")
+    ProductBatch = apps.get_model("products", "ProductBatch")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    StockMovement = apps.get_model("products", "StockMovement")
+    StockBalance = apps.get_model("products", "StockBalance")
+
+    on_hand = dict(
+        ProductBatch.objects.values("product_id").annotate(grams=Sum("remaining_grams")).values_list("product_id", "grams")
+    )
+    reserved = dict(
+        OrderItem.objects.filter(order__status__in=["paid", "pending_fulfillment"], product__isnull=False)
+        .values("product_id")
+        .annotate(grams=Sum(F("quantity") * F("weight_grams")))
+        .values_list("product_id", "grams")
+    )
+    movements, balances, products = [], [], []
+    for product in Product.objects.only("pk", "stock", "weight_grams"):
+        held = on_hand.get(product.pk, product.stock * product.weight_grams)
+        promised = reserved.get(product.pk, 0)
+        if held or promised:
+            movements.append(StockMovement(
+                product_id=product.pk, kind="adjustment", on_hand_grams=held, reserved_grams=promised,
+                note="Opening balance",
+            ))
+        balances.append(StockBalance(product_id=product.pk, on_hand_grams=held, reserved_grams=promised))
+        if product.weight_grams:
+            product.stock = max(0, (held - promised) // product.weight_grams)
+            products.append(product)
+    StockMovement.objects.bulk_create(movements, batch_size=1000)
+    StockBalance.objects.bulk_create(balances, batch_size=1000)
+    Product.objects.bulk_update(products, ["stock"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_order_guest_email_index'),
+        ('products', '0005_packvariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_balance', serialize=False, to='products.product')),
+                ('on_hand_grams', models.BigIntegerField(default=0)),
+                ('reserved_grams', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('reservation', 'Reservation'), ('sale', 'Sale'), ('consumption', 'Fulfilment consumption'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('on_hand_grams', models.IntegerField(default=0)),
+                ('reserved_grams', models.IntegerField(default=0)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='products.productbatch')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='products.product')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='products_st_product_a806c1_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
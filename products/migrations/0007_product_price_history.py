@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('cost_price', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('markup_percent', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('valid_from', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(choices=[('save', 'Product saved'), ('reprice', 'Bulk repricing'), ('import', 'CSV import')], default='save', max_length=20)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='products.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='products.packvariant')),
+            ],
+            options={
+                'verbose_name_plural': 'Product price history',
+                'ordering': ['product', '-valid_from'],
+                'indexes': [models.Index(fields=['product', 'valid_from'], name='price_history_product_from_idx')],
+            },
+        ),
+    ]
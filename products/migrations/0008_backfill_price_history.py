@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:05
+
+from django.db import migrations
+
+
+def backfill_price_history(apps, schema_editor):
+    """
+    Open the price history with each product's current price, valid from
+    its creation, for products that have none yet. Earlier prices are not
+    known, so history before this point reads as the current price.
+    """
+    Product = apps.get_model("products", "Product")
+    ProductPriceHistory = apps.get_model("products", "ProductPriceHistory")
+
+    recorded = ProductPriceHistory.objects.filter(variant__isnull=True).values("product_id")
+    rows = [
+        ProductPriceHistory(
+            product_id=product["pk"],
+            price=product["price"],
+            cost_price=product["cost_price"],
+            markup_percent=product["markup_percent"],
+            valid_from=product["created_at"],
+            source="save",
+        )
+        for product in Product.objects.exclude(pk__in=recorded)
+        .values("pk", "price", "cost_price", "markup_percent", "created_at")
+        .iterator(chunk_size=1000)
+    ]
+    ProductPriceHistory.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_price_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_price_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_backfill_price_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='products.product')),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('history_days', models.PositiveIntegerField(default=56)),
+                ('sold_grams', models.BigIntegerField(default=0)),
+                ('avg_7d_grams', models.FloatField(default=0)),
+                ('avg_28d_grams', models.FloatField(default=0)),
+                ('daily_grams', models.FloatField(default=0)),
+                ('available_grams', models.BigIntegerField(default=0)),
+                ('days_of_cover', models.FloatField(blank=True, null=True)),
+                ('reorder_grams', models.BigIntegerField(default=0)),
+                ('reorder_by', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': [models.OrderBy(models.F('days_of_cover'), nulls_last=True), 'product'],
+            },
+        ),
+    ]
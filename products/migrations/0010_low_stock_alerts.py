@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_stock_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(blank=True, help_text='Alert when available stock falls to this level (empty: never).', null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_unit',
+            field=models.CharField(choices=[('units', 'Units (packs)'), ('grams', 'Grams')], default='units', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='stockbalance',
+            name='low_stock_alerted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='LowStockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available_grams', models.BigIntegerField()),
+                ('threshold_grams', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_alerts', to='products.product')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+    ]
@@ -3,11 +3,23 @@
 from decimal import Decimal, ROUND_HALF_UP
 from typing import List, Optional
 
-from django.db import models
-from django.db.models import Avg
+from django.db import models, transaction
+from django.db.models import (
+    Avg,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, Greatest, NullIf
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 
+from versohnung_und_vergebung_kaffee.metrics import FIFO_CONSUME_SECONDS
+
 
 class Category(models.Model):
     """Simple classification for products."""
@@ -29,10 +41,52 @@ class Category(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+    def get_absolute_url(self) -> str:
+        return f"{reverse('products:product_list')}?category={self.slug}"
+
+
+MONEY_AGGREGATE = DecimalField(max_digits=16, decimal_places=4)
+# Multiply rather than divide: SQLite stores whole-euro decimals as integers,
+# and integer / 1000 would truncate.
+GRAMS_TO_KG = Value(Decimal("0.001"))
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_valuation(self):
+        """
+        Annotate stock valuation from remaining batch grams in one grouped query:
+        ``remaining_grams_sum``, ``total_cost`` (grams x unit cost / 1000),
+        ``total_revenue`` at the current price and whole ``stock_units``.
+        """
+        return self.annotate(
+            remaining_grams_sum=Coalesce(Sum("batches__remaining_grams"), 0),
+            total_cost=Coalesce(
+                Sum(
+                    F("batches__remaining_grams")
+                    * F("batches__unit_cost")
+                    * GRAMS_TO_KG,
+                    output_field=MONEY_AGGREGATE,
+                ),
+                Value(Decimal("0")),
+                output_field=MONEY_AGGREGATE,
+            ),
+            total_revenue=ExpressionWrapper(
+                F("price") * F("remaining_grams_sum") * GRAMS_TO_KG,
+                output_field=MONEY_AGGREGATE,
+            ),
+            stock_units=ExpressionWrapper(
+                F("remaining_grams_sum") / NullIf(F("weight_grams"), 0),
+                output_field=IntegerField(),
+            ),
+        )
+
 
 class Product(models.Model):
     """Coffee product with provenance and merchandising details."""
 
+    UNITS = "units"
+    GRAMS = "grams"
+    LOW_STOCK_UNIT_CHOICES = [(UNITS, "Units (packs)"), (GRAMS, "Grams")]
     ROAST_CHOICES = [
         ("light", "Light Roast"),
         ("medium", "Medium Roast"),
@@ -76,11 +130,21 @@ class Product(models.Model):
     stock = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     image = models.ImageField(upload_to="products/", blank=True, null=True)
+    low_stock_threshold = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Alert when available stock falls to this level (empty: never).",
+    )
+    low_stock_unit = models.CharField(
+        max_length=10, choices=LOW_STOCK_UNIT_CHOICES, default=UNITS
+    )
 
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
         indexes = [
@@ -91,15 +155,72 @@ class Product(models.Model):
     def __str__(self) -> str:
         return f"{self.name} ({self.weight_grams}g)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_price = instance.__dict__.get("price")
+        return instance
+
     def save(self, *args, **kwargs) -> None:
-        """Ensure a stable slug and keep stored price in sync with cost + markup%."""
+        """
+        Ensure a stable slug and keep stored price in sync with cost + markup%.
+
+        ``stock`` is owned by the stock ledger. A new product's initial
+        stock is booked as an adjustment; after that ``save()`` never writes
+        the column, so a stale in-memory value cannot undo concurrent
+        movements (staff adjust stock with an explicit delta instead). A new
+        or changed price is recorded in ``ProductPriceHistory``.
+        """
 
         if not self.slug:
             self.slug = slugify(f"{self.name}-{self.weight_grams}")
 
         sale_price = self.sale_price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
         self.price = sale_price
-        super().save(*args, **kwargs)
+
+        adding = self._state.adding
+        stock_delta = (self.stock or 0) if adding else 0
+        update_fields = kwargs.get("update_fields")
+        if not adding and update_fields is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.attname
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname != "stock"
+                and field.attname not in deferred
+            ]
+        price_written = update_fields is None or "price" in update_fields
+        loaded_price = getattr(self, "_loaded_price", None)
+        price_changed = price_written and (adding or loaded_price != self.price)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if stock_delta:
+                from .stock import record_movement
+
+                record_movement(
+                    self,
+                    StockMovement.ADJUSTMENT,
+                    on_hand_grams=stock_delta * (self.weight_grams or 0),
+                    note="Stock set on product",
+                )
+                self.refresh_stock()
+            if price_changed:
+                ProductPriceHistory.objects.create(
+                    product=self,
+                    price=self.price,
+                    cost_price=self.cost_price,
+                    markup_percent=self.markup_percent,
+                    source=ProductPriceHistory.SAVE,
+                )
+        self._loaded_price = self.price
+
+    def refresh_stock(self) -> None:
+        """Reload ``stock`` after the ledger changed it in the database."""
+        self.stock = (
+            type(self)._base_manager.values_list("stock", flat=True).get(pk=self.pk)
+        )
 
     def get_absolute_url(self) -> str:
         return reverse("products:product_detail", kwargs={"slug": self.slug})
@@ -196,45 +317,65 @@ class Product(models.Model):
         return int(total_remaining // weight)
 
     def recalc_stock_from_batches(self) -> None:
-        """Recompute stock units from remaining grams across batches."""
-        self.stock = max(0, self.batch_stock_units())
-        self.save(update_fields=["stock"])
+        """Re-derive ``stock`` from this product's ledger balance."""
+        from .stock import sync_product_stock
 
-    def consume_grams_fifo(self, grams_needed: Decimal) -> Decimal:
+        sync_product_stock([self.pk])
+        self.refresh_stock()
+
+    @FIFO_CONSUME_SECONDS.timed()
+    def consume_grams_fifo(self, grams_needed: Decimal, order=None) -> Decimal:
         """
-        Reduce remaining_grams from batches in FIFO order.
-        Returns grams actually consumed.
+        Reduce remaining_grams from batches in FIFO order and record one
+        consumption movement per batch touched. Grams the batches cannot
+        cover are still recorded (without a batch) so the ledger matches
+        what physically left the warehouse.
+        Returns grams actually taken from batches.
         """
+        from .stock import record_movements
+
+        grams_needed = int(grams_needed or 0)
         if grams_needed <= 0:
             return Decimal("0.00")
 
-        consumed = Decimal("0.00")
-        batches = list(self.batches.order_by("received_at", "id"))
-        remaining = Decimal(grams_needed)
-
-        for batch in batches:
-            avail = Decimal(batch.remaining_grams or 0)
-            if avail <= 0:
-                continue
-            take = min(avail, remaining)
-            batch.remaining_grams = int(avail - take)
-            batch.save(update_fields=["remaining_grams"])
-            consumed += take
-            remaining -= take
-            if remaining <= 0:
-                break
-
-        # optionally sync stock to remaining grams / unit weight
-        try:
-            total_remaining = sum((Decimal(b.remaining_grams or 0) for b in self.batches.all()), Decimal("0"))
-            weight = Decimal(self.weight_grams or 1)
-            approx_units = int(total_remaining // weight) if weight > 0 else 0
-            self.stock = int(max(0, approx_units))
-            self.save(update_fields=["stock"])
-        except Exception:
-            pass
-
-        return consumed
+        consumed = 0
+        movements = []
+        with transaction.atomic():
+            batches = (
+                self.batches.select_for_update()
+                .filter(remaining_grams__gt=0)
+                .order_by("received_at", "id")
+            )
+            for batch in batches:
+                take = min(batch.remaining_grams, grams_needed - consumed)
+                ProductBatch.objects.filter(pk=batch.pk).update(
+                    remaining_grams=F("remaining_grams") - take
+                )
+                movements.append(
+                    StockMovement(
+                        product=self,
+                        kind=StockMovement.CONSUMPTION,
+                        on_hand_grams=-take,
+                        batch=batch,
+                        order=order,
+                    )
+                )
+                consumed += take
+                if consumed >= grams_needed:
+                    break
+            if consumed < grams_needed:
+                movements.append(
+                    StockMovement(
+                        product=self,
+                        kind=StockMovement.CONSUMPTION,
+                        on_hand_grams=consumed - grams_needed,
+                        order=order,
+                        note="Not covered by batches",
+                    )
+                )
+            record_movements(movements)
+        self.refresh_stock()
+        return Decimal(consumed)
 
 
 class ProductBatch(models.Model):
@@ -253,15 +394,171 @@ class ProductBatch(models.Model):
     def __str__(self):
         return f"{self.product.name} batch ({self.remaining_grams}g remaining)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_remaining = instance.__dict__.get("remaining_grams")
+        return instance
+
     def save(self, *args, **kwargs):
+        from .stock import record_movement
+
         # Default remaining to full quantity only on initial creation when unspecified
         if self.pk is None and self.remaining_grams is None:
             self.remaining_grams = self.quantity_grams
+        adding = self._state.adding
+        previous = (
+            0 if adding else getattr(self, "_loaded_remaining", self.remaining_grams)
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            delta = (self.remaining_grams or 0) - (previous or 0)
+            if delta:
+                record_movement(
+                    self.product,
+                    StockMovement.RECEIPT if adding else StockMovement.ADJUSTMENT,
+                    on_hand_grams=delta,
+                    batch=self,
+                )
+        self._loaded_remaining = self.remaining_grams
+
+
+class StockMovement(models.Model):
+    """
+    One append-only entry in the stock ledger.
+
+    ``on_hand_grams`` and ``reserved_grams`` are signed deltas: receipts and
+    consumption move coffee in and out of the warehouse, reservations hold
+    it for paid orders and a sale releases the hold on fulfilment. Summing
+    the deltas up to any moment gives the balance at that moment.
+    """
+
+    RECEIPT = "receipt"
+    RESERVATION = "reservation"
+    SALE = "sale"
+    CONSUMPTION = "consumption"
+    ADJUSTMENT = "adjustment"
+    KIND_CHOICES = [
+        (RECEIPT, "Receipt"),
+        (RESERVATION, "Reservation"),
+        (SALE, "Sale"),
+        (CONSUMPTION, "Fulfilment consumption"),
+        (ADJUSTMENT, "Adjustment"),
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="stock_movements"
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    on_hand_grams = models.IntegerField(default=0)
+    reserved_grams = models.IntegerField(default=0)
+    batch = models.ForeignKey(
+        ProductBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="stock_movements",
+    )
+    order = models.ForeignKey(
+        "orders.Order",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="stock_movements",
+    )
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [models.Index(fields=["product", "created_at"])]
+
+    def __str__(self):
+        return (
+            f"{self.get_kind_display()} {self.product_id}: "
+            f"{self.on_hand_grams:+}g on hand, {self.reserved_grams:+}g reserved"
+        )
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError(
+                "Stock movements are append-only; record a new movement instead."
+            )
         super().save(*args, **kwargs)
-        try:
-            self.product.recalc_stock_from_batches()
-        except Exception:
-            pass
+
+
+class StockBalance(models.Model):
+    """Materialised running totals of the ledger, one row per product."""
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stock_balance",
+    )
+    on_hand_grams = models.BigIntegerField(default=0)
+    reserved_grams = models.BigIntegerField(default=0)
+    # Set when a low-stock alert went out; cleared once stock is back above
+    # the threshold.
+    low_stock_alerted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.available_grams}g available"
+
+    @property
+    def available_grams(self) -> int:
+        return self.on_hand_grams - self.reserved_grams
+
+    def available_units(self, pack_grams: int) -> int:
+        if not pack_grams or pack_grams <= 0:
+            return 0
+        return max(0, self.available_grams // pack_grams)
+
+
+class LowStockAlert(models.Model):
+    """
+    A product's available stock fell to its low-stock threshold. Written by
+    ``products.alerts`` in the transaction that moved the stock and mailed
+    once it commits; ``sent_at`` stays empty until the mail went out.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="low_stock_alerts"
+    )
+    available_grams = models.BigIntegerField()
+    threshold_grams = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.available_grams}g <= {self.threshold_grams}g"
+
+
+class PackVariantQuerySet(models.QuerySet):
+    def with_availability(self):
+        """
+        Annotate ``available_grams`` (on hand minus reserved, never negative)
+        from the product's ledger balance and whole ``available_packs``,
+        joined in the same query instead of scanning batches per variant.
+        """
+        return self.annotate(
+            available_grams=Greatest(
+                Coalesce(
+                    F("product__stock_balance__on_hand_grams")
+                    - F("product__stock_balance__reserved_grams"),
+                    0,
+                ),
+                0,
+            ),
+            available_packs=ExpressionWrapper(
+                F("available_grams") / NullIf(F("pack_weight_grams"), 0),
+                output_field=IntegerField(),
+            ),
+        )
 
 
 class PackVariant(models.Model):
@@ -275,6 +572,8 @@ class PackVariant(models.Model):
     markup_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     is_active = models.BooleanField(default=True)
 
+    objects = PackVariantQuerySet.as_manager()
+
     class Meta:
         ordering = ["pack_weight_grams", "name"]
 
@@ -283,9 +582,91 @@ class PackVariant(models.Model):
 
     @property
     def available_units(self) -> int:
-        """Availability derived from product batches."""
-        total_grams = self.product.total_remaining_grams()
-        weight = Decimal(self.pack_weight_grams or 1)
-        if weight <= 0:
+        """
+        Whole packs sellable now. Uses the ``with_availability()`` annotation
+        when present, otherwise the cached per-product availability map.
+        """
+        packs = getattr(self, "available_packs", None)
+        if packs is not None:
+            return packs
+        from .stock import availability_map
+
+        if not self.pack_weight_grams:
             return 0
-        return int(total_grams // weight)
+        return (
+            availability_map([self.product_id])[self.product_id]
+            // self.pack_weight_grams
+        )
+
+
+class ProductPriceHistory(models.Model):
+    """
+    One catalogue price, valid from ``valid_from`` until the next row for the
+    same product (and pack variant; ``variant`` is empty for the product's
+    own price).
+    """
+
+    SAVE = "save"
+    REPRICE = "reprice"
+    IMPORT = "import"
+    SOURCE_CHOICES = [
+        (SAVE, "Product saved"),
+        (REPRICE, "Bulk repricing"),
+        (IMPORT, "CSV import"),
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="price_history"
+    )
+    variant = models.ForeignKey(
+        PackVariant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="price_history",
+    )
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    cost_price = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    markup_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    valid_from = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=SAVE)
+
+    class Meta:
+        ordering = ["product", "-valid_from"]
+        verbose_name_plural = "Product price history"
+        indexes = [
+            models.Index(
+                fields=["product", "valid_from"], name="price_history_product_from_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: €{self.price} from {self.valid_from:%Y-%m-%d}"
+
+
+class StockForecast(models.Model):
+    """
+    Precomputed sales velocity and reorder suggestion for one product,
+    refreshed by ``manage.py forecast_stock`` so the staff page only reads.
+    Velocities are grams per day.
+    """
+
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="forecast"
+    )
+    computed_at = models.DateTimeField(default=timezone.now)
+    history_days = models.PositiveIntegerField(default=56)
+    sold_grams = models.BigIntegerField(default=0)  # over the history window
+    avg_7d_grams = models.FloatField(default=0)
+    avg_28d_grams = models.FloatField(default=0)
+    daily_grams = models.FloatField(default=0)  # velocity used for cover and reorder
+    available_grams = models.BigIntegerField(default=0)
+    days_of_cover = models.FloatField(null=True, blank=True)  # empty: no recent sales
+    reorder_grams = models.BigIntegerField(default=0)
+    reorder_by = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = [models.F("days_of_cover").asc(nulls_last=True), "product"]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.daily_grams:.0f}g/day"
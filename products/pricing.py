@@ -0,0 +1,256 @@
+"""
+Bulk repricing: apply cost or markup changes to a filtered set of products
+(and optionally their pack variants) with one UPDATE each.
+
+Prices are computed in whole cents with 64-bit integer arithmetic, so the database
+rounds exactly like ``Product.save`` (``ROUND_HALF_UP`` to cents) on SQLite
+as well as PostgreSQL:
+
+    price_cents = (cost_cents * (10000 + markup_bp) + 5000) // 10000
+
+A pack variant is priced from its product's cost per gram, scaled to the
+pack weight, with the variant's own ``markup_percent``. Every price that
+changes gets a ``ProductPriceHistory`` row, written in bulk.
+
+``price_history_at`` / ``prices_at`` answer "what did these products cost
+at that moment?" for any number of products in one query.
+"""
+
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import (
+    BigIntegerField,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    Window,
+)
+from django.db.models.functions import Cast, Coalesce, NullIf, Round, RowNumber
+from django.utils import timezone
+
+from .inventory import invalidate_inventory_totals
+from .models import PackVariant, Product, ProductPriceHistory
+from .sitemaps import invalidate_sitemap
+
+PRICE_FIELD = DecimalField(max_digits=8, decimal_places=2)
+CENT_VALUE = Value(Decimal("0.01"))
+
+
+def _integer(expression):
+    return ExpressionWrapper(expression, output_field=BigIntegerField())
+
+
+def _bigint(expression):
+    # PostgreSQL integers are 32-bit; cents x grams x basis points are not.
+    return Cast(expression, BigIntegerField())
+
+
+def _hundredths(value):
+    """``value`` (euros or percent, two decimals) as an exact 64-bit integer."""
+    if isinstance(value, Decimal):
+        return _bigint(Value(int((value * 100).to_integral_value())))
+    return _bigint(Round(value * 100))
+
+
+def _from_cents(cents):
+    return ExpressionWrapper(cents * CENT_VALUE, output_field=PRICE_FIELD)
+
+
+def _cost_cents(cost_price=None, cost_change_percent=None):
+    """New cost in cents: fixed, the current cost changed by a percentage, or as is."""
+    if cost_price is not None:
+        return _hundredths(Decimal(cost_price))
+    current = _hundredths(F("cost_price"))
+    if cost_change_percent is None:
+        return current
+    change_bp = _hundredths(Decimal(cost_change_percent))
+    return _integer((current * (10000 + change_bp) + 5000) / 10000)
+
+
+def _price_cents(cost_cents, markup_bp):
+    return _integer((cost_cents * (10000 + markup_bp) + 5000) / 10000)
+
+
+def _markup_bp(markup_percent=None):
+    if markup_percent is None:
+        return _hundredths(F("markup_percent"))
+    return _hundredths(Decimal(markup_percent))
+
+
+def _product_prices(cost_price=None, cost_change_percent=None, markup_percent=None):
+    """New ``cost_price``, ``markup_percent`` and ``price`` of a product row."""
+    cost_cents = _cost_cents(cost_price, cost_change_percent)
+    markup_bp = _markup_bp(markup_percent)
+    return {
+        "cost_price": _from_cents(cost_cents),
+        "markup_percent": _from_cents(markup_bp),
+        "price": _from_cents(_price_cents(cost_cents, markup_bp)),
+    }
+
+
+def _variant_prices(markup_percent=None, cost_price=None, cost_change_percent=None):
+    """
+    Expressions for the new ``markup_percent`` and ``price`` of a pack variant
+    row; the cost arguments preview a product cost change not yet written.
+    """
+    product = Product.objects.filter(pk=OuterRef("product_id"))
+    product_cost_cents = _bigint(Subquery(
+        product.annotate(cents=_cost_cents(cost_price, cost_change_percent))
+        .values("cents")
+    ))
+    product_weight = _bigint(Subquery(product.values("weight_grams")))
+    markup_bp = _markup_bp(markup_percent)
+    # cost per gram x pack grams x (1 + markup), rounded half up to cents
+    denominator = NullIf(_integer(product_weight * 10000), 0)
+    pack_weight = _bigint(F("pack_weight_grams"))
+    numerator = product_cost_cents * pack_weight * (10000 + markup_bp)
+    cents = Coalesce(
+        _integer((numerator + denominator / 2) / denominator),
+        _hundredths(F("price")),  # product without a weight: keep the current price
+    )
+    return {"markup_percent": _from_cents(markup_bp), "price": _from_cents(cents)}
+
+
+def reprice_preview(
+    products, cost_price=None, cost_change_percent=None, markup_percent=None
+):
+    """
+    ``products`` annotated with ``new_cost_price``, ``new_markup_percent``
+    and ``new_price``.
+    """
+    prices = _product_prices(cost_price, cost_change_percent, markup_percent)
+    return products.annotate(**{f"new_{name}": value for name, value in prices.items()})
+
+
+def variant_preview(
+    variants, markup_percent=None, cost_price=None, cost_change_percent=None
+):
+    """
+    ``variants`` annotated with ``new_markup_percent`` and ``new_price``
+    from their product's (new) cost.
+    """
+    prices = _variant_prices(markup_percent, cost_price, cost_change_percent)
+    return variants.annotate(**{f"new_{name}": value for name, value in prices.items()})
+
+
+def select_products(category=None, skus=None, roast_type=None, include_inactive=False):
+    """The products a repricing run applies to."""
+    products = Product.objects.all()
+    if not include_inactive:
+        products = products.filter(is_active=True)
+    if category:
+        products = products.filter(
+            Q(category__slug=category) | Q(category__name__iexact=category)
+        )
+    if skus:
+        products = products.filter(sku__in=skus)
+    if roast_type:
+        products = products.filter(roast_type=roast_type)
+    return products.order_by("name")
+
+
+def _history_rows(before, after, now, variant=False):
+    rows = []
+    for pk, (price, cost, markup, product_id) in after.items():
+        if before.get(pk) != price:
+            rows.append(ProductPriceHistory(
+                product_id=product_id,
+                variant_id=pk if variant else None,
+                price=price,
+                cost_price=cost,
+                markup_percent=markup,
+                valid_from=now,
+                source=ProductPriceHistory.REPRICE,
+            ))
+    return rows
+
+
+def reprice(
+    products,
+    cost_price=None,
+    cost_change_percent=None,
+    markup_percent=None,
+    variants=False,
+    variant_markup_percent=None,
+):
+    """
+    Apply the change to ``products`` (a queryset) with one UPDATE, then
+    (if ``variants``) reprice their pack variants with one more. Returns
+    ``(products_changed, variants_changed)``.
+    """
+    ids = list(products.values_list("pk", flat=True))
+    now = timezone.now()
+    with transaction.atomic():
+        targets = Product.objects.filter(pk__in=ids)
+        before = dict(targets.values_list("pk", "price"))
+        targets.update(
+            **_product_prices(cost_price, cost_change_percent, markup_percent),
+            updated_at=now,
+        )
+        after = {
+            pk: (price, cost, markup, pk)
+            for pk, price, cost, markup in targets.values_list(
+                "pk", "price", "cost_price", "markup_percent"
+            )
+        }
+        history = _history_rows(before, after, now)
+
+        variants_changed = 0
+        if variants:
+            pack_variants = PackVariant.objects.filter(product_id__in=ids)
+            variant_before = dict(pack_variants.values_list("pk", "price"))
+            pack_variants.update(**_variant_prices(variant_markup_percent))
+            variant_after = {
+                pk: (price, cost, markup, product_id)
+                for pk, price, cost, markup, product_id in pack_variants.values_list(
+                    "pk", "price", "product__cost_price", "markup_percent", "product_id"
+                )
+            }
+            variant_history = _history_rows(
+                variant_before, variant_after, now, variant=True
+            )
+            variants_changed = len(variant_history)
+            history += variant_history
+
+        ProductPriceHistory.objects.bulk_create(history, batch_size=1000)
+    invalidate_inventory_totals()
+    invalidate_sitemap()
+    return len(history) - variants_changed, variants_changed
+
+
+def price_history_at(moment=None, product_ids=None):
+    """
+    The ``ProductPriceHistory`` row in effect at ``moment`` (default: now)
+    for each product, as one query: ``DISTINCT ON`` where the database has
+    it, otherwise the newest row per product by window function, falling
+    back to a correlated subquery on databases without window support.
+    Products with no price recorded by then are absent.
+    """
+    rows = ProductPriceHistory.objects.filter(variant__isnull=True)
+    if moment is not None:
+        rows = rows.filter(valid_from__lte=moment)
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=list(product_ids))
+    newest_first = [F("valid_from").desc(), F("pk").desc()]
+
+    if connection.features.can_distinct_on_fields:
+        return rows.order_by("product_id", *newest_first).distinct("product_id")
+    if connection.features.supports_over_clause:
+        return rows.annotate(
+            position=Window(
+                RowNumber(), partition_by=F("product_id"), order_by=newest_first
+            )
+        ).filter(position=1)
+    newest = rows.filter(product_id=OuterRef("product_id")).order_by(*newest_first)
+    return rows.filter(pk=Subquery(newest.values("pk")[:1]))
+
+
+def prices_at(moment=None, product_ids=None) -> dict:
+    """``{product_id: price}`` in effect at ``moment``; see ``price_history_at``."""
+    rows = price_history_at(moment, product_ids)
+    return dict(rows.values_list("product_id", "price"))
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .inventory import invalidate_inventory_totals
+from .models import Category, Product, ProductBatch, StockMovement
+from .sitemaps import invalidate_sitemap
+from .stock import record_movements
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductBatch)
+def on_inventory_changed(sender, **kwargs):
+    # Any product or batch write can move the cached valuation totals.
+    invalidate_inventory_totals()
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def on_catalogue_changed(sender, **kwargs):
+    invalidate_sitemap()
+
+
+@receiver(post_delete, sender=ProductBatch)
+def on_batch_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting a product cascades to its batches and ledger; nothing to book.
+    if isinstance(origin, Product) or getattr(origin, "model", None) is Product:
+        return
+    if instance.remaining_grams:
+        record_movements([StockMovement(
+            product_id=instance.product_id,
+            kind=StockMovement.ADJUSTMENT,
+            on_hand_grams=-instance.remaining_grams,
+            note=f"Batch #{instance.pk} deleted",
+        )])
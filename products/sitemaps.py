@@ -0,0 +1,190 @@
+"""
+The site's ``sitemap.xml``, generated from the catalogue.
+
+``django.contrib.sitemaps`` lists the home and shop pages, every active
+product and every category with active products, with ``lastmod`` from
+``Product.updated_at``. While each section fits into one page of
+``SITEMAP_LIMIT`` URLs, ``/sitemap.xml`` is a plain urlset. Past that it
+becomes a sitemap index of ``/sitemap-<section>.xml?p=<n>`` chunks.
+
+Every document (index, section or chunk) is rendered on first request
+and cached with its ``ETag`` and ``Last-Modified``, so crawlers get 304s
+for unchanged documents. The cache keys carry a version stamp.
+``invalidate_sitemap`` moves the stamp whenever a product or category is
+saved or deleted, and after a catalogue import or bulk reprice.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps import views as sitemap_views
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from versohnung_und_vergebung_kaffee.metrics import record_cache_lookup
+from .models import Category, Product
+
+SITEMAP_VERSION_KEY = "products:sitemap:version"
+SITEMAP_KEY = "products:sitemap:{version}:{section}:{page}"
+
+
+def _limit():
+    return getattr(settings, "SITEMAP_LIMIT", 5000)
+
+
+class _CatalogueSitemap(Sitemap):
+    # Behind Heroku's proxy every request looks like plain http.
+    protocol = "https"
+
+    def __init__(self):
+        self.limit = _limit()
+
+    def get_latest_lastmod(self):
+        return Product.objects.filter(is_active=True).aggregate(
+            latest=Max("updated_at")
+        )["latest"]
+
+
+class StaticViewSitemap(_CatalogueSitemap):
+    """Home and shop pages; they change whenever the catalogue does."""
+
+    changefreq = "daily"
+    priority = 1.0
+
+    def items(self):
+        return ["home", "products:product_list"]
+
+    def location(self, item):
+        return reverse(item)
+
+    def lastmod(self, item):
+        if not hasattr(self, "_latest"):
+            self._latest = self.get_latest_lastmod()
+        return self._latest
+
+
+class ProductSitemap(_CatalogueSitemap):
+    changefreq = "weekly"
+    priority = 0.8
+
+    def items(self):
+        return (
+            Product.objects.filter(is_active=True)
+            .only("slug", "updated_at")
+            .order_by("pk")
+        )
+
+    def lastmod(self, product):
+        return product.updated_at
+
+
+class CategorySitemap(_CatalogueSitemap):
+    changefreq = "weekly"
+    priority = 0.6
+
+    def items(self):
+        return (
+            Category.objects.filter(
+                Exists(Product.objects.filter(category=OuterRef("pk"), is_active=True))
+            )
+            .annotate(
+                latest=Max("products__updated_at", filter=Q(products__is_active=True))
+            )
+            .order_by("pk")
+        )
+
+    def lastmod(self, category):
+        return category.latest
+
+
+SITEMAPS = {
+    "pages": StaticViewSitemap,
+    "products": ProductSitemap,
+    "categories": CategorySitemap,
+}
+
+
+def _version():
+    return cache.get_or_set(SITEMAP_VERSION_KEY, time.time_ns, None)
+
+
+def invalidate_sitemap() -> None:
+    """Retire every cached sitemap document, now and once the transaction commits."""
+
+    def bump():
+        cache.set(SITEMAP_VERSION_KEY, time.time_ns(), None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def cached_sitemap(view):
+    """
+    Serve ``view``'s document from the cache, answering ``If-None-Match``
+    and ``If-Modified-Since`` with 304 before anything is rendered.
+    """
+
+    @wraps(view)
+    def wrapper(request, section=None):
+        if section is not None and section not in SITEMAPS:
+            raise Http404(f"No sitemap section {section!r}")
+        try:
+            page = int(request.GET.get("p", "1"))
+        except ValueError:
+            raise Http404("Invalid sitemap page") from None
+        if page < 1:
+            raise Http404("Invalid sitemap page")
+        key = SITEMAP_KEY.format(version=_version(), section=section or "", page=page)
+        document = cache.get(key)
+        record_cache_lookup("sitemap", document is not None)
+        if document is None:
+            response = view(request, section)
+            response.render()
+            if response.status_code != 200:
+                return response
+            last_modified = response.get("Last-Modified", "")
+            document = {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": quote_etag(hashlib.md5(response.content).hexdigest()),
+                "last_modified": parse_http_date_safe(last_modified),
+            }
+            cache.set(key, document, getattr(settings, "SITEMAP_CACHE_TIMEOUT", 3600))
+
+        not_modified = get_conditional_response(
+            request, etag=document["etag"], last_modified=document["last_modified"]
+        )
+        response = not_modified or HttpResponse(
+            document["content"], content_type=document["content_type"]
+        )
+        response["ETag"] = document["etag"]
+        if document["last_modified"]:
+            response["Last-Modified"] = http_date(document["last_modified"])
+        response["X-Robots-Tag"] = "noindex, noodp, noarchive"
+        return response
+
+    return wrapper
+
+
+@cached_sitemap
+def sitemap_xml(request, section=None):
+    """One urlset while every section fits on a page, else an index of chunks."""
+    if any(sitemap().paginator.num_pages > 1 for sitemap in SITEMAPS.values()):
+        return sitemap_views.index(
+            request, SITEMAPS, sitemap_url_name="sitemap_section"
+        )
+    return sitemap_views.sitemap(request, SITEMAPS)
+
+
+@cached_sitemap
+def sitemap_section(request, section=None):
+    """One section (``?p=<n>``: chunk) of the sitemap index."""
+    return sitemap_views.sitemap(request, SITEMAPS, section=section)
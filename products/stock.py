@@ -0,0 +1,271 @@
+"""
+Stock ledger: append-only movements with materialised per-product balances.
+
+Every change to coffee on hand or held for paid orders is a
+``StockMovement``. ``record_movements`` writes the rows and applies their
+deltas to ``StockBalance`` in the same transaction, so "how much can we
+sell?" is a single-row read. ``Product.stock`` stays in sync as available
+units (available grams // product weight) for the existing templates and
+forms. ``rebuild_stock_balances`` replays the ledger to repair or verify
+the balance table; ``balances_at`` answers the same question for any past
+moment. ``availability_map`` caches available grams per product and is
+invalidated whenever a movement touches that product. Each batch of
+movements also checks its products against their low-stock thresholds
+(``products.alerts``).
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, NullIf
+from django.utils import timezone
+
+from versohnung_und_vergebung_kaffee.metrics import record_cache_lookup
+from .alerts import detect_low_stock
+from .inventory import invalidate_inventory_totals
+from .models import Product, StockBalance, StockMovement
+
+# Orders whose items are held (reserved) until fulfilment.
+RESERVED_ORDER_STATUSES = {"paid", "pending_fulfillment"}
+AVAILABILITY_KEY = "products:availability:{}"
+
+
+def record_movements(movements) -> None:
+    """Append ``movements`` and apply them to the balances atomically."""
+    movements = [m for m in movements if m.on_hand_grams or m.reserved_grams]
+    if not movements:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    for movement in movements:
+        delta = deltas[movement.product_id]
+        delta[0] += movement.on_hand_grams
+        delta[1] += movement.reserved_grams
+
+    with transaction.atomic():
+        StockMovement.objects.bulk_create(movements)
+        StockBalance.objects.bulk_create(
+            [StockBalance(product_id=product_id) for product_id in deltas],
+            ignore_conflicts=True,
+        )
+        now = timezone.now()
+        for product_id, (on_hand, reserved) in sorted(deltas.items()):
+            StockBalance.objects.filter(product_id=product_id).update(
+                on_hand_grams=F("on_hand_grams") + on_hand,
+                reserved_grams=F("reserved_grams") + reserved,
+                updated_at=now,
+            )
+        sync_product_stock(deltas)
+        invalidate_availability(deltas)
+        # Batches and Product.stock are written with update(), which skips
+        # the post_save receiver that normally drops the valuation totals.
+        invalidate_inventory_totals()
+        transaction.on_commit(invalidate_inventory_totals)
+        detect_low_stock(deltas)
+
+
+def record_movement(product, kind, on_hand_grams=0, reserved_grams=0, **fields) -> None:
+    record_movements(
+        [
+            StockMovement(
+                product=product,
+                kind=kind,
+                on_hand_grams=on_hand_grams,
+                reserved_grams=reserved_grams,
+                **fields
+            )
+        ]
+    )
+
+
+def sync_product_stock(product_ids) -> None:
+    """Set ``Product.stock`` to the available units of each balance."""
+    available = (
+        StockBalance.objects.filter(product=OuterRef("pk"))
+        .annotate(available=F("on_hand_grams") - F("reserved_grams"))
+        .values("available")
+    )
+    Product.objects.filter(pk__in=list(product_ids)).update(
+        stock=Coalesce(
+            Greatest(
+                Coalesce(Subquery(available), 0) / NullIf(F("weight_grams"), 0), 0
+            ),
+            0,
+        )
+    )
+
+
+def availability_map(product_ids) -> dict:
+    """
+    ``{product_id: available_grams}`` (on hand minus reserved, never
+    negative). Cached per product; misses are filled with one query.
+    """
+    product_ids = set(product_ids)
+    keys = {AVAILABILITY_KEY.format(pk): pk for pk in product_ids}
+    cached = cache.get_many(keys)
+    record_cache_lookup("availability", len(cached) == len(keys))
+    available = {keys[key]: grams for key, grams in cached.items()}
+    missing = product_ids - available.keys()
+    if missing:
+        fetched = dict.fromkeys(missing, 0)
+        for balance in StockBalance.objects.filter(product_id__in=missing):
+            fetched[balance.product_id] = max(balance.available_grams, 0)
+        cache.set_many(
+            {AVAILABILITY_KEY.format(pk): grams for pk, grams in fetched.items()},
+            getattr(settings, "AVAILABILITY_CACHE_TIMEOUT", 300),
+        )
+        available.update(fetched)
+    return available
+
+
+def invalidate_availability(product_ids) -> None:
+    """Drop cached availability now and again once the transaction commits."""
+    keys = [AVAILABILITY_KEY.format(pk) for pk in product_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def reserve_order_stock(order_ids) -> None:
+    """Hold the grams of newly paid orders (one movement per order and product)."""
+    from orders.models import OrderItem
+
+    grams = (
+        OrderItem.objects.filter(order_id__in=list(order_ids), product__isnull=False)
+        .values("order_id", "product_id")
+        .annotate(
+            grams=Sum(
+                F("quantity")
+                * Coalesce(NullIf(F("weight_grams"), 0), F("product__weight_grams"))
+            )
+        )
+        .order_by("order_id", "product_id")
+    )
+    record_movements([
+        StockMovement(
+            product_id=row["product_id"], order_id=row["order_id"],
+            kind=StockMovement.RESERVATION, reserved_grams=row["grams"],
+        )
+        for row in grams
+    ])
+
+
+def release_order_stock(order_ids) -> None:
+    """
+    Give back whatever the orders still hold (refund or cancellation).
+
+    The held grams are read from the orders' own movements, so orders that
+    never reserved, or whose reservation already became a sale, release
+    nothing and calling this twice is harmless.
+    """
+    held = (
+        StockMovement.objects.filter(order_id__in=list(order_ids))
+        .values("order_id", "product_id")
+        .annotate(grams=Sum("reserved_grams"))
+        .filter(grams__gt=0)
+        .order_by("order_id", "product_id")
+    )
+    record_movements([
+        StockMovement(
+            product_id=row["product_id"], order_id=row["order_id"],
+            kind=StockMovement.RESERVATION, reserved_grams=-row["grams"],
+            note="Reservation released",
+        )
+        for row in held
+    ])
+
+
+def fulfil_order_stock(order) -> None:
+    """
+    Turn an order's reservation into a sale, consume its grams FIFO and
+    record what each line cost (``orders.costing.record_order_costs``).
+    The sale releases only what the order actually holds, so orders paid
+    before (or without) a reservation never drive ``reserved_grams`` below
+    zero.
+    """
+    from orders.costing import record_order_costs
+    needed = defaultdict(int)
+    products = {}
+    for item in order.items.select_related("product"):
+        if item.product is None:
+            continue
+        products[item.product_id] = item.product
+        needed[item.product_id] += (
+            item.weight_grams or item.product.weight_grams or 0
+        ) * (item.quantity or 0)
+
+    with transaction.atomic():
+        held = dict(
+            StockMovement.objects.filter(order=order)
+            .values("product_id")
+            .annotate(grams=Sum("reserved_grams"))
+            .values_list("product_id", "grams")
+        )
+        record_movements([
+            StockMovement(
+                product_id=product_id, order=order, kind=StockMovement.SALE,
+                reserved_grams=-min(grams, max(held.get(product_id) or 0, 0)),
+            )
+            for product_id, grams in sorted(needed.items())
+        ])
+        for product_id, grams in sorted(needed.items()):
+            products[product_id].consume_grams_fifo(grams, order=order)
+        record_order_costs([order.pk])
+
+
+def balances_at(moment=None, product_ids=None) -> dict:
+    """``{product_id: (on_hand_grams, reserved_grams)}`` replayed from the ledger."""
+    movements = StockMovement.objects.all()
+    if moment is not None:
+        movements = movements.filter(created_at__lte=moment)
+    if product_ids is not None:
+        movements = movements.filter(product_id__in=list(product_ids))
+    rows = (
+        movements.values("product_id")
+        .annotate(on_hand=Sum("on_hand_grams"), reserved=Sum("reserved_grams"))
+        .order_by("product_id")
+    )
+    return {row["product_id"]: (row["on_hand"], row["reserved"]) for row in rows}
+
+
+def rebuild_stock_balances(product_ids=None) -> int:
+    """
+    Replace balances with a replay of the ledger and re-sync ``Product.stock``.
+    Returns how many balances differed from the replayed value.
+    """
+    products = (
+        Product.objects.all()
+        if product_ids is None
+        else Product.objects.filter(pk__in=list(product_ids))
+    )
+    ids = list(products.values_list("pk", flat=True))
+    replayed = balances_at(product_ids=ids)
+    with transaction.atomic():
+        stored = {
+            balance.product_id: (balance.on_hand_grams, balance.reserved_grams)
+            for balance in StockBalance.objects.select_for_update().filter(
+                product_id__in=ids
+            )
+        }
+        now = timezone.now()
+        rows = [
+            StockBalance(
+                product_id=pk,
+                on_hand_grams=on_hand,
+                reserved_grams=reserved,
+                updated_at=now,
+            )
+            for pk in ids
+            for on_hand, reserved in [replayed.get(pk, (0, 0))]
+        ]
+        StockBalance.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["on_hand_grams", "reserved_grams", "updated_at"],
+            batch_size=1000,
+        )
+        sync_product_stock(ids)
+        invalidate_availability(ids)
+    return sum(1 for pk in ids if stored.get(pk, (0, 0)) != replayed.get(pk, (0, 0)))
@@ -1,10 +1,55 @@
-from django.contrib.auth.models import User
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import Permission, User
 from django.contrib.staticfiles import storage as static_storage
 from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from orders.payments import mark_orders_paid
 
-from .models import Product
+from .alerts import send_low_stock_alerts
+from .forecasting import daily_sold_grams, forecast, sales_matrix
+from .imports import import_catalogue, read_csv
+from .inventory import INVENTORY_TOTALS_KEY, inventory_totals
+from .models import (
+    Category,
+    LowStockAlert,
+    PackVariant,
+    Product,
+    ProductBatch,
+    ProductPriceHistory,
+    StockBalance,
+    StockForecast,
+    StockMovement,
+)
+from .pricing import (
+    price_history_at,
+    prices_at,
+    reprice,
+    select_products,
+    variant_preview,
+)
+from .sitemaps import SITEMAP_VERSION_KEY
+from .stock import (
+    AVAILABILITY_KEY,
+    availability_map,
+    balances_at,
+    fulfil_order_stock,
+    rebuild_stock_balances,
+    record_movement,
+)
 
 
 @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
@@ -42,7 +87,7 @@ class StaffProductViewTests(TestCase):
                 "sku": self.product.sku,
                 "price": "10.00",
                 "weight_grams": 250,
-                "stock": -1,
+                "stock_adjustment": -6,
                 "available_grinds": "whole",
                 "roast_type": "medium",
                 "is_active": "on",
@@ -53,5 +98,957 @@ class StaffProductViewTests(TestCase):
         self.assertEqual(self.product.stock, 5)
         self.assertIn(
             "Inventory cannot be negative.",
-            response.context["form"].errors.get("stock", []),
+            response.context["form"].errors.get("stock_adjustment", []),
+        )
+
+    def test_stock_is_adjusted_by_delta_not_overwritten(self):
+        self.client.login(username="staff", password="pw")
+        url = reverse("products:staff_product_update", args=[self.product.pk])
+        form = {
+            "name": self.product.name,
+            "sku": self.product.sku,
+            "cost_price": "8.00",
+            "markup_percent": "25",
+            "weight_grams": 250,
+            "available_grinds": "whole",
+            "roast_type": "medium",
+            "is_active": "on",
+            "origin": "Huye",
+            "low_stock_unit": Product.UNITS,
+        }
+        self.client.get(url)
+        # Two packs are sold while the form is open; saving it must not undo that.
+        record_movement(self.product, StockMovement.CONSUMPTION, on_hand_grams=-500)
+        self.assertEqual(self.client.post(url, form).status_code, 302)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+        self.client.post(url, {**form, "stock_adjustment": 4})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertEqual(
+            list(self.product.stock_movements.values_list("kind", "on_hand_grams")),
+            [("adjustment", 1250), ("consumption", -500), ("adjustment", 1000)],
+        )
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class StaffProductValuationTests(TestCase):
+    def setUp(self):
+        self._original_storage = static_storage.staticfiles_storage
+        static_storage.staticfiles_storage = StaticFilesStorage()
+        self.addCleanup(
+            setattr, static_storage, "staticfiles_storage", self._original_storage
+        )
+        cache.clear()
+        self.staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(self.staff)
+        self.cheap = Product.objects.create(
+            name="Cheap", sku="C-1", cost_price=Decimal("8.00"), weight_grams=250
+        )
+        self.dear = Product.objects.create(
+            name="Dear", sku="D-1", cost_price=Decimal("20.00"), weight_grams=500
+        )
+        self.empty = Product.objects.create(
+            name="Empty", sku="E-1", cost_price=Decimal("5.00"), weight_grams=250
+        )
+        ProductBatch.objects.create(
+            product=self.cheap,
+            quantity_grams=1000,
+            remaining_grams=750,
+            unit_cost=Decimal("4.10"),
+        )
+        ProductBatch.objects.create(
+            product=self.cheap,
+            quantity_grams=1000,
+            remaining_grams=333,
+            unit_cost=Decimal("5.25"),
+        )
+        ProductBatch.objects.create(
+            product=self.dear,
+            quantity_grams=5000,
+            remaining_grams=2600,
+            unit_cost=Decimal("12.00"),
+        )
+
+    def test_annotations_match_python_valuation(self):
+        for product in Product.objects.with_valuation().prefetch_related("batches"):
+            self.assertEqual(
+                product.remaining_grams_sum, product.total_remaining_grams()
+            )
+            self.assertEqual(
+                Decimal(product.total_cost).quantize(Decimal("0.01")),
+                product.batch_total_cost,
+            )
+            self.assertEqual(product.stock_units, product.batch_stock_units())
+        self.assertEqual(
+            Product.objects.with_valuation().get(pk=self.empty.pk).total_cost, 0
+        )
+
+    def test_list_sorts_by_valuation_and_paginates(self):
+        response = self.client.get(
+            reverse("products:staff_product_list"), {"sort": "-cost"}
+        )
+        self.assertEqual(
+            [p.name for p in response.context["products"]], ["Dear", "Cheap", "Empty"]
+        )
+        self.assertEqual(response.context["products"][0].total_cost, Decimal("31.20"))
+        self.assertEqual(response.context["sort_links"]["cost"], "cost")
+
+        with patch("products.views.STAFF_PRODUCTS_PER_PAGE", 2):
+            response = self.client.get(
+                reverse("products:staff_product_list"), {"sort": "name", "page": 2}
+            )
+        self.assertEqual([p.name for p in response.context["products"]], ["Empty"])
+
+    def test_totals_are_cached_and_invalidated_by_batch_changes(self):
+        totals = inventory_totals()
+        self.assertEqual(totals["products"], 3)
+        self.assertEqual(totals["total_kg"], Decimal("3.683"))
+        # 3.075 + 1.74825 + 31.20
+        self.assertEqual(totals["total_cost"], Decimal("36.02"))
+        # 8 x 1.083 + 20 x 2.6
+        self.assertEqual(totals["total_revenue"], Decimal("60.66"))
+        self.assertEqual(totals["stock_units"], 4 + 5)
+        self.assertIsNotNone(cache.get(INVENTORY_TOTALS_KEY))
+
+        with self.assertNumQueries(0):
+            inventory_totals()
+
+        ProductBatch.objects.create(
+            product=self.empty, quantity_grams=500, remaining_grams=500, unit_cost=1
+        )
+        self.assertIsNone(cache.get(INVENTORY_TOTALS_KEY))
+        self.assertEqual(inventory_totals()["stock_units"], 11)
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Ledger", sku="L-1", cost_price=Decimal("10.00"), weight_grams=250
+        )
+        self.old = ProductBatch.objects.create(
+            product=self.product,
+            quantity_grams=1000,
+            remaining_grams=1000,
+            unit_cost=Decimal("4.00"),
+        )
+        self.new = ProductBatch.objects.create(
+            product=self.product,
+            quantity_grams=1000,
+            remaining_grams=1000,
+            unit_cost=Decimal("5.00"),
+        )
+
+    def _paid_order(self, quantity):
+        order = Order.objects.create(
+            full_name="L", email="l@example.com", street="S", city="C", postal_code="1"
+        )
+        OrderItem.objects.create(
+            order=order, product=self.product, product_name_snapshot="Ledger",
+            unit_price=self.product.price, quantity=quantity, weight_grams=250,
+        )
+        mark_orders_paid([order.pk])
+        return order
+
+    def balance(self):
+        balance = StockBalance.objects.get(product=self.product)
+        return balance.on_hand_grams, balance.reserved_grams
+
+    def test_batch_changes_are_recorded(self):
+        self.assertEqual(self.balance(), (2000, 0))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+        self.new.remaining_grams = 900
+        self.new.save()
+        self.assertEqual(self.balance(), (1900, 0))
+        self.assertEqual(
+            list(self.product.stock_movements.values_list("kind", "on_hand_grams")),
+            [("receipt", 1000), ("receipt", 1000), ("adjustment", -100)],
+        )
+
+        self.new.delete()
+        self.assertEqual(self.balance(), (1000, 0))
+
+    def test_paid_orders_reserve_and_fulfilment_consumes_fifo(self):
+        order = self._paid_order(3)
+        self.assertEqual(self.balance(), (2000, 750))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+        order.status = "fulfilled"
+        order.save()
+        fulfil_order_stock(order)
+        self.assertEqual(self.balance(), (1250, 0))
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertEqual(
+            (self.old.remaining_grams, self.new.remaining_grams), (250, 1000)
+        )
+        self.assertEqual(
+            list(
+                order.stock_movements.values_list(
+                    "kind", "batch_id", "on_hand_grams", "reserved_grams"
+                )
+            ),
+            [
+                ("reservation", None, 0, 750),
+                ("sale", None, 0, -750),
+                ("consumption", self.old.pk, -750, 0),
+            ],
+        )
+
+    def test_fulfilment_refreshes_inventory_totals(self):
+        cache.clear()
+        order = self._paid_order(2)
+        self.assertEqual(inventory_totals()["total_kg"], Decimal("2.000"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fulfil_order_stock(order)
+        self.assertIsNone(cache.get(INVENTORY_TOTALS_KEY))
+        totals = inventory_totals()
+        self.assertEqual(totals["total_kg"], Decimal("1.500"))
+        self.assertEqual(totals["total_cost"], Decimal("7.00"))  # 0.5 x 4 + 1 x 5
+
+    def test_rebuild_replays_ledger_and_reports_drift(self):
+        self._paid_order(1)
+        StockBalance.objects.filter(product=self.product).update(on_hand_grams=1)
+        Product.objects.filter(pk=self.product.pk).update(stock=99)
+
+        self.assertEqual(rebuild_stock_balances(), 1)
+        self.assertEqual(self.balance(), (2000, 250))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertEqual(rebuild_stock_balances(), 0)
+
+        out = StringIO()
+        call_command("rebuild_stock_balances", sku=["L-1"], stdout=out)
+        self.assertIn("Rebuilt 1 balance(s); 0 differed.", out.getvalue())
+
+    def test_balances_at_a_past_moment(self):
+        StockMovement.objects.filter(product=self.product).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        self._paid_order(2)
+        yesterday = timezone.now() - timedelta(days=1)
+        self.assertEqual(balances_at(yesterday)[self.product.pk], (2000, 0))
+        self.assertEqual(balances_at()[self.product.pk], (2000, 500))
+
+    def test_movements_are_append_only(self):
+        movement = self.product.stock_movements.first()
+        movement.note = "edited"
+        with self.assertRaises(ValueError):
+            movement.save()
+
+
+class PackVariantAvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stocked = Product.objects.create(
+            name="Stocked", sku="S-1", cost_price=Decimal("10.00"), weight_grams=250
+        )
+        self.empty = Product.objects.create(
+            name="Empty", sku="E-1", cost_price=Decimal("10.00"), weight_grams=250
+        )
+        for grams in (1000, 1100):
+            ProductBatch.objects.create(
+                product=self.stocked,
+                quantity_grams=grams,
+                remaining_grams=grams,
+                unit_cost=4,
+            )
+        for product in (self.stocked, self.empty):
+            for grams in (250, 1000):
+                PackVariant.objects.create(
+                    product=product, name=f"{grams}g", sku=f"{product.sku}-{grams}",
+                    pack_weight_grams=grams, price=Decimal("9.00"),
+                )
+
+    def test_with_availability_uses_one_query(self):
+        with self.assertNumQueries(1):
+            packs = {
+                v.sku: v.available_units
+                for v in PackVariant.objects.with_availability()
+            }
+        self.assertEqual(
+            packs, {"S-1-250": 8, "S-1-1000": 2, "E-1-250": 0, "E-1-1000": 0}
+        )
+
+    def test_availability_map_is_cached_and_invalidated_by_batch_changes(self):
+        self.assertEqual(
+            availability_map([self.stocked.pk, self.empty.pk]),
+            {self.stocked.pk: 2100, self.empty.pk: 0},
+        )
+        variant = PackVariant.objects.get(sku="S-1-1000")
+        with self.assertNumQueries(0):
+            self.assertEqual(variant.available_units, 2)
+
+        ProductBatch.objects.create(
+            product=self.stocked, quantity_grams=900, remaining_grams=900, unit_cost=4
+        )
+        self.assertIsNone(cache.get(AVAILABILITY_KEY.format(self.stocked.pk)))
+        self.assertEqual(variant.available_units, 3)
+
+
+PRODUCTS_CSV = """\
+sku;name;category;cost_price;markup_percent;weight_grams;available_grinds
+P-1;Gisenyi;;9,50;20;250;whole,filter
+N-1;Nyungwe;filter;6,00;50;250;
+N-2;Nyungwe;;6,00;50;250;whole
+"""
+BATCHES_CSV = """sku,quantity_grams,remaining_grams,unit_cost,note
+N-1,1000,,5.00,first lot
+N-1,600,500,5.20,
+P-1,500,500,7.00,
+"""
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class CatalogueImportTests(TestCase):
+    def setUp(self):
+        self._original_storage = static_storage.staticfiles_storage
+        static_storage.staticfiles_storage = StaticFilesStorage()
+        self.addCleanup(
+            setattr, static_storage, "staticfiles_storage", self._original_storage
+        )
+        Category.objects.create(name="Filter")
+        self.existing = Product.objects.create(
+            name="Gisenyi",
+            sku="P-1",
+            cost_price=Decimal("8.00"),
+            markup_percent=20,
+            weight_grams=250,
+        )
+
+    def test_dry_run_reports_diff_without_writing(self):
+        report = import_catalogue(
+            read_csv(PRODUCTS_CSV), read_csv(BATCHES_CSV), dry_run=True
+        )
+        self.assertTrue(report.ok)
+        self.assertFalse(report.applied)
+        self.assertEqual(
+            [row["action"] for row in report.products], ["update", "create", "create"]
+        )
+        self.assertEqual(
+            report.products[0]["changes"]["cost_price"],
+            (Decimal("8.00"), Decimal("9.50")),
+        )
+        self.assertEqual(len(report.batches), 3)
+        self.assertEqual(Product.objects.count(), 1)
+        self.assertFalse(ProductBatch.objects.exists())
+
+    def test_import_upserts_products_and_books_batches_once_per_product(self):
+        report = import_catalogue(read_csv(PRODUCTS_CSV), read_csv(BATCHES_CSV))
+        self.assertTrue(report.applied)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(
+            (self.existing.price, self.existing.available_grinds),
+            (Decimal("11.40"), "whole,filter"),
+        )
+        new = Product.objects.get(sku="N-1")
+        self.assertEqual(
+            (new.price, new.category.name, new.slug),
+            (Decimal("9.00"), "Filter", "nyungwe-250"),
+        )
+        self.assertEqual(Product.objects.get(sku="N-2").slug, "nyungwe-250-n-2")
+
+        self.assertEqual(new.stock, 6)  # (1000 + 500) // 250
+        self.assertEqual(new.stock_balance.on_hand_grams, 1500)
+        self.assertEqual(
+            sorted(
+                new.stock_movements.values_list(
+                    "batch__remaining_grams", "on_hand_grams"
+                )
+            ),
+            [(500, 500), (1000, 1000)],
+        )
+        self.assertEqual(rebuild_stock_balances(), 0)
+
+        again = import_catalogue(read_csv(PRODUCTS_CSV))
+        self.assertEqual({row["action"] for row in again.products}, {"unchanged"})
+
+    def test_boolean_columns_parse_explicitly(self):
+        rows = [
+            {"sku": "P-1", "is_active": "0"},
+            {"sku": "B-1", "name": "Kivu", "cost_price": "5", "is_active": "Yes"},
+            {"sku": "B-2", "name": "Kivu", "cost_price": "5", "is_active": "false"},
+        ]
+        report = import_catalogue(rows)
+        self.assertTrue(report.applied)
+        self.assertEqual(
+            dict(Product.objects.values_list("sku", "is_active")),
+            {"P-1": False, "B-1": True, "B-2": False},
+        )
+
+        report = import_catalogue([{"sku": "P-1", "is_active": "on"}])
+        self.assertEqual(
+            [message for _, _, message in report.errors],
+            ["is_active: Enter 1/0, true/false or yes/no, not 'on'."],
+        )
+
+    def test_invalid_rows_abort_the_whole_import(self):
+        products = PRODUCTS_CSV + "X-1;;nope;-1;0;0;espresso,turkish\n"
+        batches = BATCHES_CSV + "N-1,100,200,1.00,\nZZZ,100,,1.00,\n"
+        report = import_catalogue(read_csv(products), read_csv(batches))
+        self.assertFalse(report.applied)
+        messages = [message for _, _, message in report.errors]
+        self.assertIn("category: Unknown category: nope", messages)
+        self.assertIn("Remaining grams cannot exceed received grams.", messages)
+        self.assertIn("Unknown SKU: ZZZ", messages)
+        self.assertTrue(
+            any(message.startswith("available_grinds:") for message in messages)
+        )
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_staff_upload_requires_manager_and_shows_report(self):
+        url = reverse("products:staff_product_import")
+        manager = User.objects.create_user("importer", password="pw", is_staff=True)
+        self.client.force_login(manager)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        manager.user_permissions.add(Permission.objects.get(codename="add_product"))
+        upload = SimpleUploadedFile(
+            "products.csv", PRODUCTS_CSV.encode("utf-8-sig"), content_type="text/csv"
+        )
+        response = self.client.post(url, {"products_csv": upload, "dry_run": "on"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["report"].created, 2)
+        self.assertEqual(Product.objects.count(), 1)
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class RepricingTests(TestCase):
+    def setUp(self):
+        self._original_storage = static_storage.staticfiles_storage
+        static_storage.staticfiles_storage = StaticFilesStorage()
+        self.addCleanup(
+            setattr, static_storage, "staticfiles_storage", self._original_storage
+        )
+        espresso = Category.objects.create(name="Espresso")
+        self.a = Product.objects.create(
+            name="A",
+            sku="A-1",
+            category=espresso,
+            cost_price=Decimal("8.35"),
+            markup_percent=Decimal("33.30"),
+        )
+        self.b = Product.objects.create(
+            name="B",
+            sku="B-1",
+            category=espresso,
+            cost_price=Decimal("0.29"),
+            markup_percent=Decimal("12.50"),
+        )
+        self.other = Product.objects.create(
+            name="C", sku="C-1", cost_price=Decimal("5.00"), markup_percent=10
+        )
+        self.kilo = PackVariant.objects.create(
+            product=self.a,
+            name="1kg",
+            sku="A-1000",
+            pack_weight_grams=1000,
+            price=1,
+            markup_percent=25,
+        )
+
+    def test_bulk_update_rounds_like_product_save(self):
+        changed, variants = reprice(
+            select_products(category="espresso"),
+            cost_change_percent=Decimal("7.5"),
+            variants=True,
+        )
+        self.assertEqual((changed, variants), (2, 1))
+        for product in (self.a, self.b):
+            product.refresh_from_db()
+            repriced = product.price
+            product.save()  # recomputes price in Python with ROUND_HALF_UP
+            self.assertEqual(product.price, repriced)
+        self.assertEqual(
+            (self.a.cost_price, self.a.price), (Decimal("8.98"), Decimal("11.97"))
+        )
+        self.assertEqual(
+            (self.b.cost_price, self.b.price), (Decimal("0.31"), Decimal("0.35"))
+        )
+        self.kilo.refresh_from_db()
+        self.assertEqual(self.kilo.price, Decimal("44.90"))  # 8.98 x 4 x 1.25
+        self.assertEqual(Product.objects.get(sku="C-1").price, Decimal("5.50"))
+
+        history = ProductPriceHistory.objects.filter(source=ProductPriceHistory.REPRICE)
+        self.assertEqual(
+            list(
+                history.order_by("product__sku", "variant__sku").values_list(
+                    "product__sku", "variant__sku", "price"
+                )
+            ),
+            [
+                ("A-1", None, Decimal("11.97")),
+                ("A-1", "A-1000", Decimal("44.90")),
+                ("B-1", None, Decimal("0.35")),
+            ],
+        )
+        self.assertEqual(
+            reprice(select_products(skus=["A-1"]), markup_percent=Decimal("33.30")),
+            (0, 0),
+        )
+
+    def test_variant_prices_do_not_overflow_32_bit_integers(self):
+        product = Product.objects.create(
+            name="D",
+            sku="D-1",
+            cost_price=Decimal("48.37"),
+            markup_percent=10,
+            weight_grams=250,
+        )
+        PackVariant.objects.create(
+            product=product,
+            name="1kg",
+            sku="D-1000",
+            pack_weight_grams=1000,
+            price=1,
+            markup_percent=Decimal("37.50"),
+        )
+        variants = PackVariant.objects.filter(sku="D-1000")
+        # 4837 cents x 1000 g x 13750 bp = 66,508,750,000, beyond a PostgreSQL integer.
+        preview = variant_preview(variants)
+        self.assertNotIn("AS integer)", str(preview.query))
+        # 48.37 x 4 x 1.375 = 266.035
+        self.assertEqual(preview.get().new_price, Decimal("266.04"))
+        reprice(
+            select_products(skus=["D-1"]),
+            cost_change_percent=Decimal("0"),
+            variants=True,
+        )
+        self.assertEqual(variants.get().price, Decimal("266.04"))
+
+    def test_staff_preview_then_apply(self):
+        manager = User.objects.create_user("pricer", password="pw", is_staff=True)
+        manager.user_permissions.add(Permission.objects.get(codename="add_product"))
+        self.client.force_login(manager)
+        url = reverse("products:staff_product_reprice")
+        data = {
+            "skus": "A-1, C-1",
+            "cost_mode": "keep",
+            "markup_percent": "50",
+            "variants": "on",
+        }
+
+        response = self.client.post(url, data)
+        self.assertEqual(
+            [p.new_price for p in response.context["preview"]],
+            [Decimal("12.53"), Decimal("7.50")],
+        )
+        self.assertEqual(
+            [v.new_price for v in response.context["variants"]], [Decimal("41.75")]
+        )
+        self.assertEqual(
+            Product.objects.get(sku="A-1").markup_percent, Decimal("33.30")
+        )
+
+        response = self.client.post(url, {**data, "apply": ""})
+        self.assertRedirects(
+            response,
+            reverse("products:staff_product_list"),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(Product.objects.get(sku="C-1").price, Decimal("7.50"))
+        self.assertEqual(PackVariant.objects.get(sku="A-1000").price, Decimal("41.75"))
+
+    def test_command_requires_a_selection_and_supports_dry_run(self):
+        with self.assertRaises(CommandError):
+            call_command("reprice_products", markup=Decimal("10"))
+        out = StringIO()
+        call_command(
+            "reprice_products",
+            sku=["C-1"],
+            cost=Decimal("6.00"),
+            dry_run=True,
+            stdout=out,
+        )
+        self.assertIn("price 5.50 -> 6.60", out.getvalue())
+        self.assertEqual(Product.objects.get(sku="C-1").price, Decimal("5.50"))
+
+
+class PriceHistoryTests(TestCase):
+    def setUp(self):
+        self.a = Product.objects.create(
+            name="A", sku="A-1", cost_price=Decimal("10.00"), markup_percent=50
+        )
+        self.b = Product.objects.create(
+            name="B", sku="B-1", cost_price=Decimal("4.00"), markup_percent=25
+        )
+
+    def _backdate(self, product, moment):
+        ProductPriceHistory.objects.filter(product=product).update(valid_from=moment)
+
+    def test_save_records_price_changes_only(self):
+        self.a.description = "New description"
+        self.a.save()
+        self.a.stock = 3
+        self.a.save()
+        self.assertEqual(self.a.price_history.count(), 1)
+
+        self.a.markup_percent = 60
+        self.a.save()
+        self.assertEqual(
+            list(self.a.price_history.values_list("price", "source")),
+            [
+                (Decimal("16.00"), ProductPriceHistory.SAVE),
+                (Decimal("15.00"), ProductPriceHistory.SAVE),
+            ],
+        )
+
+    def test_prices_at_resolves_many_products_in_one_query(self):
+        start = timezone.now() - timedelta(days=30)
+        self._backdate(self.a, start)
+        self._backdate(self.b, start)
+        self.a.cost_price = Decimal("12.00")
+        self.a.save()
+        ProductPriceHistory.objects.filter(
+            product=self.a, price=Decimal("18.00")
+        ).update(valid_from=start + timedelta(days=10))
+        reprice(select_products(skus=["B-1"]), markup_percent=Decimal("50"))
+
+        with self.assertNumQueries(1):
+            before = prices_at(start + timedelta(days=5))
+        self.assertEqual(
+            before, {self.a.pk: Decimal("15.00"), self.b.pk: Decimal("5.00")}
+        )
+        self.assertEqual(
+            prices_at(), {self.a.pk: Decimal("18.00"), self.b.pk: Decimal("6.00")}
+        )
+        self.assertEqual(prices_at(start - timedelta(days=1)), {})
+        self.assertEqual(
+            prices_at(product_ids=[self.b.pk]), {self.b.pk: Decimal("6.00")}
+        )
+
+        moment = start + timedelta(days=15)
+        window = list(
+            price_history_at(moment)
+            .order_by("product_id")
+            .values_list("product_id", "price")
+        )
+        with patch.object(connection.features, "supports_over_clause", False):
+            fallback = list(
+                price_history_at(moment)
+                .order_by("product_id")
+                .values_list("product_id", "price")
+            )
+        self.assertEqual(window, fallback)
+        self.assertEqual(
+            window, [(self.a.pk, Decimal("18.00")), (self.b.pk, Decimal("5.00"))]
+        )
+
+    def test_import_records_new_and_changed_prices(self):
+        rows = read_csv(
+            "sku,name,cost_price,markup_percent\n"
+            "A-1,A,10.00,50\n"
+            "B-1,B,5.00,25\n"
+            "N-1,New,8.00,50\n"
+        )
+        self.assertTrue(import_catalogue(product_rows=rows).ok)
+        imported = ProductPriceHistory.objects.filter(source=ProductPriceHistory.IMPORT)
+        self.assertEqual(
+            sorted(imported.values_list("product__sku", "price")),
+            [("B-1", Decimal("6.25")), ("N-1", Decimal("12.00"))],
+        )
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class StockForecastTests(TestCase):
+    def setUp(self):
+        self._original_storage = static_storage.staticfiles_storage
+        static_storage.staticfiles_storage = StaticFilesStorage()
+        self.addCleanup(
+            setattr, static_storage, "staticfiles_storage", self._original_storage
+        )
+        self.today = timezone.localdate()
+        self.fast = Product.objects.create(
+            name="Fast", sku="F-1", cost_price=Decimal("10.00"), weight_grams=250
+        )
+        self.slow = Product.objects.create(
+            name="Slow", sku="S-1", cost_price=Decimal("10.00"), weight_grams=250
+        )
+        ProductBatch.objects.create(
+            product=self.fast, quantity_grams=7000, remaining_grams=6250, unit_cost=4
+        )
+        ProductBatch.objects.create(
+            product=self.slow, quantity_grams=1000, remaining_grams=1000, unit_cost=4
+        )
+        self._order(4, days_ago=0)
+        self._order(8, days_ago=10)
+        self._order(4, days_ago=40)
+        self._order(20, days_ago=1, paid=False)
+
+    def _order(self, quantity, days_ago, paid=True):
+        order = Order.objects.create(
+            full_name="F", email="f@example.com", street="S", city="C", postal_code="1"
+        )
+        OrderItem.objects.create(
+            order=order, product=self.fast, product_name_snapshot="Fast",
+            unit_price=self.fast.price, quantity=quantity, weight_grams=250,
+        )
+        if paid:
+            mark_orders_paid([order.pk])
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+
+    def test_daily_sales_are_grouped_in_one_query(self):
+        start = self.today - timedelta(days=27)
+        with self.assertNumQueries(1):
+            rows = daily_sold_grams(start, self.today)
+        self.assertEqual(
+            sorted(rows, key=lambda row: row[1]),
+            [
+                (self.fast.pk, self.today - timedelta(days=10), 2000),
+                (self.fast.pk, self.today, 1000),
+            ],
+        )
+        matrix = sales_matrix(rows, [self.slow.pk, self.fast.pk], start, 28)
+        self.assertEqual(matrix.shape, (2, 28))
+        self.assertEqual(matrix[0].sum(), 0)
+        self.assertEqual((matrix[1, 17], matrix[1, 27]), (2000, 1000))
+
+    def test_velocity_cover_and_reorder(self):
+        rows = {row.product_id: row for row in forecast(today=self.today)}
+        fast = rows[self.fast.pk]
+        self.assertEqual(fast.sold_grams, 4000)
+        self.assertAlmostEqual(fast.avg_7d_grams, 1000 / 7)
+        self.assertAlmostEqual(fast.avg_28d_grams, 3000 / 28)
+        self.assertAlmostEqual(fast.daily_grams, 125)
+        # Less the paid reservations.
+        self.assertEqual(fast.available_grams, 6250 - 4000)
+        self.assertAlmostEqual(fast.days_of_cover, 18)
+        # Lead time plus target cover.
+        self.assertEqual(fast.reorder_grams, 125 * 42 - 2250)
+        self.assertEqual(fast.reorder_by, self.today + timedelta(days=4))
+
+        slow = rows[self.slow.pk]
+        self.assertIsNone(slow.days_of_cover)
+        self.assertEqual((slow.reorder_grams, slow.reorder_by), (0, None))
+
+    def test_command_stores_forecasts_for_the_staff_page(self):
+        out = StringIO()
+        call_command("forecast_stock", stdout=out)
+        self.assertIn("Forecast 2 product(s); 1 to reorder.", out.getvalue())
+        self.assertEqual(StockForecast.objects.count(), 2)
+
+        self.slow.is_active = False
+        self.slow.save()
+        call_command("forecast_stock", "--lead-time", "0", stdout=StringIO())
+        self.assertEqual(
+            list(StockForecast.objects.values_list("product_id", flat=True)),
+            [self.fast.pk],
+        )
+
+        url = reverse("products:staff_stock_forecast")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(
+            User.objects.create_user("staff", password="pw", is_staff=True)
+        )
+        response = self.client.get(url, {"all": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row.product for row in response.context["forecasts"]], [self.fast]
+        )
+        self.assertContains(response, "Fast")
+
+
+@override_settings(
+    ORDER_NOTIFICATION_EMAILS=["ops@example.com"], LOW_STOCK_ALERT_EMAILS=[]
+)
+class LowStockAlertTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Alert",
+            sku="AL-1",
+            cost_price=Decimal("10.00"),
+            weight_grams=250,
+            low_stock_threshold=4,
+        )
+        self.batch = ProductBatch.objects.create(
+            product=self.product, quantity_grams=2000, remaining_grams=2000, unit_cost=4
+        )
+
+    def _paid_order(self, quantity):
+        order = Order.objects.create(
+            full_name="A", email="a@example.com", street="S", city="C", postal_code="1"
+        )
+        OrderItem.objects.create(
+            order=order, product=self.product, product_name_snapshot="Alert",
+            unit_price=self.product.price, quantity=quantity, weight_grams=250,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_orders_paid([order.pk])
+
+    def test_one_alert_per_crossing_and_rearm_on_recovery(self):
+        self._paid_order(3)  # 1250 g left, threshold 4 x 250 g
+        self.assertFalse(LowStockAlert.objects.exists())
+
+        self._paid_order(1)
+        self._paid_order(1)
+        alert = LowStockAlert.objects.get()
+        self.assertEqual((alert.available_grams, alert.threshold_grams), (1000, 1000))
+        self.assertIsNotNone(alert.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["ops@example.com"])
+        self.assertIn("Alert (AL-1): 1000 g available", mail.outbox[0].body)
+
+        self.batch.remaining_grams = 3000
+        self.batch.save()
+        self.assertFalse(
+            StockBalance.objects.get(product=self.product).low_stock_alerted
+        )
+        self._paid_order(4)
+        self.assertEqual(
+            list(LowStockAlert.objects.values_list("available_grams", flat=True)),
+            [750, 1000],
+        )
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_gram_thresholds_and_products_without_threshold(self):
+        Product.objects.filter(pk=self.product.pk).update(
+            low_stock_threshold=1900, low_stock_unit=Product.GRAMS
+        )
+        other = Product.objects.create(
+            name="Quiet", sku="Q-1", cost_price=Decimal("10.00")
+        )
+        ProductBatch.objects.create(
+            product=other, quantity_grams=100, remaining_grams=100, unit_cost=4
+        )
+
+        self.batch.remaining_grams = 1900
+        self.batch.save()
+        self.assertEqual(
+            list(LowStockAlert.objects.values_list("product_id", "available_grams")),
+            [(self.product.pk, 1900)],
+        )
+
+        with override_settings(ORDER_NOTIFICATION_EMAILS=[]):
+            self.assertEqual(
+                send_low_stock_alerts(
+                    LowStockAlert.objects.values_list("pk", flat=True)
+                ),
+                0,
+            )
+        self.assertIsNone(LowStockAlert.objects.get().sent_at)
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class SitemapTests(TestCase):
+    def setUp(self):
+        self._original_storage = static_storage.staticfiles_storage
+        static_storage.staticfiles_storage = StaticFilesStorage()
+        self.addCleanup(
+            setattr, static_storage, "staticfiles_storage", self._original_storage
+        )
+        cache.clear()
+        self.beans = Category.objects.create(name="Beans")
+        Category.objects.create(name="Empty")
+        self.a = Product.objects.create(
+            name="Alpha", sku="SA-1", cost_price=Decimal("10.00"), category=self.beans
+        )
+        self.b = Product.objects.create(
+            name="Beta", sku="SB-1", cost_price=Decimal("10.00")
+        )
+        Product.objects.create(
+            name="Hidden", sku="SH-1", cost_price=Decimal("10.00"), is_active=False
+        )
+
+    def test_lists_active_catalogue_and_answers_conditional_gets(self):
+        response = self.client.get(reverse("sitemap_xml"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/xml")
+        body = response.content.decode()
+        self.assertIn("<urlset", body)
+        for path in [
+            "/shop/",
+            self.a.get_absolute_url(),
+            self.b.get_absolute_url(),
+            "/shop/?category=beans",
+        ]:
+            self.assertIn(f"<loc>https://example.com{path}</loc>", body)
+        self.assertNotIn("hidden", body)
+        self.assertNotIn("category=empty", body)
+        self.assertIn(f"<lastmod>{self.b.updated_at:%Y-%m-%d}</lastmod>", body)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get(reverse("sitemap_xml")).content, response.content
+            )
+            cached = self.client.get(
+                reverse("sitemap_xml"), HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+            self.assertEqual(cached.status_code, 304)
+            since = self.client.get(
+                reverse("sitemap_xml"), HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+            self.assertEqual(since.status_code, 304)
+
+        self.b.is_active = False
+        self.b.save()
+        changed = self.client.get(
+            reverse("sitemap_xml"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotIn(self.b.get_absolute_url(), changed.content.decode())
+
+    def test_bulk_paths_invalidate_and_large_catalogues_become_an_index(self):
+        self.client.get(reverse("sitemap_xml"))
+        version = cache.get(SITEMAP_VERSION_KEY)
+        reprice(select_products(skus=["SA-1"]), markup_percent=Decimal("10"))
+        self.assertNotEqual(cache.get(SITEMAP_VERSION_KEY), version)
+
+        self.client.get(reverse("sitemap_xml"))
+        import_catalogue(
+            product_rows=read_csv(
+                "sku,name,cost_price,markup_percent\nSC-1,Gamma,5.00,50\n"
+            )
+        )
+        self.assertIn(
+            "/shop/gamma-250/</loc>",
+            self.client.get(reverse("sitemap_xml")).content.decode(),
+        )
+
+        with override_settings(SITEMAP_LIMIT=1):
+            cache.clear()
+            index = self.client.get(reverse("sitemap_xml")).content.decode()
+            self.assertIn("<sitemapindex", index)
+            self.assertIn(
+                "<loc>https://example.com/sitemap-products.xml?p=3</loc>", index
+            )
+            chunk = self.client.get(
+                reverse("sitemap_section", args=["products"]), {"p": 3}
+            )
+            cached = set(cache._cache)
+            products_url = reverse("sitemap_section", args=["products"])
+            for junk in ["x", "0", "-1", "3.0"]:
+                response = self.client.get(products_url, {"p": junk})
+                self.assertEqual(response.status_code, 404)
+            response = self.client.get(reverse("sitemap_section", args=["nope"]))
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(set(cache._cache), cached)
+        self.assertEqual(chunk.status_code, 200)
+        self.assertIn("/shop/gamma-250/</loc>", chunk.content.decode())
+
+    def test_shop_filters_by_category(self):
+        response = self.client.get(self.beans.get_absolute_url())
+        self.assertEqual([p.name for p in response.context["products"]], ["Alpha"])
+        self.assertEqual(
+            self.client.get(
+                reverse("products:product_list"), {"category": "nope"}
+            ).status_code,
+            404,
         )
@@ -11,6 +11,21 @@ urlpatterns = [
         views.staff_product_create,
         name="staff_product_create",
     ),
+    path(
+        "staff/products/import/",
+        views.staff_product_import,
+        name="staff_product_import",
+    ),
+    path(
+        "staff/products/reprice/",
+        views.staff_product_reprice,
+        name="staff_product_reprice",
+    ),
+    path(
+        "staff/products/forecast/",
+        views.staff_stock_forecast,
+        name="staff_stock_forecast",
+    ),
     path(
         "staff/products/<int:pk>/",
         views.staff_product_detail,
@@ -36,6 +51,16 @@ urlpatterns = [
         views.staff_product_batch_edit,
         name="staff_product_batch_edit",
     ),
+    path(
+        "staff/products/<int:product_id>/variants/add/",
+        views.pack_variant_add,
+        name="pack_variant_add",
+    ),
+    path(
+        "staff/variants/<int:variant_id>/edit/",
+        views.pack_variant_edit,
+        name="pack_variant_edit",
+    ),
     path(
         "<slug:slug>/",
         views.ProductDetailView.as_view(),
@@ -3,17 +3,30 @@ from decimal import Decimal, ROUND_HALF_UP
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Avg, Count, Prefetch
+from django.core.paginator import Paginator
+from django.db.models import Avg, Count, Max, Prefetch
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
 from django.views.generic import DetailView, ListView
 
 from orders.models import OrderItem
 from reviews.forms import ProductReviewForm
 from reviews.models import ProductReview
-from .forms import ProductForm, ProductBatchForm, PackVariantForm
-from .models import Product, ProductBatch, PackVariant
+from versohnung_und_vergebung_kaffee.routers import read_from_replica
+from .forms import (
+    CatalogueImportForm,
+    PackVariantForm,
+    ProductBatchForm,
+    ProductForm,
+    RepricingForm,
+)
+from .imports import import_catalogue, read_csv
+from .inventory import inventory_totals
+from .pricing import reprice, reprice_preview, variant_preview
+from .models import Category, Product, ProductBatch, PackVariant, StockForecast
 
 
+@method_decorator(read_from_replica, name="dispatch")
 class ProductListView(ListView):
     model = Product
     template_name = "products/product_list.html"
@@ -21,8 +34,17 @@ class ProductListView(ListView):
     paginate_by = 12
 
     def get_queryset(self):
+        products = Product.objects.filter(is_active=True)
+        # ``?category=<slug>`` narrows the shop to one category (linked from the
+        # sitemap).
+        self.category = None
+        if self.request.GET.get("category"):
+            self.category = get_object_or_404(
+                Category, slug=self.request.GET["category"]
+            )
+            products = products.filter(category=self.category)
         return (
-            Product.objects.filter(is_active=True)
+            products
             .annotate(
                 average_rating=Avg("reviews__rating"),
                 review_count=Count("reviews"),
@@ -30,6 +52,11 @@ class ProductListView(ListView):
             .order_by("-created_at")
         )
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["category"] = self.category
+        return ctx
+
 
 class ProductDetailView(DetailView):
     model = Product
@@ -58,6 +85,9 @@ class ProductDetailView(DetailView):
         values = [g.strip() for g in raw.split(",") if g.strip()]
         choices = [(g, g.replace("_", " ").title()) for g in values]
         ctx["grind_choices"] = choices
+        ctx["variants"] = list(
+            product.variants.filter(is_active=True).with_availability()
+        )
         # Access prefetched reviews efficiently
         reviews_list = list(product.reviews.all())
         ctx["reviews"] = reviews_list
@@ -104,34 +134,91 @@ manager_required = user_passes_test(
 )
 
 
+# ?sort= values for the staff product list -> annotated/model fields.
+STAFF_PRODUCT_SORTS = {
+    "name": "name",
+    "sku": "sku",
+    "price": "price",
+    "kg": "remaining_grams_sum",
+    "cost": "total_cost",
+    "revenue": "total_revenue",
+    "stock": "stock_units",
+    "created": "created_at",
+}
+STAFF_PRODUCTS_PER_PAGE = 50
+REPRICE_PREVIEW_ROWS = 200
+
+
 @login_required
 @staff_required
+@read_from_replica
 def staff_product_list(request):
-    products = list(
-        Product.objects.order_by("-created_at").prefetch_related("batches")
+    sort = request.GET.get("sort") or "-created"
+    if sort.lstrip("-") not in STAFF_PRODUCT_SORTS:
+        sort = "-created"
+    descending = sort.startswith("-")
+    field = STAFF_PRODUCT_SORTS[sort.lstrip("-")]
+
+    # Valuation is aggregated in SQL; only the current page is materialised.
+    products = Product.objects.with_valuation().order_by(
+        f"-{field}" if descending else field, "-pk"
     )
+    page_obj = Paginator(products, STAFF_PRODUCTS_PER_PAGE).get_page(
+        request.GET.get("page")
+    )
+    for p in page_obj:
+        p.total_kg = (Decimal(p.remaining_grams_sum) / Decimal(1000)).quantize(
+            Decimal("0.001")
+        )
+        p.total_cost = Decimal(p.total_cost).quantize(
+            Decimal("0.01"), rounding=ROUND_HALF_UP
+        )
+        p.total_revenue = Decimal(p.total_revenue).quantize(
+            Decimal("0.01"), rounding=ROUND_HALF_UP
+        )
 
-    for p in products:
-        # Compute based on batches (remaining grams)
-        batches = list(p.batches.all())
-        total_grams = sum((Decimal(b.remaining_grams or 0) for b in batches), Decimal("0"))
-        total_kg = (total_grams / Decimal(1000)).quantize(Decimal("0.001"))
-        p.total_kg = total_kg
-        p.batch_stock_units = p.batch_stock_units()
+    # Clicking the active column flips its direction; others start ascending.
+    sort_links = {
+        key: (key if sort == f"-{key}" else f"-{key}" if sort == key else key)
+        for key in STAFF_PRODUCT_SORTS
+    }
 
-        total_cost = Decimal("0.00")
-        for b in batches:
-            kg = (Decimal(b.remaining_grams or 0) / Decimal(1000))
-            total_cost += kg * (b.unit_cost or Decimal("0.00"))
-        p.total_cost = total_cost.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return render(
+        request,
+        "products/staff_product_list.html",
+        {
+            "products": page_obj.object_list,
+            "page_obj": page_obj,
+            "sort": sort,
+            "sort_links": sort_links,
+            "totals": inventory_totals(),
+        },
+    )
 
-        sale_price = Decimal(p.price or 0)
-        p.total_revenue = (sale_price * total_kg).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
+@login_required
+@staff_required
+@read_from_replica
+def staff_stock_forecast(request):
+    """Reorder suggestions precomputed by ``manage.py forecast_stock``."""
+    show_all = request.GET.get("all") == "1"
+    forecasts = StockForecast.objects.select_related("product")
+    if not show_all:
+        forecasts = forecasts.filter(reorder_grams__gt=0)
+    page_obj = Paginator(forecasts, STAFF_PRODUCTS_PER_PAGE).get_page(
+        request.GET.get("page")
+    )
     return render(
         request,
-        "products/staff_product_list.html",
-        {"products": products},
+        "products/staff_stock_forecast.html",
+        {
+            "forecasts": page_obj.object_list,
+            "page_obj": page_obj,
+            "show_all": show_all,
+            "computed_at": StockForecast.objects.aggregate(
+                latest=Max("computed_at")
+            )["latest"],
+        },
     )
 
 
@@ -157,6 +244,7 @@ def staff_product_detail(request, pk: int):
     unit_price = Decimal(product.price or 0)
     total_revenue = (unit_price * kg_total).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
     stock_units = product.batch_stock_units()
+    variants = PackVariant.objects.filter(product=product).with_availability()
 
     return render(
         request,
@@ -168,6 +256,7 @@ def staff_product_detail(request, pk: int):
             "total_revenue": total_revenue,
             "batches": batches,
             "batch_stock_units": stock_units,
+            "variants": variants,
         },
     )
 
@@ -191,6 +280,92 @@ def staff_product_create(request):
     )
 
 
+@login_required
+@manager_required
+def staff_product_import(request):
+    report = None
+    if request.method == "POST":
+        form = CatalogueImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                product_rows, batch_rows = (
+                    read_csv(upload.read()) if upload else []
+                    for upload in (
+                        form.cleaned_data["products_csv"],
+                        form.cleaned_data["batches_csv"],
+                    )
+                )
+            except UnicodeDecodeError:
+                form.add_error(None, "CSV files must be UTF-8 encoded.")
+            else:
+                report = import_catalogue(
+                    product_rows, batch_rows, dry_run=form.cleaned_data["dry_run"]
+                )
+                if report.applied:
+                    messages.success(
+                        request,
+                        f"Imported {report.created} new and "
+                        f"{report.updated} updated products "
+                        f"and {len(report.batches)} batches.",
+                    )
+                elif report.ok:
+                    messages.info(request, "Dry run: nothing was written.")
+                else:
+                    messages.error(
+                        request,
+                        "Nothing was imported; fix the rows below and upload again.",
+                    )
+    else:
+        form = CatalogueImportForm()
+
+    return render(
+        request, "products/staff_product_import.html", {"form": form, "report": report}
+    )
+
+
+@login_required
+@manager_required
+def staff_product_reprice(request):
+    """Preview a cost/markup change on filtered products, then apply it in bulk."""
+    form = RepricingForm(request.POST or None)
+    preview = variants = None
+    if request.method == "POST" and form.is_valid():
+        products = form.selected_products()
+        kwargs = form.reprice_kwargs()
+        if "apply" in request.POST:
+            changed, variants_changed = reprice(
+                products,
+                **kwargs,
+                variants=form.cleaned_data["variants"],
+                variant_markup_percent=form.cleaned_data["variant_markup_percent"],
+            )
+            messages.success(
+                request,
+                f"Repriced {changed} products and {variants_changed} pack variants.",
+            )
+            return redirect("products:staff_product_list")
+        preview = reprice_preview(products, **kwargs)[:REPRICE_PREVIEW_ROWS]
+        if form.cleaned_data["variants"]:
+            variants = variant_preview(
+                PackVariant.objects.filter(product__in=products)
+                .select_related("product"),
+                form.cleaned_data["variant_markup_percent"],
+                cost_price=kwargs["cost_price"],
+                cost_change_percent=kwargs["cost_change_percent"],
+            )[:REPRICE_PREVIEW_ROWS]
+
+    return render(
+        request,
+        "products/staff_product_reprice.html",
+        {
+            "form": form,
+            "preview": preview,
+            "variants": variants,
+            "preview_rows": REPRICE_PREVIEW_ROWS,
+        },
+    )
+
+
 @login_required
 @staff_required
 def staff_product_update(request, pk: int):
@@ -2,6 +2,8 @@ from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 
+from versohnung_und_vergebung_kaffee.metrics import track_email
+
 
 def send_welcome_email(user):
     """Send a simple welcome email to a newly registered user."""
@@ -28,4 +30,5 @@ def send_welcome_email(user):
         reply_to=[settings.DEFAULT_FROM_EMAIL],
     )
     msg.attach_alternative(html_body, "text/html")
-    return msg.send(fail_silently=False)
+    with track_email("welcome_new_user"):
+        return msg.send(fail_silently=False)
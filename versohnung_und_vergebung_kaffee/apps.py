@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+
+
+class ProjectConfig(AppConfig):
+    """Project-wide management commands and tooling."""
+
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "versohnung_und_vergebung_kaffee"
+    verbose_name = "VV Kaffee"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .db import configure_connection
+
+        connection_created.connect(
+            configure_connection, dispatch_uid="vv-configure-connection"
+        )
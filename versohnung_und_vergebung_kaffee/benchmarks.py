@@ -0,0 +1,282 @@
+"""Query-count, latency and memory benchmarks for the project's named routes."""
+
+import json
+import logging
+import statistics
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+from orders.models import OrderItem
+from products.models import PackVariant, ProductBatch
+
+# URL namespaces owned by this project (admin and allauth are third-party).
+PROJECT_NAMESPACES = {"products", "cart", "orders", "profiles", "reviews", "newsletter"}
+# Route names containing these fragments are exercised as a superuser.
+STAFF_ROUTE_HINTS = ("staff", "fulfil", "picklist", "pack_variant")
+
+DEFAULT_BASELINE = (
+    Path(__file__).resolve().parent.parent / "benchmarks" / "baseline.json"
+)
+BENCH_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def discover_routes():
+    """Return ``(name, kwarg names)`` for every named project route."""
+    routes = []
+
+    def walk(patterns, namespace):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                if pattern.namespace in PROJECT_NAMESPACES:
+                    walk(pattern.url_patterns, pattern.namespace)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                name = f"{namespace}:{pattern.name}" if namespace else pattern.name
+                routes.append((name, sorted(pattern.pattern.converters)))
+
+    walk(get_resolver().url_patterns, None)
+    # The project reuses a few names (e.g. post_login_redirect); keep the first.
+    seen, unique = set(), []
+    for name, kwargs in routes:
+        if name not in seen:
+            seen.add(name)
+            unique.append((name, kwargs))
+    return unique
+
+
+class BenchFixtures:
+    """Real objects to reverse URLs against and users to request them as."""
+
+    def __init__(self, order, customer):
+        User = get_user_model()
+        self.staff = User.objects.create_superuser(
+            "bench-staff", "staff@bench.example", None
+        )
+        self.customer = customer
+        order.user = customer
+        order.status = "paid"
+        order.set_client_secret("pi_bench_secret")
+        order.save()
+        self.order = order
+        item = OrderItem.objects.select_related("product").filter(order=order).first()
+        self.product = item.product
+        self.batch = ProductBatch.objects.filter(
+            product=self.product
+        ).first() or ProductBatch.objects.create(
+            product=self.product, quantity_grams=1000, remaining_grams=1000
+        )
+        self.variant = PackVariant.objects.filter(
+            product=self.product
+        ).first() or PackVariant.objects.create(
+            product=self.product,
+            name="Bench 1kg",
+            sku=f"BENCH-{self.product.pk}",
+            price=self.product.price,
+        )
+
+    def kwargs_for(self, name, kwarg_names):
+        namespace = name.split(":", 1)[0]
+        values = {
+            "slug": self.product.slug,
+            "product_id": self.product.pk,
+            "order_id": self.order.pk,
+            "batch_id": self.batch.pk,
+            "variant_id": self.variant.pk,
+            "pk": self.product.pk if namespace == "products" else self.order.pk,
+            "section": "products",
+        }
+        return {key: values[key] for key in kwarg_names}
+
+    def user_for(self, name):
+        return (
+            self.staff
+            if any(hint in name for hint in STAFF_ROUTE_HINTS)
+            else self.customer
+        )
+
+
+def measure_routes(fixtures, routes=None, repeat=3):
+    """Request each route and record status, queries, median time and peak memory."""
+    results = {}
+    # 405s and view errors are recorded as statuses, not logged per request.
+    request_logger = logging.getLogger("django.request")
+    previous_level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        for name, kwarg_names in routes or discover_routes():
+            results[name] = _measure(fixtures, name, kwarg_names, repeat)
+    finally:
+        request_logger.setLevel(previous_level)
+    return results
+
+
+def _measure(fixtures, name, kwarg_names, repeat):
+    url = reverse(name, kwargs=fixtures.kwargs_for(name, kwarg_names))
+    client = Client(raise_request_exception=False)
+    client.force_login(fixtures.user_for(name))
+    client.get(url)  # warm caches/templates
+
+    timings, queries, status = [], 0, None
+    for _ in range(max(1, repeat)):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries, status = len(captured), response.status_code
+
+    tracemalloc.start()
+    client.get(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "url": url,
+        "status": status,
+        "queries": queries,
+        "time_ms": round(statistics.median(timings), 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(
+    results,
+    baseline,
+    time_threshold=3.0,
+    memory_threshold=2.0,
+    query_slack=0,
+    queries_only=False,
+):
+    """
+    List regressions of ``results`` against ``baseline["views"]``.
+
+    Status codes must match and query counts must not grow beyond
+    ``query_slack``; time and memory may grow by the given factors
+    (timings also get a 5 ms floor for noise). ``queries_only`` skips the
+    time and memory checks, which only mean something on the machine that
+    recorded the baseline (CI runners are not).
+    """
+    problems = []
+    for name, current in sorted(results.items()):
+        before = baseline.get("views", {}).get(name)
+        if before is None:
+            continue
+        if current["status"] != before["status"]:
+            problems.append(f"{name}: status {before['status']} -> {current['status']}")
+        if current["queries"] > before["queries"] + query_slack:
+            problems.append(
+                f"{name}: {before['queries']} -> {current['queries']} queries"
+            )
+        if queries_only:
+            continue
+        if current["time_ms"] > max(
+            before["time_ms"] * time_threshold, before["time_ms"] + 5
+        ):
+            problems.append(f"{name}: {before['time_ms']} -> {current['time_ms']} ms")
+        if current["peak_kb"] > max(
+            before["peak_kb"] * memory_threshold, before["peak_kb"] + 256
+        ):
+            problems.append(
+                f"{name}: {before['peak_kb']} -> {current['peak_kb']} KiB peak"
+            )
+    return problems
+
+
+def load_baseline(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_baseline(path, results, dataset):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"dataset": dataset, "views": results}
+    path.write_text(
+        json.dumps(payload, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+    )
+
+
+CHECKOUT_FORM = {
+    "full_name": "Bench Customer",
+    "email": "bench@example.com",
+    "phone_number": "",
+    "street": "Hauptstrasse",
+    "house_number": "1",
+    "city": "Berlin",
+    "postal_code": "10115",
+    "country": "Germany",
+}
+
+
+def measure_checkout_throughput(product, workers=4, orders_per_worker=25):
+    """
+    Run full add-to-cart + checkout round trips from ``workers`` threads.
+
+    Every thread has its own client and therefore its own database
+    connection, so this exercises the writer lock the way concurrent
+    gunicorn threads do. Returns orders/s, latency percentiles and errors.
+    """
+    add_url = reverse("cart:add", args=[product.slug])
+    checkout_url = reverse("orders:checkout")
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(workers)
+
+    def worker():
+        client = Client(raise_request_exception=False)
+        try:
+            start.wait()
+            for _ in range(orders_per_worker):
+                started = time.perf_counter()
+                client.post(add_url, {"quantity": 1, "grind": "whole"})
+                response = client.post(checkout_url, CHECKOUT_FORM)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if response.status_code == 302:
+                        latencies.append(elapsed)
+                    else:
+                        errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    request_logger = logging.getLogger("django.request")
+    previous_level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+    finally:
+        request_logger.setLevel(previous_level)
+
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        if not ordered:
+            return 0.0
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+    return {
+        "workers": workers,
+        "orders": len(latencies),
+        "errors": len(errors),
+        "seconds": round(wall, 3),
+        "orders_per_s": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+    }
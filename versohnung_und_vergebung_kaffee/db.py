@@ -0,0 +1,69 @@
+"""
+Database configuration helpers.
+
+``sqlite_database`` and ``postgres_database`` build ``DATABASES`` entries
+from settings.py. ``configure_connection`` is connected to
+``connection_created`` in ``ProjectConfig.ready``. It applies
+``settings.SQLITE_PRAGMAS`` to every new SQLite connection: WAL lets
+readers run alongside the single writer, ``synchronous=NORMAL`` is safe
+under WAL, and the busy timeout makes writers queue instead of failing.
+"""
+
+import dj_database_url
+
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 20000,  # ms
+    "foreign_keys": "ON",
+}
+
+
+def sqlite_database(path, busy_timeout_ms=20000):
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": path,
+        "OPTIONS": {
+            "timeout": busy_timeout_ms / 1000,
+            # Take the write lock when the transaction starts; a deferred
+            # transaction that upgrades later fails at once with "database is
+            # locked" instead of waiting out the busy timeout.
+            "transaction_mode": "IMMEDIATE",
+        },
+    }
+
+
+def postgres_database(
+    url, pool_min_size=1, pool_max_size=4, pool_timeout=10, ssl_require=True
+):
+    """
+    PostgreSQL via psycopg 3 with Django's built-in connection pool.
+
+    Pooling replaces persistent connections (Django rejects both together),
+    so ``CONN_MAX_AGE`` is 0 and health checks validate pooled connections
+    before reuse. Each worker process owns one pool of ``pool_max_size``.
+    """
+    database = dj_database_url.parse(
+        url,
+        conn_max_age=0,
+        conn_health_checks=True,
+        ssl_require=ssl_require,
+    )
+    database.setdefault("OPTIONS", {})["pool"] = {
+        "min_size": pool_min_size,
+        "max_size": pool_max_size,
+        "timeout": pool_timeout,
+    }
+    return database
+
+
+def configure_connection(sender, connection, **kwargs):
+    """``connection_created`` receiver applying per-connection PRAGMAs."""
+    if connection.vendor != "sqlite":
+        return
+    from django.conf import settings
+
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", DEFAULT_SQLITE_PRAGMAS)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,125 @@
+"""Benchmark every named project route against a seeded throwaway database."""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from versohnung_und_vergebung_kaffee.benchmarks import (
+    BENCH_STORAGES,
+    DEFAULT_BASELINE,
+    BenchFixtures,
+    compare,
+    load_baseline,
+    measure_routes,
+    write_baseline,
+)
+from versohnung_und_vergebung_kaffee.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a test database, request every named route and report query count, "
+        "median time and peak memory. --check fails on regressions against the "
+        "JSON baseline; --update-baseline rewrites it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--batches", type=int, default=3000)
+        parser.add_argument("--orders", type=int, default=2000)
+        parser.add_argument("--reviews", type=int, default=3000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument("--check", action="store_true")
+        parser.add_argument("--update-baseline", action="store_true")
+        parser.add_argument("--time-threshold", type=float, default=3.0)
+        parser.add_argument("--memory-threshold", type=float, default=2.0)
+        parser.add_argument("--query-slack", type=int, default=0)
+        parser.add_argument(
+            "--queries-only",
+            action="store_true",
+            help=(
+                "Check status codes and query counts only "
+                "(for CI, where timings vary)."
+            ),
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print raw results as JSON."
+        )
+
+    def handle(self, *args, **options):
+        dataset = {
+            key: options[key]
+            for key in ("products", "batches", "orders", "reviews", "seed")
+        }
+        if dataset["orders"] < 1 or dataset["products"] < 1:
+            raise CommandError("--orders and --products must be at least 1.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                STORAGES=BENCH_STORAGES,
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ):
+                seeded = seed_dataset(**dataset)
+                fixtures = BenchFixtures(seeded["order"], seeded["customers"][0])
+                results = measure_routes(fixtures, repeat=options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(
+                f"{'route':45} {'status':>6} {'queries':>7} {'ms':>9} {'peak KiB':>9}"
+            )
+            for name, row in sorted(results.items()):
+                self.stdout.write(
+                    f"{name:45} {row['status']:>6} {row['queries']:>7} "
+                    f"{row['time_ms']:>9.2f} {row['peak_kb']:>9.1f}"
+                )
+
+        if options["update_baseline"]:
+            write_baseline(options["baseline"], results, dataset)
+            self.stdout.write(
+                self.style.SUCCESS(f"Baseline written to {options['baseline']}")
+            )
+            return
+
+        if options["check"]:
+            baseline = load_baseline(options["baseline"])
+            if not baseline:
+                raise CommandError(
+                    f"No baseline at {options['baseline']}; run with --update-baseline."
+                )
+            if baseline.get("dataset") != dataset:
+                self.stderr.write(
+                    "Warning: dataset differs from the one the baseline "
+                    "was recorded with."
+                )
+            problems = compare(
+                results,
+                baseline,
+                time_threshold=options["time_threshold"],
+                memory_threshold=options["memory_threshold"],
+                query_slack=options["query_slack"],
+                queries_only=options["queries_only"],
+            )
+            if problems:
+                raise CommandError(
+                    "Performance regressions:\n  " + "\n  ".join(problems)
+                )
+            self.stdout.write(
+                self.style.SUCCESS("No regressions against the baseline.")
+            )
@@ -0,0 +1,124 @@
+"""Measure checkout throughput with parallel workers against a throwaway database."""
+
+import json
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from products.models import Category, Product
+from versohnung_und_vergebung_kaffee.benchmarks import (
+    BENCH_STORAGES,
+    measure_checkout_throughput,
+)
+
+# Pre-WAL SQLite defaults, to show what the connection tuning buys.
+ROLLBACK_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "busy_timeout": 20000,
+    "foreign_keys": "ON",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a file-backed test database and run add-to-cart + checkout from "
+        "parallel worker threads. Reports orders/s, p50/p95 latency and errors "
+        "for each journal mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--orders", type=int, default=25, help="Orders per worker.")
+        parser.add_argument(
+            "--mode",
+            choices=["wal", "rollback", "both"],
+            default="both",
+            help=(
+                "SQLite only: configured PRAGMAs (wal), the old defaults "
+                "(rollback), or both."
+            ),
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print raw results as JSON."
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["orders"] < 1:
+            raise CommandError("--workers and --orders must be at least 1.")
+        if connection.vendor == "sqlite":
+            modes = (
+                ["wal", "rollback"] if options["mode"] == "both" else [options["mode"]]
+            )
+        else:
+            modes = [connection.vendor]
+
+        results = {
+            mode: self._run(mode, options["workers"], options["orders"])
+            for mode in modes
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+        self.stdout.write(
+            f"{'mode':10} {'workers':>7} {'orders':>6} {'errors':>6} "
+            f"{'orders/s':>9} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for mode, row in results.items():
+            self.stdout.write(
+                f"{mode:10} {row['workers']:>7} {row['orders']:>6} "
+                f"{row['errors']:>6} {row['orders_per_s']:>9.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}"
+            )
+
+    def _run(self, mode, workers, orders_per_worker):
+        pragmas = ROLLBACK_PRAGMAS if mode == "rollback" else settings.SQLITE_PRAGMAS
+        test_settings = connection.settings_dict["TEST"]
+        previous_test_name = test_settings.get("NAME")
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # Worker threads need a shared on-disk database, not :memory:.
+                test_settings["NAME"] = str(Path(directory) / "bench_checkout.sqlite3")
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                with override_settings(
+                    SQLITE_PRAGMAS=pragmas,
+                    STORAGES=BENCH_STORAGES,
+                    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+                    STRIPE_GATEWAY="orders.stripe_gateway.FakeStripeGateway",
+                ):
+                    connection.close()  # reconnect with this mode's PRAGMAs
+                    product = self._product()
+                    connection.close()
+                    return measure_checkout_throughput(
+                        product, workers, orders_per_worker
+                    )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                test_settings["NAME"] = previous_test_name
+
+    def _product(self):
+        category = Category.objects.create(name="Bench", slug="bench")
+        return Product.objects.create(
+            category=category,
+            name="Bench Roast",
+            slug="bench-roast",
+            sku="BENCH-CHECKOUT",
+            price="12.50",
+            weight_grams=250,
+            stock=1_000_000,
+            is_active=True,
+        )
@@ -0,0 +1,55 @@
+"""Fill the configured database with a large deterministic dataset for load tests."""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from versohnung_und_vergebung_kaffee.seeding import seed_dataset, seed_exists
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate consistent synthetic users, profiles, products, pack variants, "
+        "batches, orders and reviews with chunked bulk inserts. The same --seed "
+        "always produces the same data; run against a staging database only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200_000)
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--reviews", type=int, default=50_000)
+        parser.add_argument("--batches", type=int, default=5_000)
+        parser.add_argument("--customers", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--chunk-size", type=int, default=2_000)
+
+    def handle(self, *args, **options):
+        if options["products"] < 1 or options["customers"] < 1:
+            raise CommandError("--products and --customers must be at least 1.")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        if seed_exists(options["seed"]):
+            raise CommandError(
+                f"Data for seed {options['seed']} already exists; pick another --seed."
+            )
+
+        started = time.monotonic()
+        seeded = seed_dataset(
+            products=options["products"],
+            batches=options["batches"],
+            orders=options["orders"],
+            reviews=options["reviews"],
+            customers=options["customers"],
+            seed=options["seed"],
+            chunk_size=options["chunk_size"],
+            progress=lambda message: (
+                self.stdout.write(f"  {message}") if options["verbosity"] > 1 else None
+            ),
+        )
+        counts = seeded["counts"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {counts['products']} products ({counts['variants']} variants), "
+            f"{counts['batches']} batches, {counts['customers']} customers, "
+            f"{counts['orders']} orders ({counts['order_items']} items) and "
+            f"{counts['reviews']} reviews in {time.monotonic() - started:.1f}s."
+        ))
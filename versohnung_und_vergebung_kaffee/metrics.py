@@ -0,0 +1,392 @@
+"""
+In-process counters and histograms rendered in the Prometheus text format.
+
+Each process keeps its samples in memory. When ``settings.METRICS_DIR`` is
+set, it also snapshots them to ``<METRICS_DIR>/<pid>-<token>.json`` (the
+token keeps a reused pid from overwriting an older worker's file). The
+snapshot is written at most every ``METRICS_FLUSH_INTERVAL`` seconds.
+``render()`` merges every snapshot with the live values, so ``/metrics``
+reports totals across all gunicorn workers no matter which worker answers.
+Counters and histogram buckets are summed.
+
+Totals of workers that have exited are kept, as Prometheus expects for
+counters, in one ``exited.json`` aggregate. A worker folds its own totals
+in at exit and removes its snapshot; snapshots of workers that died
+without doing so are folded by the next ``render()``. The aggregate lists
+the snapshots it already holds, so a reader that still sees one of them
+does not count it twice.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev process, nothing to coordinate
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EXITED_FILE = "exited.json"
+LOCK_FILE = ".lock"
+
+
+def _write_json(path, payload):
+    """Atomically replace ``path`` with ``payload`` as JSON."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None  # a worker is mid-write or the file vanished
+
+
+def _exited(filename):
+    """True if the worker that wrote snapshot ``filename`` is gone."""
+    pid = filename.split(".")[0].split("-")[0]
+    if os.name != "posix" or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._owner = None
+        self._filename = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(self, name, documentation, labelnames, buckets))
+
+    # ── persistence ──────────────────────────────────────────────────────────
+    def snapshot(self):
+        with self._lock:
+            return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def reset(self):
+        with self._lock:
+            for metric in self._metrics.values():
+                metric.samples.clear()
+
+    def _directory(self):
+        directory = getattr(settings, "METRICS_DIR", "")
+        return Path(directory) if directory else None
+
+    def maybe_flush(self):
+        interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 5.0)
+        if self._directory() and time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def _snapshot_name(self):
+        # Forked workers inherit the registry, so the name follows the pid.
+        pid = os.getpid()
+        if self._owner != pid:
+            self._owner = pid
+            self._filename = f"{pid}-{uuid.uuid4().hex[:12]}.json"
+        return self._filename
+
+    def flush(self):
+        """Atomically replace this process's snapshot file."""
+        directory = self._directory()
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        self._last_flush = time.monotonic()
+        _write_json(directory / self._snapshot_name(), self.snapshot())
+
+    def close(self):
+        """At exit: fold this process's totals into the aggregate, drop its snapshot."""
+        directory = self._directory()
+        if directory is None:
+            return
+        samples = self.snapshot()
+        if (
+            not any(samples.values())
+            and not (directory / self._snapshot_name()).exists()
+        ):
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._directory_lock(directory):
+            self._fold(directory, {self._snapshot_name(): samples})
+
+    @contextmanager
+    def _directory_lock(self, directory):
+        with open(directory / LOCK_FILE, "a") as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _merge(self, merged, source):
+        for name, samples in source.items():
+            if name not in self._metrics:
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in samples.items():
+                target[key] = self._metrics[name].merge(target.get(key), value)
+        return merged
+
+    def _fold(self, directory, snapshots):
+        """
+        Add ``{filename: samples}`` to the aggregate and remove the files.
+        Call with the lock held.
+        """
+        if not snapshots:
+            return
+        exited = _read_json(directory / EXITED_FILE) or {"metrics": {}, "folded": []}
+        folded = [name for name in exited["folded"] if (directory / name).exists()]
+        for filename, samples in snapshots.items():
+            if filename in exited["folded"]:
+                continue
+            self._merge(exited["metrics"], samples)
+            folded.append(filename)
+        exited["folded"] = folded
+        _write_json(directory / EXITED_FILE, exited)
+        for filename in snapshots:
+            (directory / filename).unlink(missing_ok=True)
+
+    def _collected(self):
+        """Samples of every process: live snapshots, exited totals, own values."""
+        merged = {name: {} for name in self._metrics}
+        directory = self._directory()
+        if directory and directory.is_dir():
+            own = self._snapshot_name()
+            snapshots = {}
+            for path in directory.glob("*.json"):
+                if path.name in (own, EXITED_FILE):
+                    continue
+                samples = _read_json(path)
+                if samples is not None:
+                    snapshots[path.name] = samples
+            dead = {
+                name: samples for name, samples in snapshots.items() if _exited(name)
+            }
+            if dead:
+                with self._directory_lock(directory):
+                    # Another worker may have folded some of them already.
+                    self._fold(
+                        directory,
+                        {
+                            name: samples
+                            for name, samples in dead.items()
+                            if (directory / name).exists()
+                        },
+                    )
+            # Read after the snapshots: anything folded meanwhile is listed here.
+            exited = _read_json(directory / EXITED_FILE) or {
+                "metrics": {},
+                "folded": [],
+            }
+            skip = set(exited["folded"]) | set(dead)
+            for name, samples in snapshots.items():
+                if name not in skip:
+                    self._merge(merged, samples)
+            self._merge(merged, exited["metrics"])
+        return self._merge(merged, self.snapshot())
+
+    def render(self):
+        lines = []
+        collected = self._collected()
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key in sorted(collected[name]):
+                lines.extend(metric.expose(json.loads(key), collected[name][key]))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return json.dumps([[name, str(labels[name])] for name in self.labelnames])
+
+    def dump(self):
+        return {key: self._copy(value) for key, value in self.samples.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+    def value(self, **labels):
+        return self.samples.get(self._key(labels), 0)
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def merge(current, other):
+        return (current or 0) + other
+
+    def expose(self, labels, value):
+        return [f"{self.name}_total{_format_labels(labels)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            sample = self.samples.setdefault(
+                key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    sample["buckets"][index] += 1
+            sample["sum"] += seconds
+            sample["count"] += 1
+        self.registry.maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels):
+        """Decorator form of :meth:`time`."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **labels):
+        return self.samples.get(self._key(labels), {}).get("count", 0)
+
+    @staticmethod
+    def _copy(value):
+        return {
+            "buckets": list(value["buckets"]),
+            "sum": value["sum"],
+            "count": value["count"],
+        }
+
+    @staticmethod
+    def merge(current, other):
+        if current is None:
+            return Histogram._copy(other)
+        return {
+            "buckets": [a + b for a, b in zip(current["buckets"], other["buckets"])],
+            "sum": current["sum"] + other["sum"],
+            "count": current["count"] + other["count"],
+        }
+
+    def expose(self, labels, value):
+        lines = []
+        for bound, cumulative in zip(self.buckets, value["buckets"]):
+            bucket_labels = _format_labels(labels + [["le", repr(float(bound))]])
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        bucket_labels = _format_labels(labels + [["le", "+Inf"]])
+        lines.append(f"{self.name}_bucket{bucket_labels} {value['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {value['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {value['count']}")
+        return lines
+
+
+registry = Registry()
+atexit.register(registry.close)
+
+CHECKOUT_SECONDS = registry.histogram(
+    "vv_checkout_duration_seconds", "Time to handle a checkout request.")
+PAYMENT_INTENT_CREATE_SECONDS = registry.histogram(
+    "vv_stripe_payment_intent_create_seconds",
+    "Latency of Stripe PaymentIntent creation.",
+)
+WEBHOOK_SECONDS = registry.histogram(
+    "vv_stripe_webhook_duration_seconds",
+    "Time to process a Stripe webhook.",
+    ["event_type"],
+)
+EMAIL_SEND_SECONDS = registry.histogram(
+    "vv_email_send_duration_seconds", "Time to render and send an email.", ["email"])
+EMAIL_FAILURES = registry.counter(
+    "vv_email_send_failures", "Emails that raised while sending.", ["email"])
+PDF_RENDER_SECONDS = registry.histogram(
+    "vv_pdf_render_duration_seconds", "Time to render a PDF document.", ["document"])
+FIFO_CONSUME_SECONDS = registry.histogram(
+    "vv_fifo_consume_duration_seconds", "Time to consume grams from batches FIFO.")
+CACHE_REQUESTS = registry.counter(
+    "vv_cache_requests", "Application cache lookups by outcome.", ["cache", "result"])
+
+
+def record_cache_lookup(cache_name, hit):
+    """Count one cache lookup; hit rate is hits / (hits + misses)."""
+    CACHE_REQUESTS.inc(cache=cache_name, result="hit" if hit else "miss")
+
+
+@contextmanager
+def track_email(name):
+    """Time an email send and count it as failed if it raises."""
+    try:
+        with EMAIL_SEND_SECONDS.time(email=name):
+            yield
+    except Exception:
+        EMAIL_FAILURES.inc(email=name)
+        raise
@@ -1,4 +1,5 @@
 # versohnung_und_vergebung_kaffee/middleware/fulfillment_redirect.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from versohnung_und_vergebung_kaffee.staff_mode import get_staff_mode, is_worker
 
@@ -8,10 +9,17 @@ class FulfillmentPostLoginMiddleware:
     If a logged-in user in 'Fulfillment Department' lands on '/',
     send them to the fulfillment dashboard.
     """
+    async_capable = True
+    sync_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)  # pass-through under ASGI
         response = self.get_response(request)
 
         # Previously redirected fulfillment staff hitting "/" to the fulfillment queue.
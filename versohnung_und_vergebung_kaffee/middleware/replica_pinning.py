@@ -0,0 +1,35 @@
+# versohnung_und_vergebung_kaffee/middleware/replica_pinning.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from versohnung_und_vergebung_kaffee.routers import (
+    pin_session_after_write,
+    routing_state,
+)
+
+class ReplicaPinningMiddleware:
+    """
+    Give each request its own routing state. If the request wrote to the
+    primary, keep this session's replica-routed views on the primary for
+    ``settings.REPLICA_PIN_SECONDS``, so the user sees their change straight away.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing_state() as state:
+            response = self.get_response(request)
+        pin_session_after_write(request, state)
+        return response
+
+    async def __acall__(self, request):
+        with routing_state() as state:
+            response = await self.get_response(request)
+        pin_session_after_write(request, state)
+        return response
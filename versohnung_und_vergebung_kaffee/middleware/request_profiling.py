@@ -0,0 +1,175 @@
+# versohnung_und_vergebung_kaffee/middleware/request_profiling.py
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+logger = logging.getLogger("versohnung_und_vergebung_kaffee.profiling")
+
+# Stats for the request currently being handled in this thread/task.
+_current = ContextVar("request_profile", default=None)
+_original_template_render = Template.render
+
+
+class RequestProfile:
+    """Timings and SQL signatures collected for a single request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.signatures = Counter()
+
+    @property
+    def query_count(self):
+        return sum(self.signatures.values())
+
+    @property
+    def view_ms(self):
+        """Time in Python code that was neither SQL nor template rendering."""
+        return max(self.total_ms - self.sql_ms - self.template_ms, 0.0)
+
+    def duplicates(self, limit=5):
+        """Most repeated parametrised statements, the usual sign of an N+1."""
+        return [
+            (sql, count)
+            for sql, count in self.signatures.most_common(limit)
+            if count > 1
+        ]
+
+    def server_timing(self):
+        dup_count = sum(count - 1 for count in self.signatures.values() if count > 1)
+        return ", ".join([
+            f'db;dur={self.sql_ms:.1f};desc="{self.query_count} queries"',
+            f'dup;desc="{dup_count} duplicate queries"',
+            f"tpl;dur={self.template_ms:.1f}",
+            f"view;dur={self.view_ms:.1f}",
+            f"total;dur={self.total_ms:.1f}",
+        ])
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.sql_ms += (time.perf_counter() - started) * 1000
+        profile.signatures[sql] += 1
+
+
+def _install_query_recorder(sender=None, connection=None, **kwargs):
+    # Connections are per thread and async views run the ORM in worker
+    # threads, so the recorder lives on every connection and reads the
+    # request's profile from the (propagated) context variable.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _profiled_template_render(self, context):
+    profile = _current.get()
+    if profile is None:
+        return _original_template_render(self, context)
+    # {% include %} renders nested templates; only time the outermost one.
+    profile.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        profile.template_depth -= 1
+        if profile.template_depth == 0:
+            profile.template_ms += (time.perf_counter() - started) * 1000
+
+
+class RequestProfilingMiddleware:
+    """
+    Record per-request query count, SQL time, duplicate statements, template
+    and view time and log one JSON line. The ``Server-Timing`` header, which
+    gives away SQL statistics, is only added for staff users or with DEBUG.
+
+    Only active when ``settings.REQUEST_PROFILING`` is true; Django drops the
+    middleware entirely otherwise.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        Template.render = _profiled_template_render
+        connection_created.connect(
+            _install_query_recorder, dispatch_uid="request_profiling"
+        )
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self._stop(profile, token)
+        user = getattr(request, "user", None)
+        return self._finish(request, response, profile, user)
+
+    async def __acall__(self, request):
+        profile, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._stop(profile, token)
+        # request.user would load the user synchronously inside the event loop.
+        user = await request.auser() if hasattr(request, "auser") else None
+        return self._finish(request, response, profile, user)
+
+    def _start(self, request):
+        profile = RequestProfile()
+        request.request_profile = profile
+        return profile, _current.set(profile)
+
+    def _stop(self, profile, token):
+        _current.reset(token)
+        profile.total_ms = (time.perf_counter() - profile.started) * 1000
+
+    def _finish(self, request, response, profile, user):
+        if settings.DEBUG or getattr(user, "is_staff", False):
+            response["Server-Timing"] = profile.server_timing()
+        match = getattr(request, "resolver_match", None)
+        logger.info(
+            json.dumps(
+                {
+                    "event": "request_profile",
+                    "method": request.method,
+                    "path": request.path,
+                    "view": match.view_name if match else None,
+                    "status": response.status_code,
+                    "queries": profile.query_count,
+                    "sql_ms": round(profile.sql_ms, 2),
+                    "template_ms": round(profile.template_ms, 2),
+                    "view_ms": round(profile.view_ms, 2),
+                    "total_ms": round(profile.total_ms, 2),
+                    "duplicates": [
+                        {"sql": sql[:200], "count": count}
+                        for sql, count in profile.duplicates()
+                    ],
+                }
+            )
+        )
+        return response
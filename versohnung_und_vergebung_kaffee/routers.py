@@ -0,0 +1,189 @@
+"""
+Primary/replica routing for read-heavy staff and catalogue views.
+
+Nothing is read from the ``replica`` alias unless it is configured and the
+code is running inside ``use_replica()`` or a ``@read_from_replica`` view.
+Reads that follow a write then return to the primary, for the rest of the
+request (``ReplicaRouter.db_for_write`` pins the routing state) and for
+``settings.REPLICA_PIN_SECONDS`` of that user's next requests
+(``ReplicaPinningMiddleware`` keeps a timestamp in the session). Replication
+lag therefore never hides a user's own change from them.
+
+``pin_to_primary()`` forces primary reads explicitly, as a context manager
+or a decorator. ``on_replica(queryset)`` sends one reporting queryset to
+the replica outside a view.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = "default"
+REPLICA = "replica"
+# Session and auth data must be read where they were just written.
+PRIMARY_ONLY_APPS = {
+    "admin",
+    "auth",
+    "contenttypes",
+    "sessions",
+    "account",
+    "socialaccount",
+}
+PIN_SESSION_KEY = "_db_pin_primary_until"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RoutingState:
+    def __init__(self, use_replica=False, pinned=False):
+        self.use_replica = use_replica
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar("db_routing", default=None)
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+def read_alias():
+    """The alias reads should use right now."""
+    state = _state.get()
+    if state and state.use_replica and not state.pinned and replica_configured():
+        return REPLICA
+    return PRIMARY
+
+
+def on_replica(queryset):
+    """Run a reporting queryset on the replica when one is available."""
+    return queryset.using(REPLICA if replica_configured() else PRIMARY)
+
+
+@contextmanager
+def routing_state(**changes):
+    current = _state.get()
+    state = RoutingState(
+        use_replica=changes.get(
+            "use_replica", current.use_replica if current else False
+        ),
+        pinned=changes.get("pinned", current.pinned if current else False),
+    )
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+        if current is not None and state.wrote:
+            current.pinned = current.wrote = True
+
+
+@contextmanager
+def use_replica():
+    with routing_state(use_replica=True):
+        yield
+
+
+class pin_to_primary:
+    """Read from the primary inside the block or decorated function."""
+
+    def __enter__(self):
+        self._context = routing_state(pinned=True)
+        return self._context.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._context.__exit__(*exc_info)
+
+    def __call__(self, func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with pin_to_primary():
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with pin_to_primary():
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def _pinned_by_session(request):
+    session = getattr(request, "session", None)
+    return session is not None and session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def read_from_replica(view):
+    """
+    Serve a read-only view from the replica.
+
+    Put it below ``login_required`` so authentication still reads the
+    primary. Unsafe methods and recently-writing sessions stay on the
+    primary. Lazy ``TemplateResponse``s are rendered inside the block so
+    their querysets run on the replica too.
+    """
+
+    def should_use_replica(request):
+        return (
+            replica_configured()
+            and request.method in SAFE_METHODS
+            and not _pinned_by_session(request)
+        )
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not should_use_replica(request):
+                return await view(request, *args, **kwargs)
+            with use_replica():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not should_use_replica(request):
+            return view(request, *args, **kwargs)
+        with use_replica():
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+            return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """``DATABASE_ROUTERS`` entry; see the module docstring."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        alias = read_alias()
+        return alias if alias == REPLICA else None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def pin_session_after_write(request, state):
+    if state.wrote and replica_configured() and hasattr(request, "session"):
+        request.session[PIN_SESSION_KEY] = time.time() + getattr(
+            settings, "REPLICA_PIN_SECONDS", 10
+        )
@@ -0,0 +1,425 @@
+"""Deterministic synthetic catalogue/order data for benchmarks and load tests."""
+
+import random
+from collections import deque
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from orders.models import Order, OrderItem, OrderItemCost
+from products.models import (
+    Category,
+    PackVariant,
+    Product,
+    ProductBatch,
+    ProductPriceHistory,
+    StockMovement,
+)
+from products.stock import RESERVED_ORDER_STATUSES, rebuild_stock_balances
+from profiles.models import Profile
+from reviews.models import ProductReview
+
+CENT = Decimal("0.01")
+ORIGINS = ["Huye", "Nyamasheke", "Rutsiro", "Karongi", "Gakenke", "Nyaruguru"]
+ROASTS = ["light", "medium", "dark"]
+GRINDS = ["whole", "espresso", "filter", "french_press"]
+WEIGHTS = [250, 500, 1000]
+PACK_SIZES = [(250, "250g bag"), (1000, "1kg bag")]
+ORDER_STATUSES = [
+    "new",
+    "paid",
+    "paid",
+    "fulfilled",
+    "fulfilled",
+    "fulfilled",
+    "cancelled",
+]
+# Statuses whose items already left the warehouse (FIFO-consumed from batches).
+CONSUMED_STATUSES = {"fulfilled"}
+
+
+def _money(value) -> Decimal:
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _bulk_create_dated(model, rows, field_name, batch_size):
+    """
+    ``bulk_create`` ``rows`` keeping their own ``field_name`` values.
+
+    The field's ``auto_now_add`` is switched off for the insert instead of
+    writing the values back with a per-chunk ``bulk_update``, which took
+    longer than the inserts themselves.
+    """
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        return model.objects.bulk_create(rows, batch_size=batch_size)
+    finally:
+        field.auto_now_add = True
+
+
+def _consume_fifo(batches, item, grams) -> list:
+    """
+    Take ``grams`` for ``item`` from ``batches`` (a deque, oldest first) and
+    return its cost rows. The newest batch absorbs any shortfall, so
+    remaining stock is never negative.
+    """
+    rows = []
+    while grams > 0:
+        batch = batches[0]
+        if len(batches) == 1 and batch.remaining_grams < grams:
+            batch.quantity_grams += grams - batch.remaining_grams
+            batch.remaining_grams = grams
+        take = min(grams, batch.remaining_grams)
+        if take:
+            rows.append(OrderItemCost(
+                order_id=item.order_id,
+                order_item=item,
+                product_id=batch.product_id,
+                batch=batch,
+                grams=take,
+                unit_cost=batch.unit_cost,
+                created_at=item.order.fulfilled_at,
+            ))
+        batch.remaining_grams -= take
+        grams -= take
+        if not batch.remaining_grams and len(batches) > 1:
+            batches.popleft()
+    return rows
+
+
+def seed_exists(seed: int) -> bool:
+    """True if a dataset with this seed was already loaded."""
+    return Product.objects.filter(sku__startswith=f"SEED-{seed}-").exists()
+
+
+def seed_dataset(
+    products: int = 1000,
+    batches: int = 3000,
+    orders: int = 2000,
+    reviews: int = 3000,
+    customers: int = 200,
+    seed: int = 42,
+    chunk_size: int = 1000,
+    progress=None,
+) -> dict:
+    """
+    Insert a consistent synthetic dataset with chunked ``bulk_create``.
+
+    The same ``seed`` always produces the same rows. Every product gets pack
+    variants, every customer a profile, order totals match their items, and
+    batch ``remaining_grams`` are what is left after FIFO-consuming the
+    grams of fulfilled orders. The stock ledger records those receipts and
+    consumptions plus reservations for paid orders, and ``Product.stock`` is
+    derived from the replayed balances.
+
+    Orders are generated and inserted one chunk at a time so memory stays
+    flat for hundreds of thousands of orders. ``progress`` is an optional
+    callable receiving short status strings.
+
+    Returns the created ``categories``, ``products`` and ``customers`` plus
+    the first ``order`` so callers can build URLs against real objects.
+    """
+    rng = random.Random(seed)
+    report = progress or (lambda message: None)
+    User = get_user_model()
+    now = timezone.now()
+    password = make_password(None)  # unusable, hashed once rather than per user
+    counts = {}
+
+    with transaction.atomic():
+        categories = Category.objects.bulk_create(
+            [
+                Category(
+                    name=f"Seed {seed} {name}", slug=slugify(f"seed-{seed}-{name}")
+                )
+                for name in ORIGINS
+            ]
+        )
+
+        product_rows = []
+        for i in range(products):
+            cost = _money(rng.uniform(4, 30))
+            markup = Decimal(rng.choice([20, 35, 50, 80]))
+            weight = rng.choice(WEIGHTS)
+            name = f"{rng.choice(ORIGINS)} Lot {seed}-{i:05d}"
+            product_rows.append(
+                Product(
+                    name=name,
+                    slug=slugify(f"{name}-{weight}"),
+                    sku=f"SEED-{seed}-{i:06d}",
+                    category=rng.choice(categories),
+                    roast_type=rng.choice(ROASTS),
+                    cost_price=cost,
+                    markup_percent=markup,
+                    # Product.save() is bypassed by bulk_create, so mirror its pricing.
+                    price=_money(cost * (1 + markup / 100)),
+                    weight_grams=weight,
+                    available_grinds=",".join(
+                        rng.sample(GRINDS, rng.randint(1, len(GRINDS)))
+                    ),
+                    stock=0,
+                    is_active=rng.random() > 0.05,
+                    description="Synthetic product for load testing.",
+                )
+            )
+        products_created = Product.objects.bulk_create(
+            product_rows, batch_size=chunk_size
+        )
+        counts["products"] = len(products_created)
+        # Prices in force since before the oldest seeded order.
+        counts["price_history"] = len(ProductPriceHistory.objects.bulk_create(
+            [
+                ProductPriceHistory(
+                    product=product,
+                    price=product.price,
+                    cost_price=product.cost_price,
+                    markup_percent=product.markup_percent,
+                    valid_from=now - timedelta(days=366),
+                )
+                for product in products_created
+            ],
+            batch_size=chunk_size,
+        ))
+
+        variant_rows = [
+            PackVariant(
+                product=product,
+                name=label,
+                sku=f"{product.sku}-{grams}",
+                pack_weight_grams=grams,
+                price=_money(product.price * grams / product.weight_grams),
+                markup_percent=product.markup_percent,
+            )
+            for product in products_created
+            for grams, label in PACK_SIZES
+        ]
+        counts["variants"] = len(
+            PackVariant.objects.bulk_create(variant_rows, batch_size=chunk_size)
+        )
+        report(f"{counts['products']} products, {counts['variants']} variants")
+
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f"seed-{seed}-customer-{i}",
+                    email=f"customer{i}.{seed}@seed.example",
+                    password=password,
+                )
+                for i in range(customers)
+            ],
+            batch_size=chunk_size,
+        )
+        # bulk_create skips the post_save signal that normally creates profiles.
+        Profile.objects.bulk_create(
+            [
+                Profile(
+                    user=user,
+                    full_name=f"Seed Customer {i}",
+                    email=user.email,
+                    street="Seedstraße",
+                    house_number=str(i % 200 + 1),
+                    postcode="70563",
+                    city="Stuttgart",
+                )
+                for i, user in enumerate(users)
+            ],
+            batch_size=chunk_size,
+        )
+        counts["customers"] = len(users)
+
+        # Receipts: every product gets at least one batch. Fulfilled orders
+        # below consume them oldest-first, chunk by chunk.
+        batches_by_product = {product.pk: [] for product in products_created}
+        for index in range(max(batches, len(products_created))):
+            product = (
+                products_created[index]
+                if index < len(products_created)
+                else rng.choice(products_created)
+            )
+            batches_by_product[product.pk].append(
+                [rng.randint(5, 60) * 1000, _money(rng.uniform(3, 25))]
+            )
+
+        batch_rows = []
+        received_start = now - timedelta(days=400)
+        for product in products_created:
+            for position, (quantity, unit_cost) in enumerate(
+                batches_by_product.pop(product.pk)
+            ):
+                batch_rows.append(
+                    ProductBatch(
+                        product=product,
+                        received_at=received_start
+                        + timedelta(days=position * 30, minutes=product.pk % 60),
+                        quantity_grams=quantity,
+                        remaining_grams=quantity,
+                        unit_cost=unit_cost,
+                        note="seed",
+                    )
+                )
+        batch_rows = _bulk_create_dated(
+            ProductBatch, batch_rows, "received_at", chunk_size
+        )
+        counts["batches"] = len(batch_rows)
+        fifo = {}  # product pk -> deque of its batches, oldest first
+        for batch in batch_rows:
+            fifo.setdefault(batch.product_id, deque()).append(batch)
+        report(f"{counts['batches']} batches")
+
+        counts["stock_movements"] = counts["order_item_costs"] = 0
+        first_order = None
+        counts["orders"] = counts["order_items"] = 0
+        for start in range(0, orders, chunk_size):
+            order_rows, item_specs = [], []
+            for i in range(start, min(start + chunk_size, orders)):
+                user = rng.choice(users) if users and rng.random() > 0.3 else None
+                status = rng.choice(ORDER_STATUSES)
+                lines = [
+                    (product, rng.randint(1, 4), rng.choice(GRINDS))
+                    for product in rng.sample(
+                        products_created, min(len(products_created), rng.randint(1, 3))
+                    )
+                ]
+                subtotal = sum(
+                    (_money(p.price * qty) for p, qty, _ in lines), Decimal("0.00")
+                )
+                shipping = (
+                    Decimal("0.00") if subtotal >= Decimal("39.00") else Decimal("4.90")
+                )
+                created_at = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+                order_rows.append(
+                    Order(
+                        user=user,
+                        full_name=f"Seed Customer {i}",
+                        email=user.email if user else f"guest{i}.{seed}@seed.example",
+                        street="Seedstraße",
+                        house_number=str(i % 200 + 1),
+                        city="Stuttgart",
+                        postal_code="70563",
+                        status=status,
+                        payment_intent_id=f"pi_seed_{seed}_{i:07d}",
+                        subtotal=subtotal,
+                        shipping=shipping,
+                        total=subtotal + shipping,
+                        created_at=created_at,
+                        fulfilled_at=(
+                            created_at + timedelta(days=2)
+                            if status == "fulfilled"
+                            else None
+                        ),
+                    )
+                )
+                item_specs.append(lines)
+
+            orders_created = _bulk_create_dated(
+                Order, order_rows, "created_at", chunk_size
+            )
+            first_order = first_order or orders_created[0]
+            items = OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=product,
+                    product_name_snapshot=product.name,
+                    unit_price=product.price,
+                    quantity=qty,
+                    grind=grind,
+                    weight_grams=product.weight_grams,
+                )
+                for order, lines in zip(orders_created, item_specs)
+                for product, qty, grind in lines
+            ], batch_size=chunk_size)
+            # Cost ledger: fulfilled lines take their grams from the batches
+            # FIFO, as fulfilment would have booked them.
+            cost_rows = [
+                row
+                for item in items
+                if item.order.status in CONSUMED_STATUSES
+                for row in _consume_fifo(
+                    fifo[item.product_id], item, item.quantity * item.weight_grams
+                )
+            ]
+            counts["order_item_costs"] += len(
+                OrderItemCost.objects.bulk_create(cost_rows, batch_size=chunk_size)
+            )
+            counts["stock_movements"] += len(
+                StockMovement.objects.bulk_create(
+                    [
+                        StockMovement(
+                            product=product,
+                            order=order,
+                            kind=StockMovement.RESERVATION,
+                            reserved_grams=qty * product.weight_grams,
+                            created_at=order.created_at,
+                        )
+                        for order, lines in zip(orders_created, item_specs)
+                        if order.status in RESERVED_ORDER_STATUSES
+                        for product, qty, _ in lines
+                    ],
+                    batch_size=chunk_size,
+                )
+            )
+            counts["orders"] += len(orders_created)
+            counts["order_items"] += len(items)
+            report(f"{counts['orders']}/{orders} orders")
+
+        # One UPDATE pass at the end, and only for batches orders drew from.
+        drawn = [
+            batch
+            for batch in batch_rows
+            if batch.remaining_grams < batch.quantity_grams
+        ]
+        ProductBatch.objects.bulk_update(
+            drawn, ["quantity_grams", "remaining_grams"], batch_size=chunk_size
+        )
+
+        # Ledger: receipts and FIFO consumption per batch plus reservations of
+        # paid orders; balances and Product.stock come from replaying it.
+        movements = []
+        for batch in batch_rows:
+            movements.append(StockMovement(
+                product=batch.product, batch=batch, kind=StockMovement.RECEIPT,
+                on_hand_grams=batch.quantity_grams, created_at=batch.received_at,
+            ))
+            if batch.remaining_grams < batch.quantity_grams:
+                movements.append(
+                    StockMovement(
+                        product=batch.product,
+                        batch=batch,
+                        kind=StockMovement.CONSUMPTION,
+                        on_hand_grams=batch.remaining_grams - batch.quantity_grams,
+                        created_at=now,
+                    )
+                )
+        counts["stock_movements"] += len(
+            StockMovement.objects.bulk_create(movements, batch_size=chunk_size)
+        )
+        rebuild_stock_balances([product.pk for product in products_created])
+        report(f"{counts['stock_movements']} stock movements")
+
+        review_rows = [
+            ProductReview(
+                product=rng.choice(products_created),
+                user=rng.choice(users),
+                rating=rng.randint(1, 5),
+                title="Seed review",
+                comment="Synthetic review text.",
+            )
+            for _ in range(reviews if users else 0)
+        ]
+        counts["reviews"] = len(
+            ProductReview.objects.bulk_create(review_rows, batch_size=chunk_size)
+        )
+
+    return {
+        "categories": categories,
+        "products": products_created,
+        "customers": users,
+        "order": first_order,
+        "counts": counts,
+    }
@@ -4,6 +4,12 @@ from email.utils import formataddr, parseaddr
 from decouple import config
 from dotenv import load_dotenv
 
+from versohnung_und_vergebung_kaffee.db import (
+    DEFAULT_SQLITE_PRAGMAS,
+    postgres_database,
+    sqlite_database,
+)
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")  # load .env into os.environ
 
@@ -16,6 +22,11 @@ ALLOWED_HOSTS = ["127.0.0.1", "localhost", "vv-kaffee-5b7b3eb05052.herokuapp.com
 STRIPE_PUBLISHABLE_KEY = config("STRIPE_PUBLISHABLE_KEY", default="")
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY", default="")
 STRIPE_WEBHOOK_SECRET = config("STRIPE_WEBHOOK_SECRET", default="")
+# Gateway used for every Stripe call (see orders/stripe_gateway.py).
+STRIPE_GATEWAY = config("STRIPE_GATEWAY", default="orders.stripe_gateway.StripeGateway")
+STRIPE_TIMEOUT = 20.0          # seconds per request (read)
+STRIPE_CONNECT_TIMEOUT = 5.0
+STRIPE_MAX_RETRIES = 2         # network errors / 409 / 5xx, with backoff
 
 SITE_URL = config("SITE_URL", default="http://127.0.0.1:8000")
 SITE_NAME = config("SITE_NAME", default="Versöhnung und Vergebung Kaffee")
@@ -29,6 +40,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.humanize",
+    "django.contrib.sitemaps",
     "django_extensions",
 
     "django.contrib.sites",        # required by allauth
@@ -40,6 +52,7 @@ INSTALLED_APPS = [
     "widget_tweaks",
 
     # project apps
+    "versohnung_und_vergebung_kaffee.apps.ProjectConfig",
     "products",
     "orders",
     "reviews",
@@ -53,17 +66,18 @@ SITE_ID = 1
 # ── Middleware ────────────────────────────────────────────────────────────────
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
-
+    "versohnung_und_vergebung_kaffee.middleware.static_files.AsyncWhiteNoiseMiddleware",
+    # per-request SQL/timing instrumentation; inert unless REQUEST_PROFILING=True
+    "versohnung_und_vergebung_kaffee.middleware.request_profiling.RequestProfilingMiddleware",  # noqa: E501
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "allauth.account.middleware.AccountMiddleware",  # keep after Auth
-
+    # read-your-writes for views routed to the read replica; needs the session
+    "versohnung_und_vergebung_kaffee.middleware.replica_pinning.ReplicaPinningMiddleware",  # noqa: E501
     # optional post-login middleware (only if you actually use it)
     "versohnung_und_vergebung_kaffee.middleware.fulfillment_redirect.FulfillmentPostLoginMiddleware",
-
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -93,23 +107,71 @@ TEMPLATES = [
 WSGI_APPLICATION = "versohnung_und_vergebung_kaffee.wsgi.application"
 
 # ── Database ──────────────────────────────────────────────────────────────────
+# Tuning lives in versohnung_und_vergebung_kaffee/db.py; SQLite PRAGMAs are
+# applied per connection by ProjectConfig.ready().
+SQLITE_BUSY_TIMEOUT_MS = config("SQLITE_BUSY_TIMEOUT_MS", default=20000, cast=int)
+SQLITE_PRAGMAS = {**DEFAULT_SQLITE_PRAGMAS, "busy_timeout": SQLITE_BUSY_TIMEOUT_MS}
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-        "OPTIONS": {"timeout": 20},
-    }
+    "default": sqlite_database(
+        BASE_DIR / "db.sqlite3", busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS
+    ),
 }
 
 DATABASE_URL = config("DATABASE_URL", default=None)
 if DATABASE_URL:
-    import dj_database_url
-    DATABASES["default"] = dj_database_url.config(
-        default=DATABASE_URL,
-        conn_max_age=600,
-        ssl_require=True,
+    # psycopg 3 pool per worker process; size it so workers x max_size stays
+    # under the plan's connection limit.
+    DATABASES["default"] = postgres_database(
+        DATABASE_URL,
+        pool_min_size=config("DB_POOL_MIN_SIZE", default=1, cast=int),
+        pool_max_size=config("DB_POOL_MAX_SIZE", default=4, cast=int),
+        pool_timeout=config("DB_POOL_TIMEOUT", default=10, cast=int),
     )
 
+# Optional read replica for the heavy read-only views (see routers.py). Its
+# tests mirror "default", because a replica is never migrated separately.
+REPLICA_DATABASE_URL = config("REPLICA_DATABASE_URL", default=None)
+if DATABASE_URL and REPLICA_DATABASE_URL:
+    DATABASES["replica"] = postgres_database(
+        REPLICA_DATABASE_URL,
+        pool_min_size=config("DB_POOL_MIN_SIZE", default=1, cast=int),
+        pool_max_size=config("DB_POOL_MAX_SIZE", default=4, cast=int),
+        pool_timeout=config("DB_POOL_TIMEOUT", default=10, cast=int),
+    )
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+DATABASE_ROUTERS = ["versohnung_und_vergebung_kaffee.routers.ReplicaRouter"]
+# How long a session that wrote keeps reading from the primary.
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=10, cast=int)
+
+# ── Cache ─────────────────────────────────────────────────────────────────────
+# Invalidation (guest order linking, availability, inventory totals, margins,
+# sitemap version) must reach every worker, so anything running more than one
+# process needs the shared Redis cache. The per-process memory cache is only
+# correct for a single process (runserver, tests).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "vv-kaffee",
+    }
+}
+REDIS_URL = config("REDIS_URL", default=None)
+if REDIS_URL:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "KEY_PREFIX": "vv-kaffee",
+    }
+    if REDIS_URL.startswith("rediss://"):
+        # Heroku Redis serves TLS with a self-signed certificate.
+        CACHES["default"]["OPTIONS"] = {"ssl_cert_reqs": None}
+GUEST_ORDER_LINK_CACHE_TIMEOUT = 60 * 60  # seconds
+INVENTORY_TOTALS_CACHE_TIMEOUT = 5 * 60  # seconds; product/batch saves also invalidate
+AVAILABILITY_CACHE_TIMEOUT = 5 * 60  # seconds; every stock movement also invalidates
+# seconds; saving or costing an order also invalidates its month
+MARGIN_CACHE_TIMEOUT = 60 * 60
+SITEMAP_CACHE_TIMEOUT = 6 * 60 * 60  # seconds; catalogue changes also invalidate
+SITEMAP_LIMIT = 5000  # URLs per sitemap page; more turns sitemap.xml into an index
+
 # ── Password validation ───────────────────────────────────────────────────────
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -170,6 +232,12 @@ ORDER_NOTIFICATION_EMAILS = config(
     default="",
     cast=lambda v: [e.strip() for e in v.split(",") if e.strip()],
 )
+# Low-stock alerts (products.alerts); empty falls back to ORDER_NOTIFICATION_EMAILS.
+LOW_STOCK_ALERT_EMAILS = config(
+    "LOW_STOCK_ALERT_EMAILS",
+    default="",
+    cast=lambda v: [e.strip() for e in v.split(",") if e.strip()],
+)
 
 # ── Auth / Allauth ────────────────────────────────────────────────────────────
 AUTHENTICATION_BACKENDS = [
@@ -207,6 +275,21 @@ LOGGING = {
 }
 
 
+# ── Request profiling ─────────────────────────────────────────────────────────
+# One JSON log line per request; Server-Timing headers and an overlay for staff.
+REQUEST_PROFILING = config("REQUEST_PROFILING", default=False, cast=bool)
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+# Shared directory for per-worker snapshots so /metrics sums all gunicorn
+# workers; empty keeps metrics per process.
+METRICS_DIR = config("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = 5.0
+# Networks that may scrape /metrics without a staff login.
+METRICS_ALLOWED_NETWORKS = config(
+    "METRICS_ALLOWED_NETWORKS",
+    default="127.0.0.1/32,::1/128",
+    cast=lambda v: [n.strip() for n in v.split(",") if n.strip()],
+)
 
 # ── Default PK type ───────────────────────────────────────────────────────────
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -2,6 +2,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
+from products import sitemaps
 from profiles import views as profile_views  # for post-login redirect
 from . import views as root_views
 
@@ -11,6 +12,7 @@ urlpatterns = [
 
     path("", TemplateView.as_view(template_name="home.html"), name="home"),
     path("testbed/", root_views.test_base, name="test_base"),
+    path("metrics", root_views.metrics, name="metrics"),
 
     path("shop/", include(("products.urls", "products"), namespace="products")),
     path("cart/", include(("cart.urls", "cart"), namespace="cart")),
@@ -33,12 +35,6 @@ urlpatterns = [
         ),
         name="robots_txt",
     ),
-    path(
-        "sitemap.xml",
-        TemplateView.as_view(
-            template_name="sitemap.xml",
-            content_type="application/xml"
-        ),
-        name="sitemap_xml",
-    ),
+    path("sitemap.xml", sitemaps.sitemap_xml, name="sitemap_xml"),
+    path("sitemap-<section>.xml", sitemaps.sitemap_section, name="sitemap_section"),
 ]
@@ -1,6 +1,11 @@
+import ipaddress
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect, render
 
+from .metrics import registry
 from .staff_mode import is_worker
 
 
@@ -46,3 +51,26 @@ def staff_admin_hub(request):
 def test_base(request):
     """Render the UI sandbox template for quick component testing."""
     return render(request, "test_base.html")
+
+
+def _is_internal_address(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        ip in ipaddress.ip_network(network, strict=False)
+        for network in getattr(settings, "METRICS_ALLOWED_NETWORKS", [])
+    )
+
+
+def metrics(request):
+    """Prometheus text exposition for staff users and internal scrapers."""
+    if not (
+        request.user.is_staff
+        or _is_internal_address(request.META.get("REMOTE_ADDR", ""))
+    ):
+        return HttpResponseForbidden("Forbidden")
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )